@@ -0,0 +1,645 @@
+"""An engine for the ``download`` and ``update`` commands that is
+built on asyncio (``--engine asyncio``).
+
+Metadata queries, downloads and requirement scans of all packages run
+as concurrent tasks in a single thread, each stage being limited by
+its own semaphore. Scanning archives is CPU-bound, so it is run in a
+pool of threads, as well as updates of the indexes of the repository.
+
+The standard library has no asynchronous HTTP client, hence the
+minimal one below. This module requires Python 3.5 or later and is
+only imported when the engine is selected.
+"""
+
+import asyncio
+import concurrent.futures
+import email.parser
+import os
+import ssl
+
+from basket.compat import HTTPError
+from basket.compat import urlparse
+from basket.compat import xmlrpclib
+from basket.http import MAX_REDIRECTIONS
+from basket.http import REDIRECTION_CODES
+from basket.main import IntegrityError
+from basket.main import MULTICALL_SIZE
+from basket.repository import normalize
+
+
+# Errors that we get when we reuse a connection that has been closed
+# by the server in the meantime.
+STALE_CONNECTION_ERRORS = (OSError, asyncio.IncompleteReadError)
+# Size of the chunks in which a whole response body is read.
+READ_SIZE = 65536
+
+
+class AsyncConnectionPool(object):
+    """Keep-alive connections, by host (see ``basket.http``).
+
+    At most ``size`` idle connections are kept for each host. More
+    connections are opened if needed by concurrent requests.
+    """
+
+    def __init__(self, size, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._ssl_context = None
+
+    async def _get_connection(self, scheme, host):
+        """Return a tuple ``(reader, writer, reused)``."""
+        idle = self._idle.get((scheme, host))
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        parts = urlparse.urlsplit('%s://%s' % (scheme, host))
+        port = parts.port or (scheme == 'https' and 443 or 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl_context),
+            self.timeout)
+        return reader, writer, False
+
+    def _release(self, scheme, host, reader, writer):
+        idle = self._idle.setdefault((scheme, host), [])
+        if len(idle) < self.size:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def open(self, url, headers=None, body=None, method='GET'):
+        """Send a request and return an ``AsyncResponse``.
+
+        Redirections are followed. An ``HTTPError`` is raised if the
+        server returns an error.
+        """
+        for _ in range(MAX_REDIRECTIONS + 1):
+            response = await self._request(method, url, headers or {}, body)
+            status = response.getcode()
+            if status in REDIRECTION_CODES:
+                location = response.info().get('Location')
+                await response.read()
+                response.close()
+                url = urlparse.urljoin(url, location)
+                if status == 303:
+                    method, body = 'GET', None
+                continue
+            if status >= 400:
+                response.close()
+                raise HTTPError(url, status, response.reason,
+                                response.info(), None)
+            return response
+        raise HTTPError(url, status, 'Too many redirections.',
+                        response.info(), None)
+
+    async def _request(self, method, url, headers, body):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: %s' % parts.netloc,
+                 'Accept-Encoding: identity']
+        for name, value in headers.items():
+            lines.append('%s: %s' % (name, value))
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if body is not None:
+            request += body
+        while True:
+            reader, writer, reused = await self._get_connection(
+                parts.scheme, parts.netloc)
+            try:
+                writer.write(request)
+                status_line = await asyncio.wait_for(reader.readline(),
+                                                     self.timeout)
+                if not status_line:
+                    raise ConnectionError('Connection closed by the server.')
+                header_lines = []
+                while True:
+                    line = await asyncio.wait_for(reader.readline(),
+                                                  self.timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    header_lines.append(line)
+            except STALE_CONNECTION_ERRORS:
+                writer.close()
+                if reused:
+                    continue  # try again with a new connection
+                raise
+            except:
+                writer.close()
+                raise
+            version, status, reason = (
+                status_line.decode('latin-1').rstrip('\r\n') + ' ').split(
+                ' ', 2)
+            headers = email.parser.Parser().parsestr(
+                b''.join(header_lines).decode('latin-1'), headersonly=True)
+            return AsyncResponse(self, parts.scheme, parts.netloc,
+                                 reader, writer, method, version,
+                                 int(status), reason.strip(), headers)
+
+    def close(self):
+        """Close all idle connections."""
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncResponse(object):
+    """An HTTP response whose body is read with ``await
+    response.read()``. The connection goes back to the pool when the
+    response is closed (if the whole response has been read).
+    """
+
+    def __init__(self, pool, scheme, host, reader, writer, method,
+                 version, status, reason, headers):
+        self._pool = pool
+        self._scheme = scheme
+        self._host = host
+        self._reader = reader
+        self._writer = writer
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._chunked = False
+        # Number of bytes left in the body (or in the current chunk),
+        # or ``None`` if the body ends when the connection is closed.
+        self._remaining = None
+        self.will_close = version == 'HTTP/1.0' or \
+            (headers.get('Connection') or '').lower() == 'close'
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            self._remaining = 0
+        elif (headers.get('Transfer-Encoding') or '').lower() == 'chunked':
+            self._chunked = True
+            self._remaining = 0
+        elif headers.get('Content-Length') is not None:
+            self._remaining = int(headers['Content-Length'])
+        else:
+            self.will_close = True
+        self._done = self._remaining == 0 and not self._chunked
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    async def _read_line(self):
+        return await asyncio.wait_for(self._reader.readline(),
+                                      self._pool.timeout)
+
+    async def _read_exactly(self, size):
+        return await asyncio.wait_for(self._reader.readexactly(size),
+                                      self._pool.timeout)
+
+    async def read(self, size=-1):
+        """Read and return at most ``size`` bytes of the body (or the
+        whole body if ``size`` is negative).
+        """
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = await self.read(READ_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if self._done or size == 0:
+            return b''
+        if self._remaining is None:
+            data = await asyncio.wait_for(self._reader.read(size),
+                                          self._pool.timeout)
+            self._done = not data
+            return data
+        if self._chunked and self._remaining == 0:
+            line = await self._read_line()
+            self._remaining = int(line.split(b';', 1)[0].strip(), 16)
+            if self._remaining == 0:
+                # Skip trailers.
+                while (await self._read_line()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self._done = True
+                return b''
+        data = await self._read_exactly(min(size, self._remaining))
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            if self._chunked:
+                await self._read_line()  # end of chunk
+            else:
+                self._done = True
+        return data
+
+    def close(self):
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        if self._done and not self.will_close:
+            self._pool._release(self._scheme, self._host, self._reader,
+                                writer)
+        else:
+            writer.close()
+
+
+class AsyncXMLRPCClient(object):
+    """A minimal XML-RPC client that uses an ``AsyncConnectionPool``."""
+
+    def __init__(self, pool, url):
+        self.pool = pool
+        self.url = url
+
+    async def call(self, method, *args):
+        body = xmlrpclib.dumps(args, method).encode('utf-8')
+        headers = {'Content-Type': 'text/xml',
+                   'User-Agent': xmlrpclib.Transport.user_agent}
+        try:
+            response = await self.pool.open(self.url, headers, body, 'POST')
+        except HTTPError as exc:
+            raise xmlrpclib.ProtocolError(
+                self.url, exc.code, exc.msg, dict(exc.hdrs or {}))
+        try:
+            data = await response.read()
+        finally:
+            response.close()
+        parser, unmarshaller = xmlrpclib.getparser()
+        parser.feed(data)
+        parser.close()
+        return unmarshaller.close()[0]
+
+    async def multicall(self, calls):
+        """Send ``calls`` (a list of ``(method, args)`` tuples) in a
+        single 'system.multicall' request and return an iterator over
+        their results (see ``xmlrpclib.MultiCall``).
+        """
+        results = await self.call(
+            'system.multicall',
+            [{'methodName': method, 'params': list(args)}
+             for method, args in calls])
+        return xmlrpclib.MultiCallIterator(results)
+
+
+class AsyncEngine(object):
+    """Resolve and download packages (and their requirements) with
+    asyncio tasks on behalf of a ``Basket``.
+
+    Messages are the same as with the default engine, but they are
+    printed in the order in which packages are processed (messages of
+    a package are printed together).
+    """
+
+    # Maximum number of concurrent metadata queries, downloads and
+    # requirement scans.
+    metadata_limit = int(os.environ.get('BASKET_METADATA_LIMIT', 50))
+    download_limit = int(os.environ.get('BASKET_DOWNLOAD_LIMIT', 10))
+    scan_limit = int(os.environ.get('BASKET_SCAN_LIMIT', 4))
+
+    def __init__(self, basket):
+        self.basket = basket
+        if basket.jobs > 1:
+            self.download_limit = basket.jobs
+
+    def run(self, packages):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(packages))
+        finally:
+            loop.close()
+
+    async def _run(self, packages):
+        self.loop = asyncio.get_event_loop()
+        self.http = AsyncConnectionPool(self.basket.pool_size)
+        self.client = AsyncXMLRPCClient(self.http, self.basket.endpoint)
+        # Other indexes than the XML-RPC API (see 'basket.index') are
+        # not asynchronous: they are queried in threads.
+        self.index = None
+        if self.basket.index_url:
+            self.index = self.basket.client
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            self.scan_limit)
+        self.metadata = asyncio.Semaphore(self.metadata_limit)
+        self.downloads = asyncio.Semaphore(self.download_limit)
+        self.scans = asyncio.Semaphore(self.scan_limit)
+        # Running metadata queries, so that concurrent tasks that need
+        # the same information share a single request.
+        self._pending = {}
+        resolved = set()
+        claimed = set()
+        tasks = set()
+
+        def enqueue(names):
+            for name in names:
+                if normalize(name) not in resolved:
+                    resolved.add(normalize(name))
+                    tasks.add(asyncio.ensure_future(
+                        self._process(name, claimed)))
+
+        try:
+            if len(packages) > 1:
+                await self._prefetch(packages)
+            enqueue(packages)
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    enqueue(task.result())
+            await self._download_all_resolved()
+        finally:
+            self.executor.shutdown()
+            self.http.close()
+        return 0
+
+    async def _process(self, package, claimed):
+        """Fetch ``package``, print its messages and return its
+        requirements.
+        """
+        try:
+            messages, requirements = await self._fetch(package, claimed)
+        except Exception as exc:
+            self.basket._print_messages(self.basket._failed(
+                'Could not download "%s": %s' % (package, exc)))
+            return ()
+        if len(requirements) > 1:
+            try:
+                await self._prefetch(requirements)
+            except Exception:
+                pass  # requirements are looked up one by one
+        self.basket._print_messages(messages)
+        return requirements
+
+    async def _call(self, method, *args):
+        async with self.metadata:
+            if self.index is not None:
+                return await self.loop.run_in_executor(
+                    None, getattr(self.index, method), *args)
+            return await self.client.call(method, *args)
+
+    async def _call_many(self, calls):
+        """Send XML-RPC ``calls`` and return the list of their results
+        (see ``Basket._call_many()``).
+        """
+        basket = self.basket
+        results = [None] * len(calls)
+        retry = []
+        for start in range(0, len(calls), MULTICALL_SIZE):
+            batch = calls[start:start + MULTICALL_SIZE]
+            batch_results = None
+            if basket._multicall_supported:
+                try:
+                    async with self.metadata:
+                        batch_results = await self.client.multicall(batch)
+                except (xmlrpclib.Fault, xmlrpclib.ProtocolError):
+                    basket._multicall_supported = False
+            for i in range(len(batch)):
+                if batch_results is not None:
+                    try:
+                        results[start + i] = batch_results[i]
+                        continue
+                    except xmlrpclib.Fault:
+                        pass
+                retry.append(start + i)
+        retried = await asyncio.gather(
+            *[self._call(*((calls[i][0], ) + tuple(calls[i][1])))
+              for i in retry])
+        for i, result in zip(retry, retried):
+            results[i] = result
+        return results
+
+    def _shared(self, key, make):
+        """Return a future for ``make()``, shared by all tasks that
+        ask for the same ``key`` while it is running.
+        """
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(make())
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        return future
+
+    async def _search(self, package):
+        """Make sure that the result of the search for ``package`` is
+        known, so that ``Basket._find_package_name()`` does not query
+        the server.
+        """
+        basket = self.basket
+        query = normalize(package)
+        if basket._get_known_search(query) is not None:
+            return
+
+        async def search():
+            with basket.tracer.span('search', query) as span:
+                span.cache = 'miss'
+                result = await self._call('search', {'name': query})
+            basket._remember_search(query, result)
+
+        await self._shared(('search', query), search)
+
+    async def _get_release_urls(self, package, version):
+        """Make sure that the files of the given release are known, so
+        that ``Basket._find_package_file()`` does not query the
+        server.
+        """
+        basket = self.basket
+        key = (package, version)
+        if basket._get_known_release_urls(key) is not None:
+            return
+
+        async def release_urls():
+            with basket.tracer.span('release_urls',
+                                    normalize(package)) as span:
+                span.cache = 'miss'
+                result = await self._call('release_urls', package, version)
+            basket._remember_release_urls(key, result)
+
+        await self._shared(('release_urls', key), release_urls)
+
+    async def _prefetch(self, packages):
+        """Fetch information about all ``packages`` with as few
+        requests as possible (see ``Basket._prefetch()``).
+        """
+        basket = self.basket
+        queries = [query for query in basket._get_unknown_queries(packages)
+                   if ('search', query) not in self._pending]
+        calls = [('search', ({'name': query}, )) for query in queries]
+        for query, result in zip(queries, await self._call_many(calls)):
+            basket._remember_search(query, result)
+        # Wait for searches that have been sent by other tasks.
+        await asyncio.gather(*[self._search(package)
+                               for package in packages])
+        releases = [key for key in basket._get_unknown_releases(packages)
+                    if ('release_urls', key) not in self._pending]
+        calls = [('release_urls', key) for key in releases]
+        for key, result in zip(releases, await self._call_many(calls)):
+            basket._remember_release_urls(key, result)
+
+    async def _fetch(self, package, claimed):
+        """Resolve ``package``, download it if we do not have its
+        latest version and return a tuple ``(messages, requirements)``
+        (see ``Basket._fetch()``).
+        """
+        basket = self.basket
+        await self._search(package)
+        info = basket._find_package_name(package)
+        if info is None:
+            return [(True, 'Could not find any package named '
+                     '"%s".' % package)], ()
+        key = (info['name'], info['version'])
+        with basket._lock:
+            up_to_date = basket._has_package(*key) or key in claimed
+        claimed.add(key)
+        if up_to_date:
+            return [(False, '%(name)s is already up to date '
+                     '(%(version)s).' % info)], ()
+        await self._get_release_urls(*key)
+        release = basket._find_package_file(*key)
+        if release is None:
+            claimed.discard(key)
+            return [(True, 'Could not find a suitable distribution for '
+                     '%(name)s %(version)s.' % info)], ()
+        requirements = await self._get_requirements_from_metadata(release)
+        if requirements is not None:
+            # Download the file later, with all others.
+            basket._resolved.append((info, release, requirements))
+            return [], requirements
+        try:
+            path = await self._download(info['name'], info['version'],
+                                        release['url'],
+                                        basket._get_digests(release))
+        except IntegrityError as exc:
+            claimed.discard(key)
+            return basket._failed(str(exc)), ()
+        async with self.scans:
+            requirements = await self.loop.run_in_executor(
+                self.executor, basket._find_requirements, path)
+        basket._record_dependencies(info['name'], info['version'],
+                                    requirements)
+        return basket._get_added_messages(info, requirements), requirements
+
+    async def _get_requirements_from_metadata(self, release):
+        """See ``Basket._get_requirements_from_metadata()``."""
+        basket = self.basket
+        if not release.get('metadata'):
+            return None
+        url = release['url'] + '.metadata'
+        cache_key = 'requires:%s' % url
+        requirements = basket._get_from_cache(cache_key)
+        if requirements is not None:
+            return requirements
+        if url.startswith('file:'):
+            return await self.loop.run_in_executor(
+                self.executor, basket._get_requirements_from_metadata,
+                release)
+        try:
+            async with self.metadata:
+                response = await self.http.open(url)
+                try:
+                    data = await response.read()
+                finally:
+                    response.close()
+        except (HTTPError, IOError):
+            return None
+        requirements = basket._read_metadata_file(release, data)
+        if requirements is not None and basket.cache is not None:
+            basket.cache.set(basket._get_cache_key(cache_key), requirements)
+        return requirements
+
+    async def _download_all_resolved(self):
+        """Download all distributions whose requirements have been
+        read from their metadata file (see
+        ``Basket._download_all_resolved()``).
+        """
+        basket = self.basket
+        resolved, basket._resolved = basket._resolved, []
+
+        async def download(info, release, requirements):
+            try:
+                path = await self._download(info['name'], info['version'],
+                                            release['url'],
+                                            basket._get_digests(release))
+            except IntegrityError as exc:
+                messages = basket._failed(str(exc))
+            except Exception as exc:
+                messages = basket._failed('Could not download "%s": %s' % (
+                    info['name'], exc))
+            else:
+                await self.loop.run_in_executor(
+                    self.executor, basket._remember_requirements, path,
+                    requirements)
+                basket._record_dependencies(info['name'], info['version'],
+                                            requirements)
+                messages = basket._get_added_messages(info, requirements)
+            basket._print_messages(messages)
+
+        await asyncio.gather(*[download(*item) for item in resolved])
+
+    async def _download(self, package, version, url, digests):
+        basket = self.basket
+        filename = url[url.rfind('/') + 1:]
+        path = basket._get_download_path(package, filename)
+        async with self.downloads:
+            with basket.tracer.span('download', normalize(package)) as span:
+                sha256 = await self._retrieve(url, path, digests)
+                if basket.tracer.enabled:
+                    span.bytes = basket.os.path.getsize(path)
+        with basket.tracer.span('register', normalize(package)):
+            await self.loop.run_in_executor(
+                self.executor, basket._register, package, version, filename,
+                sha256)
+        return path
+
+    async def _retrieve(self, url, path, digests=None):
+        """Download the file at ``url``, store it at ``path`` and
+        return its SHA-256 digest (see ``Basket._retrieve()``).
+        """
+        basket = self.basket
+        if url.startswith('file:'):
+            return await self.loop.run_in_executor(
+                None, basket._retrieve, url, path, digests)
+        digests = digests or {}
+        hashes = basket._new_hashes(digests)
+        tmp_path = basket._get_partial_path(path)
+        try:
+            offset = basket.os.path.getsize(tmp_path)
+        except OSError:
+            offset = 0
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        try:
+            response = await self.http.open(url, headers)
+        except HTTPError as exc:
+            if exc.code != 416:  # Requested Range Not Satisfiable
+                raise
+            basket.os.remove(tmp_path)
+            return await self._retrieve(url, path, digests)
+        try:
+            if offset and response.getcode() != 206:  # Partial Content
+                offset = 0
+            if offset:
+                basket._hash_file(tmp_path, hashes)
+            expected = response.info().get('Content-Length')
+            received = 0
+            with open(tmp_path, offset and 'ab' or 'wb') as fp:
+                while True:
+                    chunk = await response.read(basket.chunk_size)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    for h in hashes.values():
+                        h.update(chunk)
+                    received += len(chunk)
+        finally:
+            response.close()
+        return basket._check_retrieved(url, path, tmp_path, hashes,
+                                       digests, expected, received)
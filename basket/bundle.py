@@ -0,0 +1,93 @@
+"""Bundles: a single archive with distributions of a repository, to
+move them to another repository (e.g. on a machine that is not
+connected to the network), see ``Basket.cmd_bundle()`` and
+``Basket.cmd_unbundle()``.
+
+A bundle is a TAR archive. Its first member is a JSON manifest
+(``BUNDLE.json``) with the identifier of the bundle, the identifier of
+the bundle it has been made since (if any) and the name, version,
+SHA-256 digest and requirements of each distribution. Distributions
+follow in a ``files/`` directory, so that a bundle can be read as a
+stream. Distributions are already compressed: the bundle itself is
+only compressed on request.
+"""
+
+import binascii
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+
+from basket.compat import text
+from basket.repository import replace
+
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = 'BUNDLE.json'
+FILES_DIR = 'files'
+
+
+def new_bundle_id():
+    """Return a new bundle identifier: the current (UTC) time and a
+    random suffix, so that identifiers sort by date.
+    """
+    suffix = binascii.hexlify(os.urandom(3)).decode('ascii')
+    return '%s-%s' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime()), suffix)
+
+
+def write_bundle(path, manifest, files, compress=False):
+    """Atomically write a bundle at ``path`` with the given
+    ``manifest`` (a dictionary) and ``files`` (a list of ``(filename,
+    path)`` tuples). The bundle is compressed with gzip if
+    ``compress`` is true.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(
+            os.path.abspath(path)))
+    os.close(fd)
+    try:
+        with tarfile.open(tmp_path, compress and 'w:gz' or 'w') as archive:
+            data = json.dumps(manifest, indent=2,
+                              sort_keys=True).encode('utf-8')
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            archive.addfile(info, io.BytesIO(data))
+            for filename, file_path in files:
+                archive.add(file_path, '%s/%s' % (FILES_DIR, filename))
+        os.chmod(tmp_path, 0o644)
+        replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def read_bundle(path):
+    """Read the bundle at ``path`` as a stream: yield its manifest,
+    then a ``(filename, size, fileobj)`` tuple for each distribution.
+    ``fileobj`` can only be read until the next item is requested.
+
+    A ``ValueError`` is raised if the file is not a bundle. Members
+    that are not regular files of the ``files/`` directory are
+    ignored.
+    """
+    with tarfile.open(path, 'r|*') as archive:
+        manifest = None
+        for info in archive:
+            if manifest is None:
+                if info.name != MANIFEST_NAME:
+                    raise ValueError('"%s" is not a bundle.' % path)
+                manifest = json.loads(text(archive.extractfile(info).read()))
+                if manifest.get('format') != BUNDLE_FORMAT:
+                    raise ValueError('Unsupported bundle format.')
+                yield manifest
+                continue
+            parts = info.name.split('/')
+            if not info.isfile() or len(parts) != 2 or \
+                    parts[0] != FILES_DIR or parts[1].startswith('.'):
+                continue
+            yield parts[1], info.size, archive.extractfile(info)
+        if manifest is None:
+            raise ValueError('"%s" is not a bundle.' % path)
@@ -0,0 +1,160 @@
+"""A persistent cache of the metadata returned by the package index.
+
+Entries are JSON-serializable values stored in a SQLite database. Each
+entry may have an expiration date. When the cache grows larger than
+its maximum size, least recently used entries are evicted.
+
+Access times are kept in memory and written in a single transaction
+(see ``MetadataCache.flush()``), so that reading the cache does not
+write to the database each time.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+)'''
+
+
+class MetadataCache(object):
+
+    # Current time, defined here so that we can mock it in our tests.
+    time = staticmethod(time.time)
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # The connection is shared by all threads but only used while
+        # holding the lock.
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(SCHEMA)
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        # Access times that have not been written yet, keyed by key.
+        self._accessed = {}
+
+    def get(self, key):
+        """Return the value stored for ``key``, or ``None`` if there
+        is none or if it has expired.
+        """
+        now = self.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, expires FROM entries WHERE key = ?',
+                (key, )).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < now:
+                return None
+            self._accessed[key] = now
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` for ``key``. If ``ttl`` is ``None``, the
+        entry never expires (but it may still be evicted).
+        """
+        now = self.time()
+        value = json.dumps(value)
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            with self._db:
+                self._write_accessed()
+                row = self._db.execute(
+                    'SELECT size FROM entries WHERE key = ?',
+                    (key, )).fetchone()
+                if row is not None:
+                    self._size -= row[0]
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    '(key, value, expires, accessed, size) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, value, expires, now, len(value)))
+                self._size += len(value)
+                if self._size > self.max_size:
+                    self._evict(now)
+
+    def delete(self, keys):
+        """Remove entries of the given ``keys`` (if any)."""
+        with self._lock:
+            with self._db:
+                for key in keys:
+                    self._accessed.pop(key, None)
+                    row = self._db.execute(
+                        'SELECT size FROM entries WHERE key = ?',
+                        (key, )).fetchone()
+                    if row is not None:
+                        self._size -= row[0]
+                        self._db.execute(
+                            'DELETE FROM entries WHERE key = ?', (key, ))
+
+    def _write_accessed(self):
+        """Write access times that are kept in memory. The lock must
+        be held, in a transaction.
+        """
+        if self._accessed:
+            self._db.executemany(
+                'UPDATE entries SET accessed = ? WHERE key = ?',
+                [(accessed, key)
+                 for key, accessed in self._accessed.items()])
+            self._accessed = {}
+
+    def flush(self):
+        """Write access times of the entries that have been read."""
+        with self._lock:
+            with self._db:
+                self._write_accessed()
+
+    def _evict(self, now):
+        """Remove expired entries, then least recently used ones until
+        the cache is back to 90% of its maximum size.
+        """
+        self._db.execute('DELETE FROM entries WHERE expires < ?', (now, ))
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        target = self.max_size * 0.9
+        if self._size <= target:
+            return
+        cursor = self._db.execute(
+            'SELECT key, size FROM entries ORDER BY accessed')
+        evicted = []
+        for key, size in cursor:
+            if self._size <= target:
+                break
+            evicted.append((key, ))
+            self._size -= size
+        self._db.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+    def stats(self):
+        """Return a dictionary with the number of entries, the number
+        of expired entries and the size of the cache.
+        """
+        with self._lock:
+            entries, expired = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(expires < ?), 0) '
+                'FROM entries', (self.time(), )).fetchone()
+        return {'entries': entries, 'expired': expired, 'size': self._size}
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._accessed = {}
+            with self._db:
+                self._db.execute('DELETE FROM entries')
+            self._db.execute('VACUUM')
+            self._size = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -2,10 +2,32 @@
 
 import sys
 try:
-    from urllib import request as urllib
-except:
+    from http import client as httplib
+    from urllib import parse as urlparse
+    from urllib.error import HTTPError
+    from urllib.parse import quote
+    from urllib.parse import unquote
+    from urllib.request import pathname2url
+    from urllib.request import url2pathname
+except:  # pragma: no cover
+    # Python 2
+    import httplib
+    import urlparse
+    from urllib import pathname2url
+    from urllib import quote
+    from urllib import unquote
+    from urllib import url2pathname
+    from urllib2 import HTTPError
+try:
+    from html.parser import HTMLParser
+except:  # pragma: no cover
+    # Python 2
+    from HTMLParser import HTMLParser
+try:
+    import queue as Queue
+except:  # pragma: no cover
     # Python 2
-    import urllib
+    import Queue
 try:
     import xmlrpclib
 except:  # pragma: no cover
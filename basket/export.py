@@ -0,0 +1,66 @@
+"""Populate another directory with files of the repository without
+copying them when possible (see ``Basket.cmd_export()``).
+
+Archives of the repository are never modified, so a hard link is as
+good as a copy. If hard links are not possible (e.g. on another
+volume, or if the file system does not support them), we try to clone
+the file (a "reflink": the data is shared until one of the files is
+modified), which is supported by Btrfs, XFS and others on Linux. As a
+last resort, the file is copied.
+"""
+
+import errno
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows
+    fcntl = None
+
+
+# From <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """Clone ``source`` at ``destination``. Raise an ``OSError`` (or
+    an ``IOError``) if the file system does not support it.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported.')
+    with open(source, 'rb') as src:
+        try:
+            with open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except:
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
+    shutil.copystat(source, destination)
+
+
+def link_or_copy(source, destination):
+    """Make ``destination`` a hard link to ``source``, or a clone of
+    it, or a copy of it (whichever works first) and return either
+    'hardlink', 'reflink' or 'copy'.
+
+    The modification time of ``source`` is kept in all cases, so that
+    indexes of the repository (see ``basket.repository.ArchiveIndex``)
+    can be copied as well. ``destination`` must not exist.
+    """
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except (AttributeError, OSError):
+        # 'os.link()' is not available on Windows with Python 2.
+        pass
+    try:
+        reflink(source, destination)
+        return 'reflink'
+    except (IOError, OSError):
+        pass
+    shutil.copy2(source, destination)
+    return 'copy'
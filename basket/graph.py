@@ -0,0 +1,125 @@
+"""The dependency graph of downloaded packages.
+
+The graph is recorded while packages are downloaded and stored in the
+repository, so that ``basket graph`` works without any network
+access. Nodes are keyed by normalized project name (see
+``basket.repository.normalize()``).
+"""
+
+import collections
+import json
+
+from basket.repository import write_json
+from basket.repository import normalize
+
+
+GRAPH_FORMAT = 1
+
+Node = collections.namedtuple('Node', ('name', 'version', 'requires'))
+
+
+class DependencyGraph(object):
+    """Requirements of the latest downloaded version of each package.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._nodes = {}
+        self._modified = False
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('format') == GRAPH_FORMAT:
+            for key, (name, version, requires) in data['nodes'].items():
+                self._nodes[key] = Node(name, version, requires)
+
+    def __contains__(self, name):
+        return normalize(name) in self._nodes
+
+    def get(self, name):
+        """Return the ``Node`` of the package ``name`` (which does not
+        need to be normalized), or ``None`` if it is not known.
+        """
+        return self._nodes.get(normalize(name))
+
+    def add(self, name, version, requirements):
+        """Record that the given ``version`` of the package ``name``
+        requires ``requirements`` (a list of package names).
+        """
+        requires = []
+        for requirement in requirements:
+            requirement = normalize(requirement)
+            if requirement not in requires:
+                requires.append(requirement)
+        node = Node(name, version, requires)
+        key = normalize(name)
+        if self._nodes.get(key) != node:
+            self._nodes[key] = node
+            self._modified = True
+
+    def closure(self, names):
+        """Return the normalized names of the packages ``names`` and
+        all of their (direct and indirect) requirements, in
+        breadth-first order.
+        """
+        seen = set()
+        result = []
+        queue = collections.deque(normalize(name) for name in names)
+        while queue:
+            name = queue.popleft()
+            if name in seen:
+                continue
+            seen.add(name)
+            result.append(name)
+            node = self._nodes.get(name)
+            if node is not None:
+                queue.extend(node.requires)
+        return result
+
+    def save(self):
+        """Write the graph if it has been modified."""
+        if not self._modified:
+            return
+        nodes = dict((key, list(node)) for key, node in self._nodes.items())
+        write_json(self.path, {'format': GRAPH_FORMAT, 'nodes': nodes})
+        self._modified = False
+
+    def to_dot(self, names):
+        """Return the subgraph of ``names`` (normalized names, see
+        ``closure()``) in the DOT language of Graphviz. Packages that
+        are not known are drawn with a dashed border.
+        """
+        lines = ['digraph dependencies {']
+        for name in names:
+            node = self._nodes.get(name)
+            if node is None:
+                lines.append('    %s [style=dashed];' % _quote(name))
+                continue
+            lines.append('    %s [label=%s];' % (
+                    _quote(name), _quote('%s %s' % (node.name, node.version))))
+            for requirement in node.requires:
+                lines.append('    %s -> %s;' % (
+                        _quote(name), _quote(requirement)))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def to_json(self, names):
+        """Return the subgraph of ``names`` (normalized names, see
+        ``closure()``) as a JSON object. Packages that are not known
+        are ``null``.
+        """
+        data = {}
+        for name in names:
+            node = self._nodes.get(name)
+            if node is not None:
+                node = {'name': node.name,
+                        'version': node.version,
+                        'requires': node.requires}
+            data[name] = node
+        return json.dumps(data, indent=2, sort_keys=True)
+
+
+def _quote(identifier):
+    return '"%s"' % identifier.replace('\\', '\\\\').replace('"', '\\"')
@@ -0,0 +1,234 @@
+"""A minimal pool of keep-alive HTTP connections, shared by the
+downloader and the XML-RPC client, so that we do not open a new
+TCP (and TLS) connection for each request.
+"""
+
+import os
+import socket
+import threading
+
+from basket.compat import HTTPError
+from basket.compat import httplib
+from basket.compat import url2pathname
+from basket.compat import urlparse
+from basket.compat import xmlrpclib
+
+
+MAX_REDIRECTIONS = 5
+REDIRECTION_CODES = (301, 302, 303, 307, 308)
+# Errors that we get when we reuse a connection that has been closed
+# by the server in the meantime.
+STALE_CONNECTION_ERRORS = (httplib.BadStatusLine, socket.error)
+
+
+class ConnectionPool(object):
+    """Keep-alive connections, by host.
+
+    At most ``size`` idle connections are kept for each host. More
+    connections may be opened if needed by concurrent requests: they
+    are closed once they have been used.
+    """
+
+    def __init__(self, size, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get_connection(self, scheme, host):
+        """Return a tuple ``(connection, reused)``."""
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            factory = httplib.HTTPSConnection
+        else:
+            factory = httplib.HTTPConnection
+        return factory(host, timeout=self.timeout), False
+
+    def _release(self, scheme, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def open(self, url, headers=None, body=None, method='GET'):
+        """Send a request and return a ``PooledResponse``.
+
+        Redirections are followed. An ``HTTPError`` is raised if the
+        server returns an error.
+
+        ``file:`` URLs are supported as well (see ``open_file()``).
+        """
+        if url.startswith('file:'):
+            return open_file(url)
+        for _ in range(MAX_REDIRECTIONS + 1):
+            response = self._request(method, url, headers or {}, body)
+            status = response.getcode()
+            if status in REDIRECTION_CODES:
+                location = response.info().get('Location')
+                response.close()
+                url = urlparse.urljoin(url, location)
+                if status == 303:
+                    method, body = 'GET', None
+                continue
+            if status >= 400:
+                response.close()
+                raise HTTPError(url, status, response.reason,
+                                response.info(), None)
+            return response
+        raise HTTPError(url, status, 'Too many redirections.',
+                        response.info(), None)
+
+    def _request(self, method, url, headers, body):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            connection, reused = self._get_connection(
+                parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    continue  # try again with a new connection
+                raise
+            except:
+                connection.close()
+                raise
+            return PooledResponse(self, parts.scheme, parts.netloc,
+                                  connection, response)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+
+class PooledResponse(object):
+    """A wrapper around an HTTP response that gives the connection
+    back to the pool when the response is closed (if the whole
+    response has been read).
+    """
+
+    def __init__(self, pool, scheme, host, connection, response):
+        self._pool = pool
+        self._scheme = scheme
+        self._host = host
+        self._connection = connection
+        self._response = response
+        self.reason = response.reason
+
+    def getcode(self):
+        return self._response.status
+
+    def info(self):
+        return self._response.msg
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=None):
+        if size is None:
+            return self._response.read()
+        return self._response.read(size)
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        if reusable:
+            self._pool._release(self._scheme, self._host, connection)
+        else:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_file(url):
+    """Return a ``FileResponse`` for a ``file:`` URL. The
+    ``index.html`` file of a directory is returned, like a web server
+    would do. A 404 ``HTTPError`` is raised if there is no such file.
+    """
+    path = url2pathname(urlparse.urlsplit(url).path)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.html')
+    try:
+        fp = open(path, 'rb')
+    except (IOError, OSError):
+        raise HTTPError(url, 404, 'Not Found', {}, None)
+    return FileResponse(fp, os.fstat(fp.fileno()).st_size)
+
+
+class FileResponse(object):
+    """A local file that looks like a ``PooledResponse``."""
+
+    reason = 'OK'
+
+    def __init__(self, fp, size):
+        self._fp = fp
+        self._headers = {'Content-Length': str(size)}
+
+    def getcode(self):
+        return 200
+
+    def info(self):
+        return self._headers
+
+    def getheader(self, name, default=None):
+        return self._headers.get(name, default)
+
+    def read(self, size=None):
+        if size is None:
+            return self._fp.read()
+        return self._fp.read(size)
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledTransport(xmlrpclib.Transport):
+    """An XML-RPC transport that uses a ``ConnectionPool``.
+
+    Unlike the default transport, it can be used by concurrent
+    threads.
+    """
+
+    def __init__(self, pool, scheme):
+        xmlrpclib.Transport.__init__(self)
+        self.pool = pool
+        self.scheme = scheme
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.verbose = verbose
+        url = '%s://%s%s' % (self.scheme, host, handler)
+        headers = {'Content-Type': 'text/xml',
+                   'User-Agent': self.user_agent}
+        try:
+            response = self.pool.open(url, headers, request_body, 'POST')
+        except HTTPError as exc:
+            raise xmlrpclib.ProtocolError(
+                url, exc.code, exc.msg, dict(exc.hdrs or {}))
+        with response:
+            return self.parse_response(response)
@@ -0,0 +1,320 @@
+"""Package indexes other than the XML-RPC API of PyPI (see
+``Basket.index_url``).
+
+They provide the ``search()`` and ``release_urls()`` methods of the
+XML-RPC API, so that they can be used instead of it. Unlike the
+XML-RPC API, a single request (for the page of the project) answers
+both calls.
+
+- ``SimpleIndex`` is a client of the "simple" repository API (PEP 691
+  JSON pages, or PEP 503 HTML pages), e.g. ``https://pypi.org/simple/``,
+  a mirror or ``basket serve``. Pages are stored in the metadata cache
+  and revalidated with their ETag.
+
+- ``LocalIndex`` is a local directory: either a tree of PEP 503 pages
+  (e.g. the ``simple/`` directory of another repository) or a flat
+  directory of distributions (e.g. another repository).
+"""
+
+import json
+import os
+import re
+
+from basket.compat import HTMLParser
+from basket.compat import HTTPError
+from basket.compat import pathname2url
+from basket.compat import unquote
+from basket.compat import url2pathname
+from basket.compat import urlparse
+from basket.repository import normalize
+
+
+JSON_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+ACCEPT = ('application/vnd.pypi.simple.v1+json, '
+          'application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.1')
+SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tgz', '.zip')
+
+VERSION_REGEXP = re.compile(
+    r'^v?(?:(\d+)!)?(\d+(?:\.\d+)*)'
+    r'(?:[-_.]?(a|alpha|b|beta|c|rc|pre|preview)[-_.]?(\d*))?'
+    r'(?:-(\d+)|[-_.]?(?:post|rev|r)[-_.]?(\d*))?'
+    r'(?:[-_.]?dev[-_.]?(\d*))?'
+    r'(?:\+[a-z0-9._-]*)?$')
+PRE_RELEASE_ORDER = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1}
+
+
+def version_key(version):
+    """Return a key to sort versions (as defined by PEP 440, mostly).
+    Versions that cannot be parsed sort before all others.
+    """
+    match = VERSION_REGEXP.match(version.strip().lower())
+    if match is None:
+        return (0, )
+    epoch, release, pre, pre_number, post_number, post_number2, dev = \
+        match.groups()
+    release = [int(part) for part in release.split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    if pre:
+        pre_key = (0, PRE_RELEASE_ORDER.get(pre, 2), int(pre_number or 0))
+    elif dev is not None and post_number is None and post_number2 is None:
+        pre_key = (-1, )  # '1.0.dev1' comes before '1.0a1'
+    else:
+        pre_key = (1, )
+    if post_number is not None:
+        post_key = int(post_number) + 1
+    elif post_number2 is not None:
+        post_key = int(post_number2 or 0) + 1
+    else:
+        post_key = 0
+    if dev is not None:
+        dev_key = (0, int(dev or 0))
+    else:
+        dev_key = (1, )
+    return (1, int(epoch or 0), tuple(release), pre_key, post_key, dev_key)
+
+
+def is_prerelease(version):
+    match = VERSION_REGEXP.match(version.strip().lower())
+    return match is not None and \
+        (match.group(3) is not None or match.group(7) is not None)
+
+
+def get_latest_version(versions):
+    """Return the latest of ``versions``. Pre-releases are ignored,
+    unless there are only pre-releases.
+    """
+    final = [version for version in versions if not is_prerelease(version)]
+    return max(final or versions, key=version_key)
+
+
+def split_filename(filename):
+    """Return a dictionary with the name, the version, the type of
+    package and the Python version of a distribution (as returned by
+    the 'release_urls' XML-RPC method), or ``None`` if ``filename`` is
+    not a source distribution or a wheel.
+    """
+    if filename.endswith('.whl'):
+        parts = filename[:-4].split('-')
+        if len(parts) not in (5, 6):
+            return None
+        return {'name': parts[0], 'version': parts[1],
+                'packagetype': 'bdist_wheel', 'python_version': parts[-3]}
+    for extension in SDIST_EXTENSIONS:
+        if filename.endswith(extension):
+            base = filename[:-len(extension)]
+            if '-' not in base:
+                return None
+            name, version = base.rsplit('-', 1)
+            return {'name': name, 'version': version,
+                    'packagetype': 'sdist', 'python_version': 'source'}
+    return None
+
+
+class _LinkParser(HTMLParser):
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.links.append(dict(attrs))
+
+
+def _parse_metadata_attribute(value):
+    """Parse the value of a 'data-core-metadata' attribute (PEP 658 and
+    PEP 714): either 'true' or a hash.
+    """
+    if value is None:
+        return False
+    if '=' in value:
+        algorithm, digest = value.split('=', 1)
+        return {algorithm: digest}
+    return True
+
+
+def parse_project_page(url, body, content_type):
+    """Return the list of files of the project page at ``url``.
+
+    Each file is a dictionary with the 'filename', the (absolute)
+    'url', the 'hashes' of the file, whether it is 'yanked' and the
+    'metadata' of the file (``False`` if there is no separate
+    metadata file, ``True`` or its hashes otherwise, see PEP 658).
+    """
+    files = []
+    if content_type.split(';')[0].strip() == JSON_CONTENT_TYPE:
+        data = json.loads(body.decode('utf-8'))
+        for info in data.get('files', ()):
+            metadata = info.get('core-metadata',
+                                info.get('dist-info-metadata', False))
+            files.append({'filename': info['filename'],
+                          'url': urlparse.urljoin(url, info['url']),
+                          'hashes': info.get('hashes') or {},
+                          'yanked': bool(info.get('yanked')),
+                          'metadata': metadata})
+        return files
+    parser = _LinkParser()
+    parser.feed(body.decode('utf-8', 'replace'))
+    parser.close()
+    for attrs in parser.links:
+        if not attrs.get('href'):
+            continue
+        href, _, fragment = urlparse.urljoin(url, attrs['href']).partition('#')
+        hashes = {}
+        if '=' in fragment:
+            algorithm, digest = fragment.split('=', 1)
+            hashes[algorithm] = digest
+        metadata = attrs.get('data-core-metadata',
+                             attrs.get('data-dist-info-metadata'))
+        files.append({'filename': unquote(href.rstrip('/').split('/')[-1]),
+                      'url': href,
+                      'hashes': hashes,
+                      'yanked': 'data-yanked' in attrs,
+                      'metadata': _parse_metadata_attribute(metadata)})
+    return files
+
+
+class Index(object):
+    """Base class of package indexes. Subclasses must implement
+    ``get_files()``.
+    """
+
+    def get_files(self, name):
+        """Return the list of files of the project ``name`` (see
+        ``parse_project_page()``), or ``None`` if there is no such
+        project.
+        """
+        raise NotImplementedError
+
+    def search(self, spec):
+        """Return the latest version of the project ``spec['name']``,
+        like the 'search' XML-RPC method: a list with a single
+        dictionary (with a 'name' and a 'version') or an empty list.
+        Yanked files are ignored.
+        """
+        files = self.get_files(spec['name']) or ()
+        names = {}
+        for info in files:
+            parsed = split_filename(info['filename'])
+            if parsed is None or info['yanked']:
+                continue
+            # Prefer the name of the source distribution.
+            if parsed['version'] not in names or \
+                    parsed['packagetype'] == 'sdist':
+                names[parsed['version']] = parsed['name']
+        if not names:
+            return []
+        version = get_latest_version(list(names.keys()))
+        return [{'name': names[version], 'version': version}]
+
+    def release_urls(self, name, version):
+        """Return the list of files of the given release, like the
+        'release_urls' XML-RPC method.
+        """
+        releases = []
+        for info in self.get_files(name) or ():
+            parsed = split_filename(info['filename'])
+            if parsed is None or parsed['version'] != version:
+                continue
+            releases.append({'filename': info['filename'],
+                             'url': info['url'],
+                             'packagetype': parsed['packagetype'],
+                             'python_version': parsed['python_version'],
+                             'digests': info['hashes'],
+                             'yanked': info['yanked'],
+                             'metadata': info['metadata']})
+        return releases
+
+    def changelog_last_serial(self):
+        raise NotImplementedError('This index has no changelog.')
+
+    def changelog_since_serial(self, serial):
+        raise NotImplementedError('This index has no changelog.')
+
+
+class SimpleIndex(Index):
+    """A "simple" repository API at ``url``.
+
+    ``pool`` is the ``ConnectionPool`` used to get pages. If a
+    ``MetadataCache`` is given, pages are stored in it and only
+    revalidated with a conditional request afterwards.
+    """
+
+    def __init__(self, url, pool, cache=None):
+        self.url = url.rstrip('/') + '/'
+        self.pool = pool
+        self.cache = cache
+        # Files of projects that have been fetched during this run.
+        self._projects = {}
+
+    def get_files(self, name):
+        key = normalize(name)
+        if key not in self._projects:
+            self._projects[key] = self._fetch_files(key)
+        return self._projects[key]
+
+    def _fetch_files(self, name):
+        url = '%s%s/' % (self.url, name)
+        cache_key = 'simple:%s' % url
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+        headers = {'Accept': ACCEPT}
+        if cached is not None:
+            headers['If-None-Match'] = cached['etag']
+        try:
+            response = self.pool.open(url, headers)
+        except HTTPError as exc:
+            if exc.code == 404:
+                return None
+            raise
+        with response:
+            body = response.read()
+            if response.getcode() == 304:  # Not Modified
+                return cached['files']
+            content_type = response.getheader('Content-Type') or ''
+            etag = response.getheader('ETag')
+        files = parse_project_page(url, body, content_type)
+        if self.cache is not None and etag:
+            self.cache.set(cache_key, {'etag': etag, 'files': files})
+        return files
+
+
+class LocalIndex(SimpleIndex):
+    """A local directory at ``path``: either a tree of PEP 503 pages
+    or a flat directory of distributions.
+    """
+
+    def __init__(self, path, pool):
+        self.path = os.path.abspath(path)
+        SimpleIndex.__init__(self, 'file://' + pathname2url(self.path), pool)
+        self._flat_listing = None
+
+    def _fetch_files(self, name):
+        if os.path.isdir(os.path.join(self.path, name)):
+            return SimpleIndex._fetch_files(self, name)
+        if self._flat_listing is None:
+            self._flat_listing = {}
+            for filename in sorted(os.listdir(self.path)):
+                parsed = split_filename(filename)
+                if parsed is None:
+                    continue
+                url = 'file://' + pathname2url(
+                    os.path.join(self.path, filename))
+                self._flat_listing.setdefault(
+                    normalize(parsed['name']), []).append(
+                    {'filename': filename, 'url': url, 'hashes': {},
+                     'yanked': False, 'metadata': False})
+        return self._flat_listing.get(name)
+
+
+def get_index(url, pool, cache=None):
+    """Return the index at ``url`` (a URL or the path of a local
+    directory).
+    """
+    if url.startswith('file:'):
+        return LocalIndex(url2pathname(urlparse.urlsplit(url).path), pool)
+    if '://' not in url:
+        return LocalIndex(url, pool)
+    return SimpleIndex(url, pool, cache)
@@ -0,0 +1,21 @@
+"""Modules that are imported on first use, so that commands that do
+not need them (e.g. ``list``) start quickly.
+"""
+
+import sys
+
+
+class LazyModule(object):
+    """A proxy to the module ``name``, which is imported when one of
+    its attributes is first accessed.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        __import__(self.__name)
+        return getattr(sys.modules[self.__name], attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name
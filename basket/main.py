@@ -1,33 +1,121 @@
 import collections
+import json
 import os
+import re
+import shutil
 import sys
-import tarfile
-import zipfile
+import threading
+import time
 
-from basket.compat import urllib
-from basket.compat import xmlrpclib
-from basket.compat import text
+from basket.graph import DependencyGraph
+from basket.lazy import LazyModule
+from basket.records import RECORD_FORMATS
+from basket.records import write_records
+from basket.repository import Catalog
+from basket.repository import Distribution
+from basket.repository import ArchiveIndex
+from basket.repository import ShardedCatalog
+from basket.repository import get_shard
+from basket.repository import list_files
+from basket.repository import write_json
+from basket.repository import normalize
+from basket.repository import read_manifest
+from basket.repository import replace
+from basket.repository import write_manifest
+from basket.tracing import NULL_TRACER
+from basket.tracing import Tracer
 
 
 PYPI_ENDPOINT = 'https://pypi.python.org/pypi'
+# Maximum number of XML-RPC calls sent in a single 'system.multicall'
+# request.
+MULTICALL_SIZE = 100
+# Name of the directory (in the root of the repository) where Basket
+# stores its own data.
+STATE_DIR = '.basket-data'
+MANIFEST = 'manifest.json'
+REQUIREMENTS_INDEX = 'requirements.json'
+CHECKSUMS = 'checksums.json'
+GRAPH = 'graph.json'
+# The serial of the last event of the changelog of the index that has
+# been taken into account by 'update' (see 'Basket.cmd_update()').
+SERIAL = 'serial.json'
+# The layout of the repository: either 'flat' (the default, all files
+# in the root directory) or 'sharded' (see 'Basket.layout').
+LAYOUT = 'layout.json'
+LAYOUTS = ('flat', 'sharded')
+# Bundles that have been written by (or applied to) the repository
+# (see 'Basket.cmd_bundle()').
+BUNDLES = 'bundles.json'
+# Name of the directory (in the root of the repository) of the PEP 503
+# "simple" index.
+SIMPLE_DIR = 'simple'
+
+
+PACKAGE_NAME_REGEXP = re.compile('[A-Za-z0-9._-]+')
+# A line of a 'requirements.txt' file that pins a single version, e.g.
+# 'Foo[bar]==1.0 ; python_version > "3"'.
+PINNED_REQUIREMENT_REGEXP = re.compile(
+    r'^[A-Za-z0-9._-]+\s*(?:\[[^\]]*\])?\s*===?\s*([^\s,;]+)\s*(?:;.*)?$')
+# Fields of the records written by 'list' and 'prune' with '--format'
+# (see 'basket.records').
+RECORD_FIELDS = ('name', 'version', 'filename', 'path', 'size', 'mtime')
+# How files are exported (see 'basket.export.link_or_copy()').
+EXPORT_METHODS = {'hardlink': 'hard link', 'reflink': 'reflink',
+                  'copy': 'copy'}
 
 
 def get_package_name(line):
     """Return a package name from a line in the ``requirements.txt``
-    file.
+    file (or a ``Requires-Dist`` header).
     """
-    idx = line.find('<')
-    if idx == -1:
-        idx = line.find('>')
-        if idx == -1:
-            idx = line.find('=')
-    if idx == -1:
+    match = PACKAGE_NAME_REGEXP.match(line.strip())
+    if match is None:
         return line
-    return line[:idx].strip()
+    return match.group(0)
+
+
+def parse_metadata(lines):
+    """Return requirements listed in the ``Requires-Dist`` headers of
+    a ``PKG-INFO`` or ``METADATA`` file, as a tuple ``(requirements,
+    complete)``.
+
+    ``complete`` tells whether the list of requirements can be
+    trusted: before version 2.2 of the metadata format, requirements
+    were usually listed in ``.egg-info/requires.txt`` only. Since
+    version 2.2, requirements must be listed unless they are marked
+    as dynamic.
+    """
+    requirements = []
+    metadata_version = (1, 0)
+    dynamic = False
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            break  # end of headers, the rest is the description
+        if ':' not in line or line[0].isspace():
+            continue
+        header, value = line.split(':', 1)
+        header = header.lower()
+        value = value.strip()
+        if header == 'metadata-version':
+            try:
+                metadata_version = tuple(int(n) for n in value.split('.'))
+            except ValueError:
+                pass
+        elif header == 'requires-dist':
+            requirements.append(value)
+        elif header == 'dynamic' and value.lower() == 'requires-dist':
+            dynamic = True
+    complete = metadata_version >= (2, 2) and not dynamic
+    return requirements, complete
 
 
 def get_name_and_version(filename):
     """Guess name and version of a package given its ``filename``."""
+    if filename.endswith('.whl'):
+        name, version = filename.split('-')[:2]
+        return {'name': name, 'version': version}
     idx = filename.rfind('.tar.gz')
     if idx == -1:
         idx = filename.rfind('.zip')
@@ -39,54 +127,535 @@ def get_name_and_version(filename):
     return {'name': name, 'version': version}
 
 
+class IntegrityError(IOError):
+    """Raised when a downloaded file does not match the digest
+    advertised by the package index.
+    """
+
+
+def pop_option(argv, option, default=None):
+    """Remove ``option`` and its value from ``argv`` and return the
+    value (or ``default`` if the option is not there).
+
+    Both ``--option value`` and ``--option=value`` are accepted.
+    """
+    for i, arg in enumerate(argv):
+        if arg == option:
+            if i + 1 == len(argv):
+                raise ValueError('Missing value for "%s".' % option)
+            value = argv[i + 1]
+            del argv[i:i + 2]
+            return value
+        if arg.startswith(option + '='):
+            del argv[i]
+            return arg[len(option) + 1:]
+    return default
+
+
 class Basket(object):
 
     # Defined here so we can mock them for our tests. This is just a
     # try and I might end up using a mocking library instead if it
     # gets out of control.
     os = os
-    tarfile = tarfile
-    urllib = urllib
-    zipfile = zipfile
+    tarfile = LazyModule('tarfile')
+    zipfile = LazyModule('zipfile')
     err = sys.stderr
     out = sys.stdout
     root = os.environ.get('BASKET_ROOT') or os.path.expanduser('~/.basket')
+    endpoint = PYPI_ENDPOINT
+    # The "simple" repository API (or local directory) to use instead
+    # of the XML-RPC API at 'endpoint' (see 'basket.index').
+    index_url = os.environ.get('BASKET_INDEX_URL') or None
+    # Number of packages that are resolved and downloaded at the same
+    # time (see '--jobs').
+    jobs = 1
+    # Either 'threads' (the default), 'asyncio' (see '--engine' and
+    # the 'basket.aio' module) or 'pipeline' (see
+    # '_download_pipelined()').
+    engine = 'threads'
+    # Number of packages that each stage of the 'pipeline' engine may
+    # have in advance.
+    pipeline_depth = int(os.environ.get('BASKET_PIPELINE_DEPTH', 8))
+    # Metadata cache settings: how long (in seconds) search results
+    # and negative results ("no such package", "no source
+    # distribution") are kept, and the maximum size (in bytes) of the
+    # cache.
+    cache_ttl = int(os.environ.get('BASKET_CACHE_TTL', 3600))
+    cache_negative_ttl = int(os.environ.get('BASKET_CACHE_NEGATIVE_TTL', 300))
+    cache_max_size = int(os.environ.get('BASKET_CACHE_MAX_SIZE', 50000000))
+    # Size (in bytes) of the chunks that are read and written when
+    # downloading a file.
+    chunk_size = int(os.environ.get('BASKET_CHUNK_SIZE', 65536))
+    # Maximum number of idle connections that are kept open for each
+    # host.
+    pool_size = int(os.environ.get('BASKET_POOL_SIZE', 10))
+    # Records the duration of each phase (see '--profile' and the
+    # 'basket.tracing' module).
+    tracer = NULL_TRACER
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._multicall_supported = True
+        # Results of 'search' (keyed by normalized query) and
+        # 'release_urls' (keyed by '(name, version)') XML-RPC calls.
+        self._search_results = {}
+        self._release_urls = {}
+        # Distributions whose requirements have been read from their
+        # metadata file and that are downloaded once all requirements
+        # are resolved (see '_fetch()').
+        self._resolved = []
+        # Whether files have been registered since the manifest has
+        # been written (see '_register()').
+        self._manifest_modified = False
+        # Number of packages that could not be downloaded by the
+        # current run (see '_failed()').
+        self._failures = 0
+
+    @property
+    def http(self):
+        """The pool of HTTP connections, created on-demand."""
+        from basket.http import ConnectionPool
+        if getattr(self, '_http', None) is None:
+            self._http = ConnectionPool(self.pool_size)
+        return self._http
 
     @property
     def client(self):
         """A wrapper around the XML-RPC client to create it on-demand.
+
+        The client uses our pool of HTTP connections and can be used
+        by concurrent threads. If ``index_url`` is set, the client is
+        an index with the same 'search' and 'release_urls' methods
+        instead (see ``basket.index``).
         """
+        from basket.compat import urlparse
+        from basket.compat import xmlrpclib
+        from basket.http import PooledTransport
+        from basket.index import get_index
         # The 'is None' part is required, otherwise Python tries to
         # call 'self._client.__nonzero__' and the ServerProxy class
         # supposes that we are looking for the '__nonzero__' RPC
         # method. Hilarity does not ensue.
+        if getattr(self, '_client', None) is None and self.index_url:
+            self._client = get_index(self.index_url, self.http, self.cache)
+            # Only the XML-RPC API supports 'system.multicall'.
+            self._multicall_supported = False
         if getattr(self, '_client', None) is None:
-            self._client = xmlrpclib.ServerProxy(PYPI_ENDPOINT)
+            scheme = urlparse.urlsplit(self.endpoint).scheme
+            transport = PooledTransport(self.http, scheme)
+            self._client = xmlrpclib.ServerProxy(self.endpoint, transport)
         return self._client
 
+    @property
+    def cache(self):
+        """The metadata cache, or ``None`` if the repository does not
+        exist (yet).
+        """
+        from basket.cache import MetadataCache
+        if getattr(self, '_cache', None) is None:
+            path = self._get_state_path('cache.sqlite')
+            if path is None:
+                return None
+            self._cache = MetadataCache(path, self.cache_max_size)
+        return self._cache
+
+    @property
+    def requirements_index(self):
+        """The index of requirements of downloaded archives, or
+        ``None`` if the repository does not exist (yet).
+        """
+        if getattr(self, '_requirements_index', None) is None:
+            path = self._get_state_path(REQUIREMENTS_INDEX)
+            if path is None:
+                return None
+            self._requirements_index = ArchiveIndex(path)
+        return self._requirements_index
+
+    @property
+    def checksums(self):
+        """The index of SHA-256 digests of downloaded archives, or
+        ``None`` if the repository does not exist (yet).
+        """
+        if getattr(self, '_checksums', None) is None:
+            path = self._get_state_path(CHECKSUMS)
+            if path is None:
+                return None
+            self._checksums = ArchiveIndex(path)
+        return self._checksums
+
+    @property
+    def dependency_graph(self):
+        """The ``DependencyGraph`` of downloaded packages, or ``None``
+        if the repository does not exist (yet).
+        """
+        if getattr(self, '_dependency_graph', None) is None:
+            path = self._get_state_path(GRAPH)
+            if path is None:
+                return None
+            self._dependency_graph = DependencyGraph(path)
+        return self._dependency_graph
+
+    def _get_state_path(self, filename):
+        """Return the path of ``filename`` in the directory where we
+        store our own data (and create this directory if needed), or
+        ``None`` if the repository does not exist or if this directory
+        cannot be created (e.g. the repository is read-only).
+        """
+        if not self.os.path.isdir(self.root):
+            return None
+        state_dir = self.os.path.join(self.root, STATE_DIR)
+        if not self.os.path.exists(state_dir):
+            try:
+                self.os.mkdir(state_dir)
+            except OSError:
+                return None
+        return self.os.path.join(state_dir, filename)
+
+    @property
+    def layout(self):
+        """The layout of the repository: either 'flat' (all files are
+        in the root directory) or 'sharded' (files of each project are
+        in their own directory, see ``basket.repository.get_shard()``).
+        The sharded layout is chosen with ``init --sharded`` or
+        ``migrate sharded``.
+        """
+        if getattr(self, '_layout', None) is None:
+            self._layout = 'flat'
+            path = self._get_state_path(LAYOUT)
+            if path is not None:
+                try:
+                    with open(path) as fp:
+                        layout = json.load(fp)['layout']
+                except (IOError, OSError, ValueError, KeyError, TypeError):
+                    layout = 'flat'
+                if layout in LAYOUTS:
+                    self._layout = layout
+        return self._layout
+
+    def _set_layout(self, layout):
+        write_json(self._get_state_path(LAYOUT), {'layout': layout})
+        self._layout = layout
+
+    def _get_relative_path(self, name, filename):
+        """Return the path (relative to the root of the repository,
+        with '/' separators) of the file ``filename`` of the project
+        ``name``.
+        """
+        if self.layout == 'sharded':
+            return '%s/%s' % (get_shard(name), filename)
+        return filename
+
+    def _get_path(self, name, filename):
+        """Return the path of the file ``filename`` of the project
+        ``name``.
+        """
+        return self.os.path.join(
+            self.root, *self._get_relative_path(name, filename).split('/'))
+
+    def _list_shard(self, name):
+        """Return the distributions in the directory of the project
+        ``name`` (normalized) of a sharded repository.
+        """
+        directory = self.os.path.join(self.root, *get_shard(name).split('/'))
+        try:
+            filenames = sorted(self.os.listdir(directory))
+        except OSError:
+            return []
+        dists = []
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue  # e.g. a partial download
+            info = get_name_and_version(filename)
+            dists.append(Distribution(info['name'], info['version'],
+                                      filename))
+        return dists
+
+    def _list_shards(self):
+        """Return the normalized names of all projects of a sharded
+        repository.
+        """
+        names = []
+        for letter in sorted(self.os.listdir(self.root)):
+            directory = self.os.path.join(self.root, letter)
+            if letter.startswith('.') or letter == SIMPLE_DIR or \
+                    not self.os.path.isdir(directory):
+                continue
+            names.extend(sorted(self.os.listdir(directory)))
+        return names
+
     @property
     def downloaded_packages(self):
-        """Return information about downloaded packages."""
+        """Return the ``Catalog`` of downloaded packages.
+
+        The catalog is read from the manifest of the repository, unless
+        the repository has been modified since it has been written, in
+        which case we list the directory and write a new manifest (if
+        we can: a read-only repository is listed each time).
+
+        In the sharded layout, there is no manifest: the directory of
+        a project is listed when the project is looked up (see
+        ``ShardedCatalog``).
+        """
+        if getattr(self, '_downloaded_packages', None) is None and \
+                self.layout == 'sharded':
+            self._downloaded_packages = ShardedCatalog(self._list_shard,
+                                                       self._list_shards)
         if getattr(self, '_downloaded_packages', None) is None:
-            self._downloaded_packages = []
-            for filename in self.os.listdir(self.root):
-                info = get_name_and_version(filename)
-                info['filename'] = filename
-                self._downloaded_packages.append(info)
+            path = self._get_state_path(MANIFEST)
+            packages = None
+            if path is not None:
+                mtime = self.os.stat(self.root).st_mtime
+                packages = read_manifest(path, mtime)
+            if packages is None:
+                packages = Catalog()
+                for filename in self.os.listdir(self.root):
+                    if filename.startswith('.') or filename == SIMPLE_DIR:
+                        continue  # our own data (or a hidden file)
+                    info = get_name_and_version(filename)
+                    packages.add(info['name'], info['version'], filename)
+                if path is not None:
+                    try:
+                        write_manifest(path, mtime, packages)
+                    except (IOError, OSError):
+                        pass  # e.g. a read-only repository
+            else:
+                packages = Catalog(packages)
+            self._downloaded_packages = packages
         return self._downloaded_packages
 
+    def _update_manifest(self):
+        """Write the manifest after we have modified the repository."""
+        path = self._get_state_path(MANIFEST)
+        if path is not None and self.layout == 'flat':
+            with self._lock:
+                mtime = self.os.stat(self.root).st_mtime
+                write_manifest(path, mtime, self.downloaded_packages)
+
+    def _get_checksum(self, name, filename):
+        """Return the SHA-256 digest of the downloaded ``filename``
+        of the project ``name`` if we know it, ``None`` otherwise.
+        """
+        if self.checksums is None:
+            return None
+        try:
+            stat = self.os.stat(self._get_path(name, filename))
+        except OSError:
+            return None
+        return self.checksums.get(filename, stat.st_size, stat.st_mtime)
+
+    def _update_simple_index(self, names):
+        """Update pages of the given projects in the simple index,
+        or build the whole index if it does not exist.
+        """
+        from basket.simple import write_project_page
+        from basket.simple import write_root_page
+        if not self.os.path.isdir(self.root):
+            return
+        simple_dir = self.os.path.join(self.root, SIMPLE_DIR)
+        with self._lock:
+            # The directory must be created before the catalog is
+            # loaded (creating it changes the repository directory,
+            # hence invalidates the manifest).
+            write_root = not self.os.path.exists(simple_dir)
+            if write_root:
+                self.os.mkdir(simple_dir)
+        catalog = self.downloaded_packages
+        with self._lock:
+            if write_root:
+                names = catalog.names()
+            for name in set([normalize(name) for name in names]):
+                files = [(self._get_relative_path(dist.name, dist.filename),
+                          self._get_checksum(dist.name, dist.filename))
+                         for dist in catalog.get(name)]
+                write_root |= write_project_page(simple_dir, name, files)
+            if write_root:
+                write_root_page(simple_dir, catalog.names())
+
+    def _call_many(self, calls):
+        """Send XML-RPC ``calls`` (a list of ``(method, args)``
+        tuples) and return the list of their results.
+
+        Calls are sent by batches of ``MULTICALL_SIZE`` in a single
+        'system.multicall' request. If the server does not support
+        multicall, we fall back to individual calls for the rest of
+        the run. If the server rejects a single call of a batch, only
+        this call is sent again on its own.
+        """
+        from basket.compat import xmlrpclib
+        results = []
+        for start in range(0, len(calls), MULTICALL_SIZE):
+            batch = calls[start:start + MULTICALL_SIZE]
+            batch_results = None
+            if self._multicall_supported:
+                multicall = xmlrpclib.MultiCall(self.client)
+                for method, args in batch:
+                    getattr(multicall, method)(*args)
+                try:
+                    with self.tracer.span('multicall'):
+                        batch_results = multicall()
+                except (xmlrpclib.Fault, xmlrpclib.ProtocolError):
+                    self._multicall_supported = False
+            for i, (method, args) in enumerate(batch):
+                if batch_results is not None:
+                    try:
+                        results.append(batch_results[i])
+                        continue
+                    except xmlrpclib.Fault:
+                        pass
+                results.append(getattr(self.client, method)(*args))
+        return results
+
+    def _prefetch(self, packages):
+        """Fetch information about all ``packages`` with as few
+        requests as possible, so that ``_find_package_name()`` and
+        ``_find_package_url()`` do not have to query the server.
+        """
+        queries = self._get_unknown_queries(packages)
+        calls = [('search', ({'name': query}, )) for query in queries]
+        for query, result in zip(queries, self._call_many(calls)):
+            self._remember_search(query, result)
+        releases = self._get_unknown_releases(packages)
+        calls = [('release_urls', key) for key in releases]
+        for key, result in zip(releases, self._call_many(calls)):
+            self._remember_release_urls(key, result)
+
+    def _get_unknown_queries(self, packages):
+        """Return the list of (normalized) queries for ``packages``
+        whose search results are neither in memory nor in the cache.
+        """
+        queries = []
+        for package in packages:
+            query = normalize(package)
+            if query not in queries and \
+                    self._get_known_search(query) is None:
+                queries.append(query)
+        return queries
+
+    def _get_unknown_releases(self, packages):
+        """Return the list of ``(name, version)`` tuples of the latest
+        releases of ``packages`` that we do not have and whose files
+        are neither in memory nor in the cache.
+
+        Search results for ``packages`` must be known.
+        """
+        releases = []
+        for package in packages:
+            info = self._find_package_name(package)
+            if info is None:
+                continue
+            key = (info['name'], info['version'])
+            if key in releases or self._has_package(*key) or \
+                    self._get_known_release_urls(key) is not None:
+                continue
+            releases.append(key)
+        return releases
+
+    def _get_cache_key(self, key):
+        """Return the key of the metadata cache for ``key``. Results
+        of other indexes than PyPI are prefixed by their URL.
+        """
+        if self.index_url:
+            return '%s %s' % (self.index_url, key)
+        return key
+
+    def _get_from_cache(self, key):
+        cache = self.cache
+        if cache is None:
+            return None
+        return cache.get(self._get_cache_key(key))
+
+    def _remember_search(self, query, result):
+        """Store ``result`` of the search for ``query`` in memory and
+        in the metadata cache.
+        """
+        self._search_results[query] = result
+        if self.cache is None:
+            return
+        if [info for info in result
+                if normalize(info['name']) == normalize(query)]:
+            ttl = self.cache_ttl
+        else:
+            ttl = self.cache_negative_ttl
+        self.cache.set(self._get_cache_key('search:%s' % query), result, ttl)
+
+    def _remember_release_urls(self, key, result):
+        """Store the ``result`` of 'release_urls' for ``key`` (a
+        ``(name, version)`` tuple) in memory and in the metadata
+        cache.
+        """
+        self._release_urls[key] = result
+        if self.cache is None:
+            return
+        # Files of a given release do not change (or very rarely), we
+        # can keep them forever. But a source distribution could be
+        # added later.
+        if [info for info in result if info['python_version'] == 'source']:
+            ttl = None
+        else:
+            ttl = self.cache_negative_ttl
+        self.cache.set(self._get_cache_key('release_urls:%s/%s' % key),
+                       result, ttl)
+
+    def _get_known_search(self, query):
+        """Return the result of the search for ``query`` (which must
+        be normalized) if it is in memory or in the metadata cache,
+        ``None`` otherwise.
+        """
+        if query not in self._search_results:
+            cached = self._get_from_cache('search:%s' % query)
+            if cached is None:
+                return None
+            self._search_results[query] = cached
+        return self._search_results[query]
+
+    def _get_known_release_urls(self, key):
+        """Return the result of 'release_urls' for ``key`` (a
+        ``(name, version)`` tuple) if it is in memory or in the
+        metadata cache, ``None`` otherwise.
+        """
+        if key not in self._release_urls:
+            cached = self._get_from_cache('release_urls:%s/%s' % key)
+            if cached is None:
+                return None
+            self._release_urls[key] = cached
+        return self._release_urls[key]
+
+    def _search(self, query):
+        query = normalize(query)
+        with self.tracer.span('search', query) as span:
+            result = self._get_known_search(query)
+            span.cache = 'hit'
+            if result is None:
+                span.cache = 'miss'
+                result = self.client.search({'name': query})
+                self._remember_search(query, result)
+        return result
+
+    def _get_release_urls(self, package, version):
+        key = (package, version)
+        with self.tracer.span('release_urls', normalize(package)) as span:
+            result = self._get_known_release_urls(key)
+            span.cache = 'hit'
+            if result is None:
+                span.cache = 'miss'
+                result = self.client.release_urls(package, version)
+                self._remember_release_urls(key, result)
+        return result
+
     def _find_package_name(self, query):
         """Return information about the package that matches the
-        query (case does not matter).
+        query (case does not matter, nor the difference between '-',
+        '_' and '.', see ``normalize()``).
 
         PyPI may return more than one version of a package (e.g. when
         there are multiple concurrent stable releases). In this case,
         we return the latest one.
         """
-        query = query.lower()
+        query = normalize(query)
         candidates = []
-        for info in self.client.search({'name': query}):
-            if info['name'].lower() == query:
+        for info in self._search(query):
+            if normalize(info['name']) == query:
                 candidates.append(info)
         if not candidates:
             return None
@@ -96,37 +665,146 @@ class Basket(object):
         """Return the URL of the requested ``version`` of the
         ``package``.
         """
+        info = self._find_package_file(package, version)
+        return info and info['url']
+
+    def _find_package_file(self, package, version):
+        """Return information about the file to download for the
+        requested ``version`` of the ``package`` (as returned by
+        'release_urls').
+        """
         # This is very basic indeed but should work. For most
         # packages. For me. YMMV.
-        for info in self.client.release_urls(package, version):
+        for info in self._get_release_urls(package, version):
             if info['python_version'] == 'source':
-                return info['url']
+                return info
         return None
 
     def _get_requirements_from_tar_archive(self, path):
-        """Return lines of ``requires.txt`` file from the given
-        TAR-gzipped or TAR-bzipped archive.
+        """Return lines of ``requires.txt`` file (or requirements
+        listed in ``PKG-INFO``) from the given TAR-gzipped or
+        TAR-bzipped archive.
+
+        The archive is read as a stream and we stop reading it as
+        soon as we have found what we need, which is usually at the
+        beginning of the archive: we do not decompress the rest.
+
+        Requirements listed in an older version of ``PKG-INFO`` (that
+        may be incomplete, see ``parse_metadata()``) are only used if
+        there is no ``requires.txt`` file.
         """
-        extension = self.os.path.splitext(path)[1].split('.')[1]
-        with self.tarfile.open(path, 'r:%s' % extension) as archive:
+        from basket.compat import text
+        in_egg_info = False
+        fallback = ()
+        # The compression is detected from the content of the file,
+        # whatever its extension ('.tar.gz', '.tgz' or '.tar.bz2').
+        with self.tarfile.open(path, 'r|*') as archive:
             for info in archive:
-                if info.name.endswith(
-                    self.os.path.join('.egg-info', 'requires.txt')):
-                    return map(text, archive.extractfile(info).readlines())
-        return ()
+                parts = info.name.split('/')
+                if [part for part in parts if part.endswith('.egg-info')]:
+                    in_egg_info = True
+                    if parts[-1] == 'requires.txt':
+                        return map(text, archive.extractfile(info).readlines())
+                elif in_egg_info:
+                    # We have gone past the '.egg-info' directory and
+                    # there is no 'requires.txt' file in it.
+                    break
+                elif len(parts) == 2 and parts[1] == 'PKG-INFO':
+                    lines = map(text, archive.extractfile(info).readlines())
+                    requirements, complete = parse_metadata(lines)
+                    if complete:
+                        return requirements
+                    fallback = requirements
+        return fallback
 
     def _get_requirements_from_zip_archive(self, path):
-        """Return lines of ``requires.txt`` file from the given zipped
-        archive.
+        """Return lines of ``requires.txt`` file (or requirements
+        listed in ``PKG-INFO`` or ``METADATA`` for wheels) from the
+        given zipped archive.
+
+        Usual locations of these files are looked up directly in the
+        central directory of the archive. As with TAR archives,
+        requirements listed in an older version of ``PKG-INFO`` are
+        only used if there is no ``requires.txt`` file.
         """
+        from basket.compat import text
+        filename = self.os.path.basename(path)
+        info = get_name_and_version(filename)
+        if filename.endswith('.whl'):
+            metadata = ['%(name)s-%(version)s.dist-info/METADATA' % info]
+            requires = []
+        else:
+            base = filename[:filename.rfind('.')]
+            metadata = ['%s/PKG-INFO' % base]
+            requires = ['%s/%s.egg-info/requires.txt' % (base, name)
+                        for name in (info['name'],
+                                     info['name'].replace('-', '_'))]
+        fallback = ()
         with self.zipfile.ZipFile(path) as archive:
+            for name in requires:
+                try:
+                    return map(text, archive.open(name).readlines())
+                except KeyError:
+                    pass
+            for name in metadata:
+                try:
+                    lines = map(text, archive.open(name).readlines())
+                except KeyError:
+                    continue
+                requirements, complete = parse_metadata(lines)
+                if complete or filename.endswith('.whl'):
+                    return requirements
+                fallback = requirements
+            # The '.egg-info' directory may be elsewhere (e.g. in a
+            # 'src/' directory).
             for info in archive.infolist():
-                if info.filename.endswith(
-                    self.os.path.join('.egg-info', 'requires.txt')):
+                if info.filename.endswith('.egg-info/requires.txt'):
                     return map(text, archive.open(info).readlines())
-        return ()
+        return fallback
 
     def _find_requirements(self, path):
+        """Return a list of packages required by the package at
+        ``path``.
+
+        Requirements are stored in the requirements index so that
+        each archive is opened only once (see
+        ``_scan_requirements()``).
+        """
+        index = self.requirements_index
+        try:
+            stat = self.os.stat(path)
+        except OSError:
+            index = None
+        if index is None:
+            return self._scan_requirements(path)
+        filename = self.os.path.basename(path)
+        key = (filename, stat.st_size, stat.st_mtime)
+        with self.tracer.span('requirements',
+                              self._get_traced_name(filename)) as span:
+            with self._lock:
+                requirements = index.get(*key)
+            span.cache = 'hit'
+            if requirements is None:
+                span.cache = 'miss'
+                span.bytes = stat.st_size
+                requirements = self._scan_requirements(path)
+                with self._lock:
+                    index.set(*(key + (list(requirements), )))
+        return requirements
+
+    def _get_traced_name(self, filename):
+        """Return the normalized name of the package of ``filename``
+        for the tracer (see ``basket.tracing``), so that all phases of
+        a package are reported together.
+        """
+        if not self.tracer.enabled:
+            return None
+        try:
+            return normalize(get_name_and_version(filename)['name'])
+        except ValueError:
+            return filename
+
+    def _scan_requirements(self, path):
         """Look at the package at ``path`` and return a list of
         required packages.
 
@@ -141,7 +819,6 @@ class Basket(object):
         - it records optional requirements (which may be a good
           thing, though).
         """
-        requirements = []
         if self.tarfile.is_tarfile(path):
             lines = self._get_requirements_from_tar_archive(path)
         elif self.zipfile.is_zipfile(path):
@@ -150,24 +827,236 @@ class Basket(object):
             self.print_err('Could not open "%s" (unknown archive '
                            'format).' % path)
             return ()
+        return self._get_package_names(lines)
+
+    def _get_package_names(self, lines):
+        """Return the names of the packages listed in ``lines`` (of a
+        ``requires.txt`` file or ``Requires-Dist`` headers).
+        """
+        requirements = []
         for line in lines:
             line = line.strip()
             if line and not line.startswith('['):
                 requirements.append(get_package_name(line))
         return requirements
 
+    def _get_requirements_from_metadata(self, release):
+        """Return the list of packages required by the file described
+        by ``release`` (as returned by 'release_urls'), read from its
+        separate metadata file (see PEP 658), or ``None`` if the index
+        does not provide one or if it does not list all requirements.
+
+        Files do not change, so requirements are kept in the metadata
+        cache forever.
+        """
+        from basket.compat import HTTPError
+        if not release.get('metadata'):
+            return None
+        url = release['url'] + '.metadata'
+        with self.tracer.span('metadata', self._get_traced_name(
+                url[url.rfind('/') + 1:-len('.metadata')])) as span:
+            requirements = self._get_from_cache('requires:%s' % url)
+            span.cache = 'hit'
+            if requirements is not None:
+                return requirements
+            span.cache = 'miss'
+            try:
+                with self.http.open(url) as response:
+                    data = response.read()
+            except (HTTPError, IOError):
+                return None
+            span.bytes = len(data)
+        requirements = self._read_metadata_file(release, data)
+        if requirements is not None and self.cache is not None:
+            self.cache.set(self._get_cache_key('requires:%s' % url),
+                           requirements)
+        return requirements
+
+    def _read_metadata_file(self, release, data):
+        """Return the list of packages required by the file described
+        by ``release``, given the content of its metadata file, or
+        ``None`` if the metadata file does not match its digest or if
+        it does not list all requirements.
+        """
+        import hashlib
+        from basket.compat import text
+        digests = release['metadata']
+        if isinstance(digests, dict):
+            for algorithm, digest in digests.items():
+                if algorithm in hashlib.algorithms_available and \
+                        hashlib.new(algorithm, data).hexdigest() != digest:
+                    return None
+        lines = text(data).splitlines()
+        requirements, complete = parse_metadata(lines)
+        if not complete:
+            return None
+        return self._get_package_names(requirements)
+
     def _has_package(self, package, version):
-        for info in self.downloaded_packages:
-            if (info['name'], info['version']) == (package, version):
-                return True
-        return False
-
-    def _download(self, package, version, url):
-        self.downloaded_packages.append({'name': package, 'version': version})
-        path = self.os.path.join(self.root, url[url.rfind('/') + 1:])
-        self.urllib.urlretrieve(url, path)
+        return self.downloaded_packages.has(package, version)
+
+    def _retrieve(self, url, path, digests=None):
+        """Download the file at ``url``, store it at ``path`` and
+        return its SHA-256 digest.
+
+        The file is first written in a temporary file in the same
+        directory, which is renamed when the download is complete: we
+        never leave a truncated file at ``path``. If a previous
+        download has been interrupted, we try to resume it.
+
+        The digest is computed while the file is downloaded. If
+        ``digests`` is given (a dictionary with a 'sha256' and/or an
+        'md5' key), the file is checked against it and an
+        ``IntegrityError`` is raised if it does not match.
+        """
+        from basket.compat import HTTPError
+        digests = digests or {}
+        hashes = self._new_hashes(digests)
+        tmp_path = self._get_partial_path(path)
+        try:
+            offset = self.os.path.getsize(tmp_path)
+        except OSError:
+            offset = 0
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        try:
+            response = self.http.open(url, headers)
+        except HTTPError as exc:
+            if exc.code != 416:  # Requested Range Not Satisfiable
+                raise
+            # Our partial file is not what we think it is.
+            self.os.remove(tmp_path)
+            return self._retrieve(url, path, digests)
+        try:
+            if offset and response.getcode() != 206:  # Partial Content
+                offset = 0  # the server does not support ranges
+            if offset:
+                # Only the partial file has to be read again.
+                self._hash_file(tmp_path, hashes)
+            expected = response.info().get('Content-Length')
+            received = 0
+            with open(tmp_path, offset and 'ab' or 'wb') as fp:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    for h in hashes.values():
+                        h.update(chunk)
+                    received += len(chunk)
+        finally:
+            response.close()
+        return self._check_retrieved(url, path, tmp_path, hashes, digests,
+                                     expected, received)
+
+    def _get_partial_path(self, path):
+        """Return the path of the temporary file in which ``path`` is
+        downloaded.
+        """
+        directory, filename = self.os.path.split(path)
+        return self.os.path.join(directory, '.%s.part' % filename)
+
+    def _new_hashes(self, digests):
+        """Return the hash objects to update while downloading a
+        file that must match ``digests``.
+        """
+        import hashlib
+        hashes = {'sha256': hashlib.sha256()}
+        if 'md5' in digests and 'sha256' not in digests:
+            hashes['md5'] = hashlib.md5()
+        return hashes
+
+    def _hash_file(self, path, hashes):
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(self.chunk_size), b''):
+                for h in hashes.values():
+                    h.update(chunk)
+
+    def _check_retrieved(self, url, path, tmp_path, hashes, digests,
+                         expected, received):
+        """Check the file that has been downloaded from ``url`` in
+        ``tmp_path``, move it to ``path`` and return its SHA-256
+        digest.
+
+        ``expected`` is the value of the Content-Length header (if
+        any) and ``received`` the number of bytes that we got.
+        """
+        if expected is not None and received != int(expected):
+            raise IOError('Incomplete download of "%s" (got %d bytes '
+                          'out of %s).' % (url, received, expected))
+        for algorithm, h in hashes.items():
+            if algorithm in digests and \
+                    h.hexdigest() != digests[algorithm].lower():
+                self.os.remove(tmp_path)
+                raise IntegrityError(
+                    'Wrong %s digest for "%s" (expected %s, got %s).' % (
+                        algorithm, url, digests[algorithm], h.hexdigest()))
+        replace(tmp_path, path)
+        return hashes['sha256'].hexdigest()
+
+    def _download(self, package, version, url, digests=None):
+        filename = url[url.rfind('/') + 1:]
+        path = self._get_download_path(package, filename)
+        # Load the catalog before the new file is in the directory.
+        self.downloaded_packages
+        with self.tracer.span('download', normalize(package)) as span:
+            sha256 = self._retrieve(url, path, digests)
+            if self.tracer.enabled:
+                span.bytes = self.os.path.getsize(path)
+        with self.tracer.span('register', normalize(package)):
+            self._register(package, version, filename, sha256)
         return path
 
+    def _get_download_path(self, package, filename):
+        """Return the path where ``filename`` of the project
+        ``package`` must be downloaded, and create its directory if
+        needed.
+        """
+        path = self._get_path(package, filename)
+        directory = self.os.path.dirname(path)
+        if self.layout == 'sharded':
+            with self._lock:
+                if not self.os.path.isdir(directory):
+                    self.os.makedirs(directory)
+        return path
+
+    def _register(self, package, version, filename, sha256):
+        """Record a downloaded file in the catalog and the indexes of
+        the repository.
+        """
+        path = self._get_path(package, filename)
+        catalog = self.downloaded_packages
+        with self._lock:
+            catalog.add(package, version, filename)
+        if self.checksums is not None:
+            stat = self.os.stat(path)
+            with self._lock:
+                self.checksums.set(
+                    filename, stat.st_size, stat.st_mtime, sha256)
+        self._update_simple_index([package])
+        # The manifest is written by '_save_indexes()'.
+        with self._lock:
+            self._manifest_modified = True
+
+    def _save_indexes(self):
+        """Write the requirements and checksums indexes, the
+        dependency graph, the manifest and the access times of the
+        metadata cache if they have been modified. They are only kept
+        in memory while a command runs.
+        """
+        for attr in ('_requirements_index', '_checksums',
+                     '_dependency_graph'):
+            index = getattr(self, attr, None)
+            if index is not None:
+                with self._lock:
+                    index.save()
+        if self._manifest_modified:
+            self._update_manifest()
+            self._manifest_modified = False
+        if getattr(self, '_cache', None) is not None:
+            self._cache.flush()
+
     def print_msg(self, msg):
         """Print ``msg`` followed by a newline character on the
         standard output.
@@ -180,116 +1069,1122 @@ class Basket(object):
         """
         self.err.write(err + os.linesep)
 
-    def cmd_init(self):
-        """Initialize Basket directory."""
+    def cmd_init(self, sharded=False):
+        """Initialize Basket directory, with the sharded layout if
+        ``sharded`` is true (see ``layout``).
+        """
         if self.os.path.exists(self.root):
             self.print_err('A file or directory already exists '
                            'at "%s".' % self.root)
             return 1
         self.os.makedirs(self.root)
+        if sharded:
+            self._set_layout('sharded')
+        self._update_simple_index(())
         self.print_msg('Repository has been created: %s' % self.root)
         return 0
 
-    def cmd_list(self, packages=()):
-        """List all downloaded packages (or only requested ones)."""
-        show_all = len(packages) == 0
-        requested = set([name.lower() for name in packages])
-        left = set(requested)
-        for info in self.downloaded_packages:
-            matches = info['name'].lower() in requested
-            if show_all or matches:
-                self.print_msg('%(name)s %(version)s' % info)
-                if not show_all:
+    def cmd_index(self):
+        """Build the simple index from scratch."""
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        simple_dir = self.os.path.join(self.root, SIMPLE_DIR)
+        if self.os.path.exists(simple_dir):
+            shutil.rmtree(simple_dir)
+        self._update_simple_index(())
+        self.print_msg('Simple index has been built: %s' % simple_dir)
+        return 0
+
+    def cmd_migrate(self, layout):
+        """Move all files of the repository to the given ``layout``
+        (see ``layout``) and rebuild the simple index.
+
+        Files are renamed, so that their modification time (hence the
+        entries of the requirements and checksums indexes) does not
+        change. The repository is marked as sharded while there may
+        be shard directories in it, so if the migration is
+        interrupted, it must be run again.
+        """
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        moved = 0
+        if layout == 'sharded':
+            self._set_layout('sharded')
+            for filename in sorted(self.os.listdir(self.root)):
+                path = self.os.path.join(self.root, filename)
+                if filename.startswith('.') or filename == SIMPLE_DIR or \
+                        self.os.path.isdir(path):
+                    continue
+                info = get_name_and_version(filename)
+                replace(path, self._get_download_path(info['name'], filename))
+                moved += 1
+        else:
+            for name in self._list_shards():
+                directory = self.os.path.join(
+                    self.root, *get_shard(name).split('/'))
+                for dist in self._list_shard(name):
+                    replace(self.os.path.join(directory, dist.filename),
+                            self.os.path.join(self.root, dist.filename))
+                    moved += 1
+                self._remove_empty_directory(directory)
+            for letter in self.os.listdir(self.root):
+                path = self.os.path.join(self.root, letter)
+                if len(letter) == 1 and self.os.path.isdir(path):
+                    self._remove_empty_directory(path)
+            self._set_layout('flat')
+        self._downloaded_packages = None
+        self._update_manifest()
+        simple_dir = self.os.path.join(self.root, SIMPLE_DIR)
+        if self.os.path.exists(simple_dir):
+            shutil.rmtree(simple_dir)
+        self._update_simple_index(())
+        self.print_msg('Moved %d files to the %s layout.' % (moved, layout))
+        return 0
+
+    def _remove_empty_directory(self, path):
+        try:
+            self.os.rmdir(path)
+        except OSError:
+            pass  # not empty (e.g. a partial download is still there)
+
+    def cmd_list(self, packages=(), fmt='text'):
+        """List all downloaded packages (or only requested ones).
+
+        ``fmt`` is either 'text' or one of ``RECORD_FORMATS`` (see
+        ``basket.records``), in which case the size and modification
+        time of each file are included.
+        """
+        left = []
+        dists = self._iter_listed(packages, left)
+        if fmt == 'text':
+            for dist in dists:
+                self.print_msg('%s %s' % (dist.name, dist.version))
+        else:
+            listed = {}
+            write_records(self.out,
+                          (self._get_record(dist, listed) for dist in dists),
+                          fmt, RECORD_FIELDS)
+        for name in left:
+            self.print_err('Package "%s" is not installed (or it is '
+                           'there but you mistyped the package name).' % name)
+        return 0
+
+    def _iter_listed(self, packages, left):
+        """Yield downloaded distributions of ``packages`` (or all of
+        them), and append requested names that are not there to
+        ``left``.
+        """
+        if not packages:
+            for dist in self.downloaded_packages:
+                yield dist
+            return
+        for name in sorted(set([name.lower() for name in packages])):
+            dists = self.downloaded_packages.get(name)
+            if not dists:
+                left.append(name)
+            for dist in dists:
+                yield dist
+
+    def _get_record(self, dist, listed):
+        """Return the record of ``dist`` for the machine-readable
+        output of commands (see ``RECORD_FIELDS``).
+
+        ``listed`` maps directories that have already been listed to
+        the size and modification time of their files, so that each
+        directory is listed only once (in a single pass, see
+        ``basket.repository.list_files()``).
+        """
+        path = self._get_relative_path(dist.name, dist.filename)
+        directory = path[:-len(dist.filename)]
+        files = listed.get(directory)
+        if files is None:
+            files = listed[directory] = {}
+            try:
+                for filename, size, mtime in list_files(self.os.path.join(
+                        self.root, *directory.split('/'))):
+                    files[filename] = (size, mtime)
+            except OSError:
+                pass
+        size, mtime = files.get(dist.filename, (None, None))
+        return {'name': dist.name, 'version': dist.version,
+                'filename': dist.filename, 'path': path, 'size': size,
+                'mtime': mtime}
+
+    def _fetch(self, package, claimed):
+        """Resolve ``package``, download it if we do not have its
+        latest version and return a tuple ``(messages, requirements)``
+        where ``messages`` is a list of ``(is_error, text)`` tuples to
+        be printed by the caller.
+
+        ``claimed`` is a set of ``(name, version)`` tuples that are
+        being downloaded by this run. It is only accessed while
+        holding the lock, so that two threads never download the same
+        distribution.
+        """
+        messages, requirements, downloaded = self._resolve_and_download(
+            package, claimed)
+        if downloaded is not None:
+            messages, requirements = self._scan_downloaded(*downloaded)
+        return messages, requirements
+
+    def _resolve_and_download(self, package, claimed):
+        """Do the first part of ``_fetch()``: resolve and download
+        ``package``, and return a tuple ``(messages, requirements,
+        downloaded)``. If a file has been downloaded, ``downloaded``
+        is an ``(info, path)`` tuple that must be passed to
+        ``_scan_downloaded()`` to get messages and requirements.
+        """
+        info = self._find_package_name(package)
+        if info is None:
+            return [(True, 'Could not find any package named '
+                     '"%s".' % package)], (), None
+        key = (info['name'], info['version'])
+        with self._lock:
+            up_to_date = self._has_package(*key) or key in claimed
+            claimed.add(key)
+        if up_to_date:
+            return [(False, '%(name)s is already up to date '
+                     '(%(version)s).' % info)], (), None
+        release = self._find_package_file(info['name'], info['version'])
+        if release is None:
+            with self._lock:
+                claimed.discard(key)
+            return [(True, 'Could not find a suitable distribution for '
+                     '%(name)s %(version)s.' % info)], (), None
+        requirements = self._get_requirements_from_metadata(release)
+        if requirements is not None:
+            # Download the file later, with all others.
+            with self._lock:
+                self._resolved.append((info, release, requirements))
+            return [], requirements, None
+        try:
+            path = self._download(info['name'], info['version'],
+                                  release['url'], self._get_digests(release))
+        except IntegrityError as exc:
+            with self._lock:
+                claimed.discard(key)
+            return self._failed(str(exc)), (), None
+        return [], (), (info, path)
+
+    def _scan_downloaded(self, info, path):
+        """Do the last part of ``_fetch()``: find requirements of the
+        distribution that has been downloaded at ``path``.
+        """
+        requirements = self._find_requirements(path)
+        self._record_dependencies(info['name'], info['version'],
+                                  requirements)
+        return self._get_added_messages(info, requirements), requirements
+
+    def _get_added_messages(self, info, requirements):
+        messages = [(False, 'Added %(name)s %(version)s.' % info)]
+        if requirements:
+            messages.append(
+                (False, '  -> requires: %s' % ', '.join(requirements)))
+        return messages
+
+    def _download_resolved(self, info, release, requirements):
+        """Download a distribution whose ``requirements`` have been
+        read from its metadata file and return messages to print (see
+        ``_fetch()``).
+        """
+        try:
+            path = self._download(info['name'], info['version'],
+                                  release['url'], self._get_digests(release))
+        except IntegrityError as exc:
+            return self._failed(str(exc))
+        self._remember_requirements(path, requirements)
+        self._record_dependencies(info['name'], info['version'],
+                                  requirements)
+        return self._get_added_messages(info, requirements)
+
+    def _remember_requirements(self, path, requirements):
+        """Store ``requirements`` of the downloaded archive at
+        ``path`` in the requirements index, so that the archive is
+        never scanned.
+        """
+        index = self.requirements_index
+        if index is not None:
+            stat = self.os.stat(path)
+            with self._lock:
+                index.set(self.os.path.basename(path), stat.st_size,
+                          stat.st_mtime, list(requirements))
+
+    def _download_all_resolved(self):
+        """Download all distributions whose requirements have been
+        read from their metadata file, with ``self.jobs`` threads.
+        """
+        from basket.compat import Queue
+        queue = Queue.Queue()
+        for item in self._resolved:
+            queue.put(item)
+        self._resolved = []
+
+        def work():
+            while True:
+                try:
+                    info, release, requirements = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    messages = self._download_resolved(
+                        info, release, requirements)
+                except Exception as exc:
+                    messages = self._failed('Could not download "%s": %s' % (
+                        info['name'], exc))
+                with self._lock:
+                    self._print_messages(messages)
+
+        workers = [threading.Thread(target=work)
+                   for _ in range(min(self.jobs, queue.qsize()) - 1)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        work()
+        for worker in workers:
+            worker.join()
+
+    def _record_dependencies(self, package, version, requirements):
+        """Record the ``requirements`` of a downloaded package in the
+        dependency graph (which is saved at the end of the run).
+        """
+        graph = self.dependency_graph
+        if graph is not None:
+            with self._lock:
+                graph.add(package, version, requirements)
+
+    def _get_digests(self, release):
+        """Return the digests of a file (as returned by
+        'release_urls'), keyed by algorithm.
+        """
+        digests = dict(release.get('digests') or {})
+        if release.get('md5_digest'):
+            digests.setdefault('md5', release['md5_digest'])
+        return digests
+
+    def _failed(self, text):
+        """Count a package that could not be downloaded (so that the
+        run returns a non-zero status) and return ``text`` as an error
+        message (see ``_fetch()``).
+        """
+        with self._lock:
+            self._failures += 1
+        return [(True, text)]
+
+    def _print_messages(self, messages):
+        for is_error, text in messages:
+            if is_error:
+                self.print_err(text)
+            else:
+                self.print_msg(text)
+
+    def _download_in_parallel(self, packages):
+        """Resolve and download ``packages`` (and their requirements)
+        with ``self.jobs`` worker threads.
+
+        Each package is processed only once, whatever the spelling
+        used to request it (see ``normalize()``). Messages of a package
+        are printed together, in the order in which packages are
+        processed.
+        """
+        from basket.compat import Queue
+        queue = Queue.Queue()
+        seen = set()
+        claimed = set()
+
+        def enqueue(names):
+            with self._lock:
+                for name in names:
+                    if normalize(name) not in seen:
+                        seen.add(normalize(name))
+                        queue.put(name)
+
+        def work():
+            while True:
+                package = queue.get()
+                if package is None:
+                    queue.task_done()
+                    return
+                try:
                     try:
-                        left.remove(info['name'].lower())
-                    except KeyError:
-                        # we have already seen another version of this package
-                        pass
+                        messages, requirements = self._fetch(package,
+                                                             claimed)
+                    except Exception as exc:
+                        messages = self._failed(
+                            'Could not download "%s": %s' % (package, exc))
+                        requirements = ()
+                    if len(requirements) > 1:
+                        try:
+                            self._prefetch(requirements)
+                        except Exception:
+                            pass  # requirements are looked up one by one
+                    with self._lock:
+                        self._print_messages(messages)
+                    enqueue(requirements)
+                finally:
+                    queue.task_done()
+
+        if len(packages) > 1:
+            self._prefetch(packages)
+        enqueue(packages)
+        workers = [threading.Thread(target=work) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        # Requirements are enqueued before the task of their parent
+        # is marked as done, so an empty queue means that we are done.
+        queue.join()
+        for worker in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        return 0
+
+    def _download_pipelined(self, packages):
+        """Resolve and download ``packages`` (and their requirements)
+        in three stages that run in their own thread and work on
+        different packages at the same time:
+
+        - the look-ahead stage fetches information about the next
+          ``pipeline_depth`` packages (in batches, see
+          ``_prefetch()``);
+
+        - the download stage resolves and downloads packages (see
+          ``_resolve_and_download()``);
+
+        - the scan stage finds requirements of downloaded archives
+          (see ``_scan_downloaded()``).
+
+        Stages are connected by bounded queues. Each stage handles
+        packages in order, so that packages are processed (and
+        messages are printed) in the same order as
+        ``_download_sequentially()``: requirements are queued after
+        the packages that are already known, which can be sent down
+        the pipeline while the requirements of the current package
+        are not known yet.
+        """
+        from basket.compat import Queue
+        depth = self.pipeline_depth
+        lookahead = Queue.Queue(depth)
+        downloads = Queue.Queue(depth)
+        scans = Queue.Queue(depth)
+        results = Queue.Queue()
+        claimed = set()
+
+        def lookahead_stage():
+            while True:
+                names = [lookahead.get()]
+                # Prefetch all packages that are waiting in a batch.
+                while len(names) < depth:
+                    try:
+                        names.append(lookahead.get_nowait())
+                    except Queue.Empty:
+                        break
+                batch = [name for name in names if name is not None]
+                try:
+                    self._prefetch(batch)
+                except Exception:
+                    pass  # the download stage will report the error
+                for name in names:
+                    downloads.put(name)
+                if None in names:
+                    return
+
+        def download_stage():
+            while True:
+                package = downloads.get()
+                if package is None:
+                    scans.put(None)
+                    return
+                try:
+                    scans.put(self._resolve_and_download(package, claimed))
+                except Exception as exc:
+                    scans.put((self._failed('Could not download "%s": %s' % (
+                        package, exc)), (), None))
+
+        def scan_stage():
+            while True:
+                item = scans.get()
+                if item is None:
+                    return
+                messages, requirements, downloaded = item
+                if downloaded is not None:
+                    try:
+                        messages, requirements = self._scan_downloaded(
+                            *downloaded)
+                    except Exception as exc:
+                        messages = self._failed('Could not scan "%s": %s' % (
+                            downloaded[1], exc))
+                        requirements = ()
+                results.put((messages, requirements))
+
+        stages = [threading.Thread(target=target)
+                  for target in (lookahead_stage, download_stage,
+                                 scan_stage)]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+        queue = collections.deque(packages)
+        resolved = set()
+        pending = 0
+        try:
+            while True:
+                while queue:
+                    package = queue.pop()
+                    if normalize(package) in resolved:
+                        continue
+                    resolved.add(normalize(package))
+                    lookahead.put(package)
+                    pending += 1
+                if not pending:
+                    break
+                messages, requirements = results.get()
+                pending -= 1
+                self._print_messages(messages)
+                queue.extendleft(requirements)
+        finally:
+            lookahead.put(None)
+            for stage in stages:
+                stage.join()
+        return 0
+
+    def _download_with_asyncio(self, packages):
+        if sys.version_info < (3, 5):
+            self.print_err('The asyncio engine requires Python 3.5 or '
+                           'later.')
+            return 1
+        from basket.aio import AsyncEngine
+        return AsyncEngine(self).run(packages)
+
+    def cmd_serve(self, host, port):
+        """Serve the repository over HTTP until interrupted."""
+        from basket.server import make_server
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        server = make_server(self.root, host, port)
+        url = 'http://%s:%d' % (host, server.server_address[1])
+        self.print_msg('Serving %s at %s/ (simple index: %s/%s/).' % (
+                self.root, url, url, SIMPLE_DIR))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    def cmd_graph(self, packages=(), fmt='text'):
+        """Print the dependency graph of the requested packages (or of
+        all downloaded packages), without any network access.
+
+        ``fmt`` is either 'text', 'dot' (for Graphviz) or 'json'.
+        """
+        graph = self.dependency_graph
+        if graph is None:
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        catalog = self.downloaded_packages
+        # Packages that have been downloaded by an older version of
+        # Basket (or added by hand) are not in the graph yet.
+        for name in catalog.names():
+            node = graph.get(name)
+            if node is None or not catalog.has(node.name, node.version):
+                dist = catalog.latest(name)
+                path = self._get_path(dist.name, dist.filename)
+                graph.add(dist.name, dist.version,
+                          self._find_requirements(path))
+        self._save_indexes()
+        if packages:
+            requested = sorted(set([normalize(name) for name in packages]))
+            roots = [name for name in requested if name in graph]
+            left = [name for name in requested if name not in graph]
+        else:
+            roots, left = sorted(catalog.names()), []
+        names = graph.closure(roots)
+        if fmt == 'dot':
+            self.print_msg(graph.to_dot(names))
+        elif fmt == 'json':
+            self.print_msg(graph.to_json(names))
+        else:
+            for name in names:
+                node = graph.get(name)
+                if node is None:
+                    self.print_msg('%s (not downloaded)' % name)
+                    continue
+                self.print_msg('%s %s' % (node.name, node.version))
+                if node.requires:
+                    self.print_msg('  -> requires: %s' % (
+                            ', '.join(node.requires)))
         for name in left:
             self.print_err('Package "%s" is not installed (or it is '
                            'there but you mistyped the package name).' % name)
         return 0
 
+    def _read_requirements_file(self, path):
+        """Return the list of packages listed in the requirements file
+        at ``path``, as ``(name, version)`` tuples where ``version`` is
+        ``None`` unless the line pins a single version.
+
+        Included files (``-r other.txt``) are read as well. Other
+        options and editable requirements are ignored.
+        """
+        requirements = []
+        with open(path) as fp:
+            for line in fp:
+                line = line.split(' #', 1)[0].strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith(('-r ', '--requirement ')):
+                    included = self.os.path.join(self.os.path.dirname(path),
+                                                 line.split(None, 1)[1])
+                    requirements.extend(
+                        self._read_requirements_file(included))
+                    continue
+                if line.startswith('-'):
+                    continue
+                match = PINNED_REQUIREMENT_REGEXP.match(line)
+                version = match and match.group(1)
+                requirements.append((get_package_name(line), version))
+        return requirements
+
+    def _resolve_locally(self, requested):
+        """Return the list of ``(dist, requirements)`` tuples of the
+        downloaded distributions of ``requested`` (a list of ``(name,
+        version)`` tuples, see ``_read_requirements_file()``) and of
+        all their requirements, and the list of names that we do not
+        have.
+
+        The latest version of each package is used, unless a version
+        has been pinned: if we do not have this version, we do not
+        fall back to another one, and the pinned requirement (e.g.
+        ``Foo==1.0``) is in the list of what we do not have.
+        Requirements are read from the archives (see
+        ``_find_requirements()``).
+        """
+        catalog = self.downloaded_packages
+        queue = collections.deque(requested)
+        seen = set()
+        resolved = []
+        left = []
+        while queue:
+            name, version = queue.popleft()
+            if normalize(name) in seen:
+                continue
+            seen.add(normalize(name))
+            dist = None
+            if version is not None:
+                for candidate in catalog.get(name):
+                    if candidate.version == version:
+                        dist = candidate
+                if dist is None:
+                    left.append('%s==%s' % (name, version))
+                    continue
+            else:
+                dist = catalog.latest(name)
+            if dist is None:
+                left.append(name)
+                continue
+            path = self._get_path(dist.name, dist.filename)
+            requirements = self._find_requirements(path)
+            resolved.append((dist, requirements))
+            queue.extend((requirement, None) for requirement in requirements)
+        return resolved, left
+
+    def cmd_export(self, destination, packages=(), requirement_files=()):
+        """Populate the repository at ``destination`` (which is
+        created if needed) with ``packages`` and packages listed in
+        ``requirement_files``, and all their requirements, without any
+        network access.
+
+        Files are hard-linked, cloned or copied (see
+        ``basket.export``). The indexes of the exported files
+        (requirements, checksums and dependency graph) are exported
+        as well, so that files are never opened again.
+        """
+        from basket.export import link_or_copy
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        requested = [(name, None) for name in packages]
+        for path in requirement_files:
+            try:
+                requested.extend(self._read_requirements_file(path))
+            except (IOError, OSError) as exc:
+                self.print_err('Could not read "%s": %s' % (path, exc))
+                return 1
+        resolved, left = self._resolve_locally(requested)
+        self._save_indexes()
+        target = self.__class__()
+        target.root = destination
+        target.os = self.os
+        if not self.os.path.exists(destination):
+            self.os.makedirs(destination)
+        # Load the catalog before new files are in the directory.
+        catalog = target.downloaded_packages
+        requirements_entries = []
+        checksums_entries = []
+        for dist, requirements in resolved:
+            path = target._get_download_path(dist.name, dist.filename)
+            if catalog.has(dist.name, dist.version) or \
+                    self.os.path.exists(path):
+                self.print_msg('%s %s is already there.' % (
+                        dist.name, dist.version))
+                continue
+            method = link_or_copy(self._get_path(dist.name, dist.filename),
+                                  path)
+            catalog.add(dist.name, dist.version, dist.filename)
+            stat = self.os.stat(path)
+            key = (dist.filename, stat.st_size, stat.st_mtime)
+            requirements_entries.append(key + (list(requirements), ))
+            sha256 = self._get_checksum(dist.name, dist.filename)
+            if sha256 is not None:
+                checksums_entries.append(key + (sha256, ))
+            target.dependency_graph.add(dist.name, dist.version, requirements)
+            self.print_msg('Exported %s %s (%s).' % (
+                    dist.name, dist.version, EXPORT_METHODS[method]))
+        target.requirements_index.update(requirements_entries)
+        target.checksums.update(checksums_entries)
+        target._save_indexes()
+        target._update_simple_index([dist.name for dist, _ in resolved])
+        target._update_manifest()
+        for name in left:
+            self.print_err('Package "%s" is not installed (or it is '
+                           'there but you mistyped the package name).' % name)
+        return 0
+
+    def _read_bundles(self):
+        """Return the bundles that have been written by (or applied
+        to) the repository, keyed by identifier.
+        """
+        path = self._get_state_path(BUNDLES)
+        try:
+            with open(path) as fp:
+                return json.load(fp)['bundles']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    def _write_bundles(self, bundles):
+        write_json(self._get_state_path(BUNDLES), {'bundles': bundles})
+
+    def _get_bundled_files(self, bundles, bundle_id):
+        """Return the set of file names that are in the bundle
+        ``bundle_id`` or in the bundles it has been made since.
+        """
+        filenames = set()
+        seen = set()
+        while bundle_id is not None and bundle_id not in seen:
+            seen.add(bundle_id)
+            filenames.update(bundles[bundle_id]['files'])
+            bundle_id = bundles[bundle_id]['since']
+        return filenames
+
+    def cmd_bundle(self, path, since=None, compress=False):
+        """Write a bundle at ``path`` with all downloaded packages,
+        or only those that have been added since the bundle ``since``
+        (see ``basket.bundle``).
+        """
+        from basket.bundle import BUNDLE_FORMAT
+        from basket.bundle import new_bundle_id
+        from basket.bundle import write_bundle
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        bundles = self._read_bundles()
+        if since is not None and since not in bundles:
+            self.print_err('Unknown bundle "%s".' % since)
+            return 1
+        shipped = self._get_bundled_files(bundles, since)
+        packages = []
+        files = []
+        for dist in self.downloaded_packages:
+            if dist.filename in shipped:
+                continue
+            dist_path = self._get_path(dist.name, dist.filename)
+            packages.append({
+                    'filename': dist.filename,
+                    'name': dist.name,
+                    'version': dist.version,
+                    'sha256': self._get_checksum(dist.name, dist.filename),
+                    'requires': list(self._find_requirements(dist_path))})
+            files.append((dist.filename, dist_path))
+        self._save_indexes()
+        if not packages and since is None:
+            self.print_msg('There is no package to bundle.')
+            return 0
+        if not packages:
+            self.print_msg('No package has been added since bundle '
+                           '%s.' % since)
+            return 0
+        bundle_id = new_bundle_id()
+        manifest = {'format': BUNDLE_FORMAT, 'id': bundle_id, 'since': since,
+                    'created': int(time.time()), 'packages': packages}
+        write_bundle(path, manifest, files, compress)
+        bundles[bundle_id] = {'since': since,
+                              'created': manifest['created'],
+                              'files': [filename for filename, _ in files]}
+        self._write_bundles(bundles)
+        self.print_msg('Bundle %s has been written to %s (%d packages).' % (
+                bundle_id, path, len(packages)))
+        return 0
+
+    def cmd_unbundle(self, path):
+        """Add distributions of the bundle at ``path`` to the
+        repository. The bundle it has been made since (if any) must
+        have been applied before.
+        """
+        import tarfile
+        from basket.bundle import read_bundle
+        if not self.os.path.isdir(self.root):
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        bundles = self._read_bundles()
+        try:
+            bundle = read_bundle(path)
+            manifest = next(bundle)
+        except (IOError, OSError, ValueError, tarfile.TarError) as exc:
+            self.print_err('Could not read bundle "%s": %s' % (path, exc))
+            return 1
+        since = manifest['since']
+        if manifest['id'] in bundles:
+            self.print_msg('Bundle %s has already been applied.' % (
+                    manifest['id']))
+            return 0
+        if since is not None and since not in bundles:
+            self.print_err('Bundle %s has been made since bundle %s, which '
+                           'has not been applied.' % (manifest['id'], since))
+            return 1
+        packages = dict((info['filename'], info)
+                        for info in manifest['packages'])
+        catalog = self.downloaded_packages
+        added = []
+        failed = False
+        try:
+            for filename, size, fp in bundle:
+                info = packages.get(filename)
+                if info is None:
+                    continue
+                if catalog.has(info['name'], info['version']):
+                    self.print_msg('%(name)s %(version)s is already '
+                                   'there.' % info)
+                    continue
+                try:
+                    self._extract(path, fp, size, info)
+                except IntegrityError as exc:
+                    self.print_err(str(exc))
+                    failed = True
+                    continue
+                catalog.add(info['name'], info['version'], filename)
+                added.append(info)
+                self.print_msg('Added %(name)s %(version)s.' % info)
+        except (IOError, OSError, ValueError, tarfile.TarError) as exc:
+            self.print_err('Could not read bundle "%s": %s' % (path, exc))
+            return 1
+        finally:
+            self._register_many(added)
+        if failed:
+            # The bundle may be applied again.
+            return 1
+        bundles[manifest['id']] = {'since': since,
+                                   'created': manifest['created'],
+                                   'files': sorted(packages)}
+        self._write_bundles(bundles)
+        return 0
+
+    def _extract(self, bundle_path, fp, size, info):
+        """Write the distribution read from ``fp`` (of the bundle at
+        ``bundle_path``) in the repository and check its digest.
+        """
+        path = self._get_download_path(info['name'], info['filename'])
+        tmp_path = self._get_partial_path(path)
+        digests = {}
+        if info.get('sha256'):
+            digests['sha256'] = info['sha256']
+        hashes = self._new_hashes(digests)
+        received = 0
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: fp.read(self.chunk_size), b''):
+                out.write(chunk)
+                for h in hashes.values():
+                    h.update(chunk)
+                received += len(chunk)
+        return self._check_retrieved(
+            '%s:%s' % (bundle_path, info['filename']), path, tmp_path,
+            hashes, digests, size, received)
+
+    def _register_many(self, infos):
+        """Record distributions that have been added to the catalog
+        (as described in a bundle manifest) in the indexes of the
+        repository.
+        """
+        if not infos:
+            return
+        requirements_entries = []
+        checksums_entries = []
+        for info in infos:
+            stat = self.os.stat(self._get_path(info['name'],
+                                               info['filename']))
+            key = (info['filename'], stat.st_size, stat.st_mtime)
+            requirements_entries.append(key + (info['requires'], ))
+            if info.get('sha256'):
+                checksums_entries.append(key + (info['sha256'], ))
+            self._record_dependencies(info['name'], info['version'],
+                                      info['requires'])
+        self.requirements_index.update(requirements_entries)
+        self.checksums.update(checksums_entries)
+        self._save_indexes()
+        self._update_simple_index([info['name'] for info in infos])
+        self._update_manifest()
+
+    def cmd_cache(self, action):
+        """Show statistics about the metadata cache or clear it."""
+        cache = self.cache
+        if cache is None:
+            self.print_err('There is no repository at "%s".' % self.root)
+            return 1
+        if action == 'clear':
+            cache.clear()
+            self.print_msg('Cache has been cleared.')
+            return 0
+        stats = cache.stats()
+        self.print_msg('Entries: %(entries)d (%(expired)d expired)' % stats)
+        self.print_msg('Size: %(size)d bytes' % stats)
+        return 0
+
     def cmd_download(self, packages):
         """Download requested packages (if we do not have the latest
         version already) as well as their requirements.
+
+        Each package is resolved only once, whatever the spelling used
+        to request it (see ``normalize()``) and the number of packages
+        that require it.
+
+        Engines report errors and carry on with other packages, but
+        the run returns 1 if a package could not be downloaded.
         """
+        self._failures = 0
+        try:
+            if self.engine == 'asyncio':
+                status = self._download_with_asyncio(packages)
+            elif self.engine == 'pipeline':
+                status = self._download_pipelined(packages)
+            elif self.jobs > 1:
+                status = self._download_in_parallel(packages)
+            else:
+                status = self._download_sequentially(packages)
+            # Distributions whose requirements are known from their
+            # metadata file are downloaded once all requirements are
+            # resolved.
+            self._download_all_resolved()
+            if self._failures and not status:
+                status = 1
+        finally:
+            # Keep what has been downloaded, even if the run has been
+            # interrupted.
+            self._save_indexes()
+        return status
+
+    def _download_sequentially(self, packages):
+        if len(packages) > 1:
+            self._prefetch(packages)
         self.packages = collections.deque(packages)
+        claimed = set()
+        resolved = set()
         while self.packages:
             package = self.packages.pop()
-            info = self._find_package_name(package)
-            if info is None:
-                self.print_err(
-                    'Could not find any package named "%s".' % package)
-                continue
-            if self._has_package(info['name'], info['version']):
-                self.print_msg(
-                    '%(name)s is already up to date (%(version)s).' % info)
+            if normalize(package) in resolved:
                 continue
-            url = self._find_package_url(info['name'], info['version'])
-            if url is None:
-                self.print_err(
-                    'Could not find a suitable distribution for '
-                    '%(name)s %(version)s.' % info)
-                continue
-            path = self._download(info['name'], info['version'], url)
-            self.print_msg('Added %(name)s %(version)s.' % info)
-            requirements = self._find_requirements(path)
-            if requirements:
-                self.print_msg('  -> requires: %s' % ', '.join(requirements))
-                self.packages.extendleft(requirements)
+            resolved.add(normalize(package))
+            messages, requirements = self._fetch(package, claimed)
+            self._print_messages(messages)
+            if len(requirements) > 1:
+                self._prefetch(requirements)
+            self.packages.extendleft(requirements)
         return 0
 
-    def cmd_prune(self, packages=()):
+    def cmd_prune(self, packages=(), fmt='text', dry_run=False):
         """Keep only the latest version of each downloaded package (or
         only those that are requested.
+
+        ``fmt`` is either 'text' or one of ``RECORD_FORMATS``, in which
+        case a record is written for each removed file (see
+        ``cmd_list()``) with the version that is kept. With
+        ``dry_run``, files that would be removed are only listed.
         """
-        requested = set([name.lower() for name in packages])
-        left = set(requested)
-        downloaded = collections.defaultdict(lambda: [])
-        for info in self.downloaded_packages:
-            downloaded[info['name'].lower()].append(info)
-        prune_all = len(requested) == 0
-        for name in sorted(downloaded.keys()):
-            if not prune_all and name not in requested:
-                continue
-            if len(downloaded[name]) == 1:
-                self.print_msg('%s has only one version. Nothing '
-                               'to prune.' % downloaded[name][0]['name'])
-                if not prune_all:
-                    left.remove(name)
-                continue
-            if not prune_all:
-                left.remove(name)
-            versions = downloaded[name]
-            versions = sorted(versions, key=lambda info: info['version'])
-            latest = versions[-1]['version']
-            for info in versions[:-1]:
-                self.os.remove(self.os.path.join(self.root, info['filename']))
-                self.print_msg('Removed %s %s (kept %s).' % (
-                        info['name'], info['version'], latest))
+        catalog = self.downloaded_packages
+        if packages:
+            requested = set([name.lower() for name in packages])
+        else:
+            requested = catalog.names()
+        left = []
+        removed = []
+
+        def plan():
+            for name in sorted(requested):
+                versions = catalog.get(name)
+                if not versions:
+                    left.append(name)
+                    continue
+                if len(versions) == 1:
+                    if fmt == 'text':
+                        self.print_msg('%s has only one version. Nothing '
+                                       'to prune.' % versions[0].name)
+                    continue
+                versions = sorted(versions, key=lambda dist: dist.version)
+                latest = versions[-1].version
+                for dist in versions[:-1]:
+                    yield dist, latest
+
+        def remove(dist):
+            if not dry_run:
+                self.os.remove(self._get_path(dist.name, dist.filename))
+                catalog.remove(dist)
+                removed.append(dist)
+
+        try:
+            if fmt == 'text':
+                for dist, latest in plan():
+                    remove(dist)
+                    if dry_run:
+                        self.print_msg('Would remove %s %s (keeping %s).' % (
+                                dist.name, dist.version, latest))
+                    else:
+                        self.print_msg('Removed %s %s (kept %s).' % (
+                                dist.name, dist.version, latest))
+            else:
+                def records():
+                    listed = {}
+                    for dist, latest in plan():
+                        # Get the size of the file before it is removed.
+                        record = self._get_record(dist, listed)
+                        record['kept'] = latest
+                        remove(dist)
+                        yield record
+
+                write_records(self.out, records(), fmt,
+                              RECORD_FIELDS + ('kept', ))
+        finally:
+            # Removed files must not be listed anywhere, even if the
+            # command fails (or its output is closed) halfway.
+            if removed:
+                for index in (self.requirements_index, self.checksums):
+                    if index is not None:
+                        index.discard([dist.filename for dist in removed])
+                self._save_indexes()
+                self._update_simple_index([dist.name for dist in removed])
+                self._update_manifest()
         for name in left:
             self.print_err('Package "%s" is not installed (or it is '
                            'there but you mistyped the package name).' % name)
         return 0
 
-    def cmd_update(self, packages=()):
+    def _read_serial(self):
+        """Return the changelog serial recorded by the last update
+        from the current index, or ``None``.
+        """
+        path = self._get_state_path(SERIAL)
+        if path is None:
+            return None
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+            if data['index'] != (self.index_url or self.endpoint):
+                return None
+            return int(data['serial'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_serial(self, serial):
+        path = self._get_state_path(SERIAL)
+        if path is not None:
+            write_json(path, {'index': self.index_url or self.endpoint,
+                              'serial': serial})
+
+    def _get_changed_packages(self, serial):
+        """Return a tuple ``(names, serial)`` where ``names`` is the
+        set of normalized names of downloaded packages that appear in
+        the changelog of the index since ``serial`` and ``serial`` is
+        the serial of the last event. Return ``None`` if the index
+        does not support changelogs.
+
+        Metadata of these packages is removed from the cache, so that
+        they are resolved again.
+        """
+        from basket.compat import xmlrpclib
+        try:
+            events = self.client.changelog_since_serial(serial)
+        except (xmlrpclib.Fault, xmlrpclib.ProtocolError,
+                NotImplementedError):
+            return None
+        downloaded = set(self.downloaded_packages.names())
+        changed = set()
+        stale_keys = []
+        for name, version, _, _, event_serial in events:
+            serial = max(serial, event_serial)
+            if normalize(name) not in downloaded:
+                continue
+            changed.add(normalize(name))
+            stale_keys.append(self._get_cache_key(
+                    'search:%s' % normalize(name)))
+            if version:
+                stale_keys.append(self._get_cache_key(
+                        'release_urls:%s/%s' % (name, version)))
+        if self.cache is not None and stale_keys:
+            self.cache.delete(stale_keys)
+        return changed, serial
+
+    def cmd_update(self, packages=(), full=False):
         """Check whether we have the latest version of the requested
         packages (or all downloaded ones if ``packages`` is not given)
         and download it if we do not.
 
+        Without ``packages``, we only check packages that have changed
+        since the last update, according to the changelog of the
+        index, unless ``full`` is true (or the index does not support
+        changelogs).
+
         If a new version is downloaded, the old version is kept. This
         is a feature.
+
+        The serial of the changelog is only recorded if all packages
+        have been downloaded, so that the next update retries those
+        that failed.
         """
-        if not packages:
-            packages = []
-            for info in self.downloaded_packages:
-                # record multiple-versions of packages only once
-                if info['name'] not in packages:
-                    packages.append(info['name'])
-            # reverse the order to please 'cmd_download()'
-            packages.sort(key=lambda name: name.lower(), reverse=True)
-        return self.cmd_download(packages)
+        from basket.compat import xmlrpclib
+        if packages:
+            return self.cmd_download(packages)
+        catalog = self.downloaded_packages
+        serial = None
+        if not full:
+            serial = self._read_serial()
+        changes = None
+        if serial is not None:
+            changes = self._get_changed_packages(serial)
+        if changes is not None:
+            names, serial = changes
+            if not names:
+                self.print_msg('No package has changed since the last '
+                               'update.')
+                self._write_serial(serial)
+                return 0
+        else:
+            # Get the serial before looking at packages, so that we do
+            # not miss changes that happen in the meantime.
+            try:
+                serial = self.client.changelog_last_serial()
+            except (xmlrpclib.Fault, xmlrpclib.ProtocolError,
+                    NotImplementedError):
+                serial = None
+            names = catalog.names()
+        # record multiple-versions of packages only once
+        packages = [catalog.get(name)[0].name for name in names]
+        # reverse the order to please 'cmd_download()'
+        packages.sort(key=lambda name: name.lower(), reverse=True)
+        status = self.cmd_download(packages)
+        if serial is not None and status == 0:
+            self._write_serial(serial)
+        return status
 
     def syntax_error(self, command=None, help=False):
         """Print help about the syntax of the command-line."""
@@ -297,29 +2192,77 @@ class Basket(object):
             self.print_err('Wrong syntax.')
         if command in (None, 'init'):
             self.print_err('Initialize a new repository (%s):' % self.root)
-            self.print_err('    basket init')
+            self.print_err('    basket init [--sharded]')
         if command in (None, 'download'):
             self.print_err('Download one or more packages:')
-            self.print_err('    basket download <package1> <package2> ...')
+            self.print_err('    basket download [--jobs N] '
+                           '[--engine threads|asyncio|pipeline] '
+                           '[--index-url URL] '
+                           '<package1> <package2> ...')
         if command in (None, 'list'):
             self.print_err('List all downloaded packages (or only the '
                            'requested ones):')
-            self.print_err('    basket list [<package1> <package2> ...]')
-        if command in (None, 'prune [<package1> <package2> ...]'):
+            self.print_err('    basket list [--format text|json|ndjson|tsv] '
+                           '[<package1> <package2> ...]')
+        if command in (None, 'prune'):
             self.print_err('Keep only the latest version of all packages (or '
                            'only the requested ones):')
-            self.print_err('    basket prune')
+            self.print_err('    basket prune [--dry-run] '
+                           '[--format text|json|ndjson|tsv] '
+                           '[<package1> <package2> ...]')
         if command in (None, 'update'):
             self.print_err('Download latest version of all packages (or '
                            'only the requested ones) if we do not already '
                            'have them:')
-            self.print_err('    basket update [<package1> <package2> ...]')
+            self.print_err('    basket update [--jobs N] '
+                           '[--engine threads|asyncio|pipeline] '
+                           '[--index-url URL] '
+                           '[--full] [<package1> <package2> ...]')
+        if command in (None, 'index'):
+            self.print_err('Build the simple index from scratch (it is '
+                           'otherwise kept up to date automatically):')
+            self.print_err('    basket index')
+        if command in (None, 'migrate'):
+            self.print_err('Move all files to the flat layout or to the '
+                           'sharded layout (one directory per package):')
+            self.print_err('    basket migrate flat|sharded')
+        if command in (None, 'graph'):
+            self.print_err('Print the dependency graph of all downloaded '
+                           'packages (or only the requested ones):')
+            self.print_err('    basket graph [--format text|dot|json] '
+                           '[<package1> <package2> ...]')
+        if command in (None, 'export'):
+            self.print_err('Export packages (and their requirements) to '
+                           'another repository, with hard links if '
+                           'possible:')
+            self.print_err('    basket export [-r requirements.txt] '
+                           '[<package1> <package2> ...] <destination>')
+        if command in (None, 'bundle'):
+            self.print_err('Write all packages (or only those added since '
+                           'a previous bundle) in a single file:')
+            self.print_err('    basket bundle [--since BUNDLE_ID] '
+                           '[--compress] <path>')
+        if command in (None, 'unbundle'):
+            self.print_err('Add packages of a bundle to the repository:')
+            self.print_err('    basket unbundle <path>')
+        if command in (None, 'serve'):
+            self.print_err('Serve the repository over HTTP:')
+            self.print_err('    basket serve [--host HOST] [--port PORT]')
+        if command in (None, 'cache'):
+            self.print_err('Show statistics about the metadata cache or '
+                           'clear it:')
+            self.print_err('    basket cache stats|clear')
         if command is None:
+            self.print_err('Print the time spent in each phase (and '
+                           'optionally write a Chrome trace), with any '
+                           'command:')
+            self.print_err('    basket <command> --profile '
+                           '[--trace trace.json] ...')
             self.print_err('Install from a Basket directory:')
             self.print_err('    easy_install -f %s -H None '
                            '<package>' % self.root)
-            self.print_err('    pip install --no-index -f '
-                           'file://%s <package>' % self.root)
+            self.print_err('    pip install --index-url '
+                           'file://%s/%s <package>' % (self.root, SIMPLE_DIR))
         return 1
 
 
@@ -332,20 +2275,132 @@ def main(argv=sys.argv, _basket_class=Basket):
     if command in ('help', '--help', '-h'):
         basket.syntax_error(help=True)
         return 0
+    # Profiling options are accepted by all commands.
+    profile = '--profile' in argv
+    if profile:
+        argv.remove('--profile')
+    try:
+        trace_path = pop_option(argv, '--trace',
+                                os.environ.get('BASKET_TRACE') or None)
+    except ValueError:
+        return basket.syntax_error()
+    if profile or trace_path or os.environ.get('BASKET_PROFILE'):
+        basket.tracer = Tracer()
+    try:
+        return run_command(basket, command, argv)
+    finally:
+        if basket.tracer.enabled:
+            for line in basket.tracer.summary():
+                basket.print_err(line)
+        if trace_path:
+            basket.tracer.write_chrome_trace(trace_path)
+            basket.print_err('Trace has been written to %s.' % trace_path)
+
+
+def run_command(basket, command, argv):
+    """Run ``command`` with the given arguments and options."""
+    if command in ('download', 'update'):
+        try:
+            basket.jobs = int(pop_option(argv, '--jobs', 1))
+        except ValueError:
+            return basket.syntax_error(command)
+        if basket.jobs < 1:
+            return basket.syntax_error(command)
+        try:
+            basket.engine = pop_option(argv, '--engine', 'threads')
+            basket.index_url = pop_option(argv, '--index-url',
+                                          basket.index_url)
+        except ValueError:
+            return basket.syntax_error(command)
+        if basket.engine not in ('threads', 'asyncio', 'pipeline'):
+            return basket.syntax_error(command)
+    if command == 'cache':
+        if argv not in (['stats'], ['clear']):
+            return basket.syntax_error('cache')
+        return basket.cmd_cache(argv[0])
     if command == 'download':
         if len(argv) < 1:
             return basket.syntax_error('download')
         return basket.cmd_download(argv)
+    if command == 'graph':
+        try:
+            fmt = pop_option(argv, '--format', 'text')
+        except ValueError:
+            return basket.syntax_error('graph')
+        if fmt not in ('text', 'dot', 'json'):
+            return basket.syntax_error('graph')
+        return basket.cmd_graph(argv, fmt)
+    if command == 'export':
+        requirement_files = []
+        try:
+            for option in ('-r', '--requirement'):
+                path = pop_option(argv, option)
+                while path is not None:
+                    requirement_files.append(path)
+                    path = pop_option(argv, option)
+        except ValueError:
+            return basket.syntax_error('export')
+        if len(argv) < 1 or (len(argv) < 2 and not requirement_files):
+            return basket.syntax_error('export')
+        return basket.cmd_export(argv[-1], argv[:-1], requirement_files)
+    if command == 'bundle':
+        compress = '--compress' in argv
+        if compress:
+            argv.remove('--compress')
+        try:
+            since = pop_option(argv, '--since')
+        except ValueError:
+            return basket.syntax_error('bundle')
+        if len(argv) != 1:
+            return basket.syntax_error('bundle')
+        return basket.cmd_bundle(argv[0], since, compress)
+    if command == 'unbundle':
+        if len(argv) != 1:
+            return basket.syntax_error('unbundle')
+        return basket.cmd_unbundle(argv[0])
+    if command == 'serve':
+        try:
+            host = pop_option(argv, '--host', '127.0.0.1')
+            port = int(pop_option(argv, '--port', 8000))
+        except ValueError:
+            return basket.syntax_error('serve')
+        if len(argv) != 0:
+            return basket.syntax_error('serve')
+        return basket.cmd_serve(host, port)
+    if command == 'index':
+        if len(argv) != 0:
+            return basket.syntax_error('index')
+        return basket.cmd_index()
     if command == 'init':
+        sharded = '--sharded' in argv
+        if sharded:
+            argv.remove('--sharded')
         if len(argv) != 0:
             return basket.syntax_error('init')
-        return basket.cmd_init()
+        return basket.cmd_init(sharded)
+    if command == 'migrate':
+        if len(argv) != 1 or argv[0] not in LAYOUTS:
+            return basket.syntax_error('migrate')
+        return basket.cmd_migrate(argv[0])
+    if command in ('list', 'prune'):
+        try:
+            fmt = pop_option(argv, '--format', 'text')
+        except ValueError:
+            return basket.syntax_error(command)
+        if fmt != 'text' and fmt not in RECORD_FORMATS:
+            return basket.syntax_error(command)
     if command == 'list':
-        return basket.cmd_list(argv)
+        return basket.cmd_list(argv, fmt)
     if command == 'prune':
-        return basket.cmd_prune(argv)
+        dry_run = '--dry-run' in argv
+        if dry_run:
+            argv.remove('--dry-run')
+        return basket.cmd_prune(argv, fmt, dry_run)
     if command == 'update':
-        return basket.cmd_update(argv)
+        full = '--full' in argv
+        if full:
+            argv.remove('--full')
+        return basket.cmd_update(argv, full)
     sys.exit(basket.syntax_error())
 
 
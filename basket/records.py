@@ -0,0 +1,54 @@
+"""Machine-readable output of commands (see the ``--format`` option of
+``list`` and ``prune``).
+
+Records are dictionaries with the same keys. They are written as soon
+as they are produced, so that the output of a large repository can be
+consumed incrementally:
+
+- 'json' writes a JSON array, with one record per line;
+
+- 'ndjson' writes one JSON object per line;
+
+- 'tsv' writes a header line with the name of each field, then one
+  line of tab-separated values per record (missing values are empty).
+"""
+
+import collections
+import json
+import os
+
+
+RECORD_FORMATS = ('json', 'ndjson', 'tsv')
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return repr(value)
+    return '%s' % value
+
+
+def write_records(stream, records, fmt, fields):
+    """Write ``records`` (an iterable of dictionaries) to ``stream`` in
+    the given format, with the given ``fields`` in this order.
+    """
+    if fmt == 'tsv':
+        stream.write('\t'.join(fields) + os.linesep)
+        for record in records:
+            stream.write('\t'.join(_format_value(record.get(field))
+                                   for field in fields) + os.linesep)
+        return
+    separator = None
+    if fmt == 'json':
+        stream.write('[')
+    for record in records:
+        data = json.dumps(collections.OrderedDict(
+                (field, record.get(field)) for field in fields))
+        if fmt == 'ndjson':
+            stream.write(data + os.linesep)
+            continue
+        stream.write((separator or os.linesep) + data)
+        separator = ',' + os.linesep
+    if fmt == 'json':
+        stream.write((separator and os.linesep or '') + ']' + os.linesep)
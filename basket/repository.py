@@ -0,0 +1,314 @@
+"""Helpers to store information about the content of the repository,
+so that we do not have to list (and parse) the whole directory each
+time Basket is run.
+"""
+
+import collections
+import json
+import os
+import re
+import tempfile
+
+
+MANIFEST_FORMAT = 1
+
+# A downloaded distribution. A tuple is much smaller than a dictionary
+# and we may have tens of thousands of them.
+Distribution = collections.namedtuple('Distribution',
+                                      ('name', 'version', 'filename'))
+
+# 'os.rename' does not overwrite an existing file on Windows.
+replace = getattr(os, 'replace', os.rename)
+
+
+def list_files(directory):
+    """Yield a ``(filename, size, mtime)`` tuple for each regular file
+    of ``directory`` (except hidden files), in a single pass.
+
+    On Windows, ``os.scandir()`` gets sizes and modification times
+    with the listing itself. Python < 3.5 does not have it: each file
+    is then stat'ed.
+    """
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:  # pragma: no cover
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            yield filename, stat.st_size, stat.st_mtime
+        return
+    for entry in scandir(directory):
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        stat = entry.stat()
+        yield entry.name, stat.st_size, stat.st_mtime
+
+
+def normalize(name):
+    """Return the normalized form of a project ``name``, as defined
+    by PEP 503: case does not matter and runs of '-', '_' and '.' are
+    equivalent.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def get_shard(name):
+    """Return the directory (relative to the root of the repository,
+    with '/' separators) that holds the files of the project ``name``
+    in the sharded layout, e.g. 'f/foo-bar' for 'Foo_Bar'.
+    """
+    name = normalize(name)
+    return '%s/%s' % (name[0], name)
+
+
+def read_manifest(path, mtime):
+    """Return the list of packages stored in the manifest at ``path``,
+    or ``None`` if there is no manifest or if it is stale, i.e. it has
+    not been written for the given ``mtime`` of the repository
+    directory.
+    """
+    try:
+        with open(path) as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if data.get('format') != MANIFEST_FORMAT or data.get('mtime') != mtime:
+        return None
+    return [Distribution(name, version, filename)
+            for filename, name, version in data['packages']]
+
+
+def write_json(path, data):
+    """Atomically write ``data`` as JSON at ``path``."""
+    # 'json.dumps()' uses the C encoder, 'json.dump()' does not.
+    data = json.dumps(data, separators=(',', ':'))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(data)
+        replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def write_manifest(path, mtime, packages):
+    """Atomically write the manifest of ``packages`` at ``path``.
+
+    ``mtime`` is the modification time of the repository directory
+    when its content matches ``packages`` (an iterable of
+    ``Distribution``).
+    """
+    data = {'format': MANIFEST_FORMAT,
+            'mtime': mtime,
+            'packages': [(dist.filename, dist.name, dist.version)
+                         for dist in packages]}
+    write_json(path, data)
+
+
+class Catalog(object):
+    """The collection of downloaded distributions, indexed by
+    normalized name (see ``normalize()``).
+
+    Iterating over the catalog yields distributions in the order in
+    which they have been added.
+    """
+
+    def __init__(self, distributions=()):
+        # An ordered set (values are not used), so that removing a
+        # distribution does not require to go through all of them.
+        self._distributions = collections.OrderedDict()
+        self._by_name = {}
+        for dist in distributions:
+            self._add(dist)
+
+    def __iter__(self):
+        return iter(self._distributions)
+
+    def __len__(self):
+        return len(self._distributions)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<Catalog %r>' % list(self._distributions)
+
+    def _add(self, dist):
+        if dist in self._distributions:
+            return
+        self._distributions[dist] = None
+        self._by_name.setdefault(normalize(dist.name), []).append(dist)
+
+    def add(self, name, version, filename):
+        """Add a distribution and return it."""
+        dist = Distribution(name, version, filename)
+        self._add(dist)
+        return dist
+
+    def remove(self, dist):
+        del self._distributions[dist]
+        key = normalize(dist.name)
+        self._by_name[key].remove(dist)
+        if not self._by_name[key]:
+            del self._by_name[key]
+
+    def names(self):
+        """Return the list of normalized names of all distributions."""
+        return list(self._by_name.keys())
+
+    def get(self, name):
+        """Return the list of distributions of the package ``name``
+        (which does not need to be normalized).
+        """
+        return list(self._by_name.get(normalize(name), ()))
+
+    def has(self, name, version):
+        """Return whether we have the given ``version`` of the package
+        ``name``.
+        """
+        for dist in self._by_name.get(normalize(name), ()):
+            if (dist.name, dist.version) == (name, version):
+                return True
+        return False
+
+    def latest(self, name):
+        """Return the latest distribution of the package ``name``, or
+        ``None`` if there is none.
+        """
+        dists = self._by_name.get(normalize(name))
+        if not dists:
+            return None
+        return max(dists, key=lambda dist: dist.version)
+
+
+class ShardedCatalog(Catalog):
+    """The catalog of a repository with the sharded layout (see
+    ``get_shard()``).
+
+    The directory of a project is only listed when the project is
+    looked up. All directories are listed when iterating over the
+    catalog (or when asking for all names).
+
+    ``list_project(name)`` must return the distributions in the
+    directory of the project ``name`` (which is normalized) and
+    ``list_projects()`` the normalized names of all projects that
+    have a directory.
+    """
+
+    def __init__(self, list_project, list_projects):
+        Catalog.__init__(self)
+        self._list_project = list_project
+        self._list_projects = list_projects
+        self._loaded = set()
+        self._complete = False
+
+    def _load(self, name):
+        key = normalize(name)
+        if self._complete or key in self._loaded:
+            return
+        self._loaded.add(key)
+        for dist in self._list_project(key):
+            self._add(dist)
+
+    def _load_all(self):
+        if self._complete:
+            return
+        for name in self._list_projects():
+            self._load(name)
+        self._complete = True
+
+    def __iter__(self):
+        self._load_all()
+        return Catalog.__iter__(self)
+
+    def __len__(self):
+        self._load_all()
+        return Catalog.__len__(self)
+
+    def __repr__(self):
+        return '<ShardedCatalog %r>' % list(self._distributions)
+
+    def add(self, name, version, filename):
+        # The directory of the project may already list the new file.
+        self._load(name)
+        for dist in self._by_name.get(normalize(name), ()):
+            if dist.filename == filename:
+                return dist
+        return Catalog.add(self, name, version, filename)
+
+    def names(self):
+        self._load_all()
+        return Catalog.names(self)
+
+    def get(self, name):
+        self._load(name)
+        return Catalog.get(self, name)
+
+    def has(self, name, version):
+        self._load(name)
+        return Catalog.has(self, name, version)
+
+    def latest(self, name):
+        self._load(name)
+        return Catalog.latest(self, name)
+
+
+class ArchiveIndex(object):
+    """Information about downloaded archives (e.g. their requirements
+    or their checksum), so that each archive is opened only once.
+
+    Entries are keyed by file name. The size and the modification time
+    of the archive are stored as well: if the archive changes, its
+    entry is ignored.
+
+    Entries are kept in memory: the index is only written by
+    ``save()``, once per command.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._modified = False
+        try:
+            with open(path) as fp:
+                self._entries = json.load(fp)
+        except (IOError, OSError, ValueError):
+            self._entries = {}
+
+    def get(self, filename, size, mtime):
+        """Return the value stored for the archive, or ``None`` if it
+        is not known.
+        """
+        entry = self._entries.get(filename)
+        if entry is None or entry[:2] != [size, mtime]:
+            return None
+        return entry[2]
+
+    def set(self, filename, size, mtime, value):
+        self._entries[filename] = [size, mtime, value]
+        self._modified = True
+
+    def update(self, entries):
+        """Store ``entries`` (a list of ``(filename, size, mtime,
+        value)`` tuples).
+        """
+        for filename, size, mtime, value in entries:
+            self._entries[filename] = [size, mtime, value]
+            self._modified = True
+
+    def discard(self, filenames):
+        """Remove entries of the given ``filenames`` (if any)."""
+        for filename in filenames:
+            if self._entries.pop(filename, None) is not None:
+                self._modified = True
+
+    def save(self):
+        """Write the index if it has been modified."""
+        if not self._modified:
+            return
+        write_json(self.path, self._entries)
+        self._modified = False
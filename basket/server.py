@@ -0,0 +1,211 @@
+"""A small HTTP server for the repository, so that other machines can
+use it as an index (with ``--index-url http://host:port/simple/``) or
+as a list of links (with ``--find-links http://host:port/``).
+
+Files are sent with ``os.sendfile()`` when available. Each client is
+served by its own thread.
+"""
+
+import mimetypes
+import os
+import posixpath
+import shutil
+import socket
+from email.utils import formatdate
+from email.utils import parsedate_tz
+from email.utils import mktime_tz
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from basket.compat import quote
+from basket.compat import unquote
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+LISTING_TEMPLATE = '''<!DOCTYPE html>
+<html>
+  <head><title>%(title)s</title></head>
+  <body>
+%(links)s
+  </body>
+</html>
+'''
+
+
+class RepositoryServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+    allow_reuse_address = True
+
+    def __init__(self, root, address):
+        HTTPServer.__init__(self, address, RepositoryHandler)
+        self.root = os.path.abspath(root)
+        # Directory listings, keyed by path and cached as long as the
+        # modification time of the directory does not change.
+        self.listings = {}
+
+
+class RepositoryHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'Basket'
+    sendfile = getattr(os, 'sendfile', None)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        path = self._translate_path(self.path)
+        if path is None:
+            return self._send_error(404)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self._send_error(404)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                return self._redirect(self.path.split('?', 1)[0] + '/')
+            index = os.path.join(path, 'index.html')
+            if os.path.exists(index):
+                return self._send_file(index, os.stat(index), send_body)
+            return self._send_listing(path, stat, send_body)
+        return self._send_file(path, stat, send_body)
+
+    def _translate_path(self, url_path):
+        """Return the path of the requested file, or ``None`` if it is
+        outside of the repository or if it is hidden.
+        """
+        url_path = unquote(url_path.split('?', 1)[0])
+        parts = [part for part in posixpath.normpath(url_path).split('/')
+                 if part]
+        for part in parts:
+            if part.startswith('.') or os.sep in part:
+                return None
+        return os.path.join(self.server.root, *parts)
+
+    def _is_fresh(self, etag, mtime):
+        """Return whether the client already has the current version
+        of the resource.
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            parsed = parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return int(mtime) <= mktime_tz(parsed)
+        return False
+
+    def _send_headers(self, status, content_type, length, etag, mtime):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.end_headers()
+
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_file(self, path, stat, send_body):
+        etag = '"%x-%x"' % (stat.st_size, int(stat.st_mtime * 1000))
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        if self._is_fresh(etag, stat.st_mtime):
+            return self._send_not_modified(etag)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            return self._send_error(404)
+        with fp:
+            self._send_headers(200, content_type, stat.st_size, etag,
+                               stat.st_mtime)
+            if send_body:
+                self._copy(fp, stat.st_size)
+
+    def _copy(self, fp, size):
+        """Send ``size`` bytes of the file ``fp`` to the client."""
+        self.wfile.flush()
+        if self.sendfile is not None:
+            offset = 0
+            out_fd = self.connection.fileno()
+            try:
+                while offset < size:
+                    sent = self.sendfile(out_fd, fp.fileno(), offset,
+                                         size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except (OSError, socket.error):
+                if offset:
+                    raise
+                # sendfile() is not supported for this file or socket.
+        shutil.copyfileobj(fp, self.wfile)
+
+    def _send_listing(self, path, stat, send_body):
+        cached = self.server.listings.get(path)
+        if cached is None or cached[0] != stat.st_mtime:
+            links = []
+            for filename in sorted(os.listdir(path)):
+                if filename.startswith('.'):
+                    continue
+                if os.path.isdir(os.path.join(path, filename)):
+                    filename += '/'
+                links.append('    <a href=%s>%s</a><br>' % (
+                        quoteattr(quote(filename)),
+                        escape(filename)))
+            body = LISTING_TEMPLATE % {'title': escape(self.path),
+                                       'links': '\n'.join(links)}
+            cached = (stat.st_mtime, body.encode('utf-8'))
+            self.server.listings[path] = cached
+        mtime, body = cached
+        etag = '"listing-%x-%x"' % (len(body), int(mtime * 1000))
+        if self._is_fresh(etag, mtime):
+            return self._send_not_modified(etag)
+        self._send_headers(200, 'text/html; charset=utf-8', len(body),
+                           etag, mtime)
+        if send_body:
+            self.wfile.write(body)
+
+    def _redirect(self, location):
+        self.send_response(301)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_error(self, status):
+        body = ('%d %s\n' % (status, self.responses[status][0]))
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def make_server(root, host, port):
+    """Return a server for the repository at ``root``. Call its
+    ``serve_forever()`` method to start it.
+    """
+    return RepositoryServer(root, (host, port))
@@ -0,0 +1,85 @@
+"""Maintain a PEP 503 "simple" index of the repository, so that pip
+can be used with ``--index-url file:///path/to/root/simple``. Unlike
+``--find-links``, pip then only looks at the pages of the projects
+that it needs.
+
+Each page is rewritten only when the files of its project change.
+"""
+
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from basket.repository import replace
+
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta name="pypi:repository-version" content="1.0">
+    <title>%(title)s</title>
+  </head>
+  <body>
+%(links)s
+  </body>
+</html>
+'''
+
+
+def _write_page(path, title, links):
+    """Atomically write an HTML page with the given ``links`` (a list
+    of ``(href, text)`` tuples).
+    """
+    links = '\n'.join('    <a href=%s>%s</a><br>' % (
+            quoteattr(href), escape(text)) for href, text in links)
+    html = PAGE_TEMPLATE % {'title': escape(title), 'links': links}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(html)
+        os.chmod(tmp_path, 0o644)
+        replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def write_root_page(simple_dir, names):
+    """Write the root page that lists all projects. ``names`` must be
+    normalized.
+    """
+    links = [('%s/' % name, name) for name in sorted(names)]
+    _write_page(os.path.join(simple_dir, 'index.html'), 'Simple index',
+                links)
+
+
+def write_project_page(simple_dir, name, files):
+    """Write the page of the project ``name`` (which must be
+    normalized) or remove it if there is no file.
+
+    ``files`` is a list of ``(path, sha256)`` tuples where ``path`` is
+    relative to the root of the repository and ``sha256`` may be
+    ``None`` if the digest is not known.
+
+    Return whether the list of projects has changed, in which case
+    the root page must be written again.
+    """
+    project_dir = os.path.join(simple_dir, name)
+    existed = os.path.isdir(project_dir)
+    if not files:
+        if existed:
+            shutil.rmtree(project_dir)
+        return existed
+    if not existed:
+        os.mkdir(project_dir)
+    links = []
+    for path, sha256 in sorted(files):
+        href = '../../%s' % path
+        if sha256:
+            href += '#sha256=%s' % sha256
+        links.append((href, os.path.basename(path)))
+    _write_page(os.path.join(project_dir, 'index.html'),
+                'Links for %s' % name, links)
+    return not existed
@@ -0,0 +1,271 @@
+import sys
+import unittest
+from unittest import TestCase
+
+from basket.repository import normalize
+from basket.tests.test_http import ThreadingXMLRPCServer
+from basket.tests.test_http import start_server
+
+try:
+    from xmlrpc.server import SimpleXMLRPCRequestHandler
+except ImportError:  # pragma: no cover
+    # Python 2
+    from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+
+
+requires_asyncio = unittest.skipIf(sys.version_info < (3, 5),
+                                   'asyncio engine requires Python 3.5')
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/pypi', )
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address[1], self.path))
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'da', b'ta'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/files/data')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePyPI(object):
+    """An XML-RPC server with the 'search' and 'release_urls' methods
+    of PyPI, that also serves files.
+    """
+
+    def __init__(self, packages):
+        from basket.tests.test_main import make_tar
+        self.server = ThreadingXMLRPCServer(('127.0.0.1', 0), Handler,
+                                            logRequests=False)
+        self.server.requests = []
+        self.server.files = {'/files/data': b'data'}
+        self.server.register_function(self.search, 'search')
+        self.server.register_function(self.release_urls, 'release_urls')
+        self.server.register_multicall_functions()
+        self.url = start_server(self.server)
+        self.endpoint = self.url + '/pypi'
+        self.packages = {}
+        for name, requires in packages.items():
+            path = '/files/%s-1.0.tar.gz' % name
+            self.server.files[path] = make_tar(name, '1.0', requires)
+            self.packages[normalize(name)] = name
+
+    def search(self, spec):
+        name = self.packages.get(normalize(spec['name']))
+        if name is None:
+            return []
+        return [{'name': name, 'version': '1.0'}]
+
+    def release_urls(self, name, version):
+        url = '%s/files/%s-%s.tar.gz' % (self.url, name, version)
+        return [{'python_version': 'source', 'url': url}]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_loop(test):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    test.addCleanup(loop.close)
+    return loop
+
+
+@requires_asyncio
+class TestAsyncConnectionPool(TestCase):
+
+    def setUp(self):
+        from basket.aio import AsyncConnectionPool
+        self.pypi = FakePyPI({'Foo': []})
+        self.addCleanup(self.pypi.close)
+        self.loop = make_loop(self)
+        self.pool = AsyncConnectionPool(2)
+        self.addCleanup(self.pool.close)
+
+    def _get(self, path):
+        response = self.loop.run_until_complete(
+            self.pool.open(self.pypi.url + path))
+        try:
+            return self.loop.run_until_complete(response.read())
+        finally:
+            response.close()
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.assertEqual(self._get('/files/data'), b'data')
+        ports = set(port for port, _ in self.pypi.server.requests)
+        self.assertEqual(len(self.pypi.server.requests), 3)
+        self.assertEqual(len(ports), 1)
+
+    def test_chunked_response(self):
+        self.assertEqual(self._get('/chunked'), b'data')
+        self.assertEqual(self._get('/chunked'), b'data')
+        ports = set(port for port, _ in self.pypi.server.requests)
+        self.assertEqual(len(ports), 1)
+
+    def test_redirection(self):
+        self.assertEqual(self._get('/redirect'), b'data')
+        self.assertEqual([path for _, path in self.pypi.server.requests],
+                         ['/redirect', '/files/data'])
+
+    def test_error(self):
+        from basket.compat import HTTPError
+        try:
+            self._get('/missing')
+        except HTTPError as exc:
+            self.assertEqual(exc.code, 404)
+        else:  # pragma: no cover
+            self.fail('HTTPError was not raised.')
+
+    def test_xmlrpc(self):
+        from basket.aio import AsyncXMLRPCClient
+        client = AsyncXMLRPCClient(self.pool, self.pypi.endpoint)
+        single = self.loop.run_until_complete(
+            client.call('release_urls', 'Foo', '1.0'))
+        self.assertEqual(single[0]['url'],
+                         self.pypi.url + '/files/Foo-1.0.tar.gz')
+        multiple = self.loop.run_until_complete(client.multicall(
+                [('search', ({'name': 'bar'}, )),
+                 ('release_urls', ('Foo', '1.0'))]))
+        self.assertEqual(list(multiple), [[], single])
+
+
+@requires_asyncio
+class TestAsyncEngine(TestCase):
+
+    def setUp(self):
+        # Foo and Bar both require Baz, which must be downloaded once.
+        self.pypi = FakePyPI({'Foo': ['baz', 'unknown'],
+                              'Bar': ['Baz>=1.0'],
+                              'Baz': []})
+        self.addCleanup(self.pypi.close)
+
+    def _download(self, engine, packages, index_url=None, status=0):
+        import os
+        import shutil
+        import tempfile
+        from basket.main import Basket
+        from basket.tests.test_main import DummyStream
+        basket = Basket()
+        basket.root = tempfile.mkdtemp()
+        basket.endpoint = self.pypi.endpoint
+        basket.index_url = index_url
+        basket.engine = engine
+        basket.out = DummyStream()
+        basket.err = DummyStream()
+
+        def cleanup():
+            if getattr(basket, '_cache', None) is not None:
+                basket._cache.close()
+            shutil.rmtree(basket.root)
+
+        self.addCleanup(cleanup)
+        self.assertEqual(basket.cmd_download(packages), status)
+        out = sorted(basket.out.stream.split(os.linesep))
+        err = sorted(basket.err.stream.split(os.linesep))
+        return basket, out, err
+
+    def test_same_messages_as_threads(self):
+        packages = ['Foo', 'Bar', 'foo', 'Missing']
+        _, out, err = self._download('threads', list(packages))
+        basket, aio_out, aio_err = self._download('asyncio', list(packages))
+        self.assertEqual(aio_out, out)
+        self.assertEqual(aio_err, err)
+        self.assertTrue('Added Baz 1.0.' in aio_out)
+        self.assertTrue('Could not find any package named "unknown".'
+                        in aio_err)
+        self.assertEqual(sorted(dist.filename
+                                for dist in basket.downloaded_packages),
+                         ['Bar-1.0.tar.gz', 'Baz-1.0.tar.gz',
+                          'Foo-1.0.tar.gz'])
+
+    def test_download_error(self):
+        del self.pypi.server.files['/files/Baz-1.0.tar.gz']
+        _, out, err = self._download('asyncio', ['Bar'], status=1)
+        self.assertTrue('Added Bar 1.0.' in out)
+        self.assertTrue([line for line in err
+                         if line.startswith('Could not download "Baz"')])
+
+    def test_normalized_names(self):
+        self.pypi = FakePyPI({'Foo': ['zope-interface', 'zope_interface',
+                                      'Zope.Interface'],
+                              'Zope.Interface': []})
+        self.addCleanup(self.pypi.close)
+        _, out, _ = self._download('asyncio', ['Foo'])
+        self.assertEqual(out, ['', '  -> requires: zope-interface, '
+                               'zope_interface, Zope.Interface',
+                               'Added Foo 1.0.', 'Added Zope.Interface 1.0.'])
+
+    def test_files_are_downloaded_once(self):
+        basket, _, _ = self._download('asyncio', ['Foo', 'Bar'])
+        downloads = [path for _, path in self.pypi.server.requests
+                     if path.startswith('/files/')]
+        self.assertEqual(sorted(downloads),
+                         ['/files/Bar-1.0.tar.gz', '/files/Baz-1.0.tar.gz',
+                          '/files/Foo-1.0.tar.gz'])
+        self.assertTrue(basket._get_checksum('Foo', 'Foo-1.0.tar.gz'))
+
+    def test_already_up_to_date(self):
+        from basket.aio import AsyncEngine
+        from basket.tests.test_main import DummyStream
+        basket, _, _ = self._download('asyncio', ['Baz'])
+        basket.out = DummyStream()
+        self.assertEqual(AsyncEngine(basket).run(['Baz']), 0)
+        self.assertEqual(basket.out.stream.strip(),
+                         'Baz is already up to date (1.0).')
+
+    def test_local_index(self):
+        import os
+        import shutil
+        import tempfile
+        from basket.tests.test_main import make_tar
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        with open(os.path.join(index_dir, 'Foo-1.0.tar.gz'), 'wb') as fp:
+            fp.write(make_tar('Foo', '1.0', ['bar']))
+        with open(os.path.join(index_dir, 'Bar-1.0.tar.gz'), 'wb') as fp:
+            fp.write(make_tar('Bar', '1.0'))
+        _, out, _ = self._download('asyncio', ['Foo'], index_dir)
+        self.assertTrue('Added Bar 1.0.' in out)
+        self.assertEqual(self.pypi.server.requests, [])
+
+    def test_metadata_files(self):
+        import shutil
+        import tempfile
+        from basket.tests.test_main import make_metadata_index
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        make_metadata_index(index_dir, {'Foo': (['bar'], ['wrong'], True),
+                                        'Bar': ([], [], True)})
+        basket, out, _ = self._download('asyncio', ['Foo'], index_dir)
+        self.assertTrue('  -> requires: bar' in out)
+        self.assertTrue('Added Bar 1.0.' in out)
+        self.assertEqual(sorted(dist.filename
+                                for dist in basket.downloaded_packages),
+                         ['Bar-1.0.tar.gz', 'Foo-1.0.tar.gz'])
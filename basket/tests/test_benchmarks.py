@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+
+class TestBenchmarks(TestCase):
+
+    def setUp(self):
+        try:
+            import benchmarks
+        except ImportError:  # pragma: no cover
+            benchmarks = None
+        if benchmarks is None:  # pragma: no cover
+            self.skipTest('benchmarks are not installed')
+
+    def test_run_and_compare(self):
+        from benchmarks.run import compare
+        from benchmarks.run import run
+        from basket.tests.test_main import DummyStream
+        out = DummyStream()
+        results = run([6], repeat=1, out=out)
+        self.assertEqual(sorted(results['results']),
+                         ['download', 'list-cold', 'list-warm', 'prune',
+                          'scan', 'startup', 'update'])
+        # The closure of the downloaded package has 6 packages.
+        self.assertEqual(
+            results['results']['download']['6']['requests']['files'], 6)
+        slower = {'results': {'scan': {'6': {'min': 0.0}},
+                              'prune': {'6': {'min': 1000.0}}}}
+        self.assertEqual(compare(slower, results, out=out), 1)
+
+    def test_fake_pypi_files(self):
+        import os
+        import shutil
+        import tempfile
+        from benchmarks.fakepypi import FakePyPI
+        files_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, files_dir)
+        pypi = FakePyPI(files_dir)
+        self.addCleanup(pypi.server.server_close)  # never started
+        pypi.add('Foo', '1.0')
+        pypi.add('Foo', '2.0', ['bar'])
+        self.assertEqual(pypi.get_file('Foo-1.0.tar.gz'), None)
+        path = pypi.get_file('Foo-2.0.tar.gz')
+        self.assertEqual(path, os.path.join(files_dir, 'Foo-2.0.tar.gz'))
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+
+class TestBundle(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_file(self, filename, data):
+        import os
+        path = os.path.join(self.tmp_dir, filename)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def test_new_bundle_id(self):
+        from basket.bundle import new_bundle_id
+        first, second = new_bundle_id(), new_bundle_id()
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(first), len('20120514T120000-abcdef'))
+
+    def test_write_and_read(self):
+        import os
+        from basket.bundle import read_bundle
+        from basket.bundle import write_bundle
+        source = self._write_file('Foo-1.0.tar.gz', b'data')
+        for compress in (False, True):
+            path = os.path.join(self.tmp_dir, 'bundle.tar')
+            write_bundle(path, {'format': 1, 'id': 'abc'},
+                         [('Foo-1.0.tar.gz', source)], compress)
+            items = read_bundle(path)
+            self.assertEqual(next(items), {'format': 1, 'id': 'abc'})
+            filename, size, fp = next(items)
+            self.assertEqual((filename, size, fp.read()),
+                             ('Foo-1.0.tar.gz', 4, b'data'))
+            self.assertEqual(list(items), [])
+
+    def test_not_a_bundle(self):
+        import tarfile
+        from basket.bundle import read_bundle
+        path = self._write_file('Foo-1.0.tar.gz', b'data')
+        self.assertRaises((ValueError, tarfile.TarError), list,
+                          read_bundle(path))
+        path = self._write_file('empty.tar', b'')
+        with tarfile.open(path, 'w'):
+            pass
+        self.assertRaises(ValueError, list, read_bundle(path))
+
+    def test_other_members_are_ignored(self):
+        import io
+        import json
+        import os
+        import tarfile
+        from basket.bundle import read_bundle
+        path = os.path.join(self.tmp_dir, 'bundle.tar')
+        with tarfile.open(path, 'w') as archive:
+            for name, data in (
+                    ('BUNDLE.json', json.dumps({'format': 1}).encode()),
+                    ('files/../../evil', b'evil'),
+                    ('files/.hidden', b'hidden'),
+                    ('files/Foo-1.0.tar.gz', b'data')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        names = [item[0] for item in list(read_bundle(path))[1:]]
+        self.assertEqual(names, ['Foo-1.0.tar.gz'])
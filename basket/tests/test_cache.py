@@ -0,0 +1,103 @@
+from unittest import TestCase
+
+
+class TestMetadataCache(TestCase):
+
+    def _make_one(self, max_size=1000):
+        import os
+        import shutil
+        import tempfile
+        from basket.cache import MetadataCache
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        cache = MetadataCache(os.path.join(tmp_dir, 'cache.sqlite'),
+                              max_size)
+        self.addCleanup(cache.close)
+        self.now = 1000
+        cache.time = lambda: self.now
+        return cache
+
+    def test_get_missing(self):
+        cache = self._make_one()
+        self.assertEqual(cache.get('foo'), None)
+
+    def test_set_and_get(self):
+        cache = self._make_one()
+        cache.set('foo', [{'name': 'Foo'}])
+        self.assertEqual(cache.get('foo'), [{'name': 'Foo'}])
+
+    def test_set_replaces_entry(self):
+        cache = self._make_one()
+        cache.set('foo', 'a' * 10)
+        cache.set('foo', 'b')
+        self.assertEqual(cache.get('foo'), 'b')
+        self.assertEqual(cache.stats()['size'], 3)
+
+    def test_delete(self):
+        cache = self._make_one()
+        cache.set('foo', 'bar')
+        cache.set('baz', 'bar')
+        cache.delete(['foo', 'unknown'])
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.get('baz'), 'bar')
+        self.assertEqual(cache.stats()['size'], 5)
+
+    def test_expiration(self):
+        cache = self._make_one()
+        cache.set('foo', 'bar', ttl=10)
+        self.now += 5
+        self.assertEqual(cache.get('foo'), 'bar')
+        self.now += 10
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.stats(),
+                         {'entries': 1, 'expired': 1, 'size': 5})
+
+    def test_eviction_of_least_recently_used_entries(self):
+        cache = self._make_one(max_size=30)
+        cache.set('foo', 'a' * 9)
+        self.now += 1
+        cache.set('bar', 'b' * 9)
+        self.now += 1
+        cache.get('foo')
+        self.now += 1
+        cache.set('baz', 'c' * 9)  # 3 * 11 bytes
+        self.assertEqual(cache.get('bar'), None)
+        self.assertEqual(cache.get('foo'), 'a' * 9)
+        self.assertEqual(cache.get('baz'), 'c' * 9)
+
+    def test_get_does_not_write(self):
+        cache = self._make_one()
+        cache.set('foo', 'bar')
+        changes = cache._db.total_changes
+        for _ in range(10):
+            cache.get('foo')
+        self.assertEqual(cache._db.total_changes, changes)
+
+    def test_flush_access_times(self):
+        from basket.cache import MetadataCache
+        cache = self._make_one()
+        cache.set('foo', 'bar')
+        self.now += 10
+        cache.get('foo')
+        cache.flush()
+        other = MetadataCache(cache.path, cache.max_size)
+        self.addCleanup(other.close)
+        self.assertEqual(other._db.execute(
+                'SELECT accessed FROM entries WHERE key = ?',
+                ('foo', )).fetchone()[0], 1010)
+
+    def test_eviction_of_expired_entries_first(self):
+        cache = self._make_one(max_size=30)
+        cache.set('foo', 'a' * 9)
+        cache.set('bar', 'b' * 9, ttl=1)
+        self.now += 2
+        cache.set('baz', 'c' * 9)
+        self.assertEqual(cache.stats(),
+                         {'entries': 2, 'expired': 0, 'size': 22})
+
+    def test_clear(self):
+        cache = self._make_one()
+        cache.set('foo', 'bar')
+        cache.clear()
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.stats()['entries'], 0)
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+
+class TestLinkOrCopy(TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'Foo-1.0.tar.gz')
+        self.destination = os.path.join(self.tmp_dir, 'copy.tar.gz')
+        with open(self.source, 'wb') as fp:
+            fp.write(b'data')
+        os.utime(self.source, (1000000000, 1000000000))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp_dir)
+
+    def _disable_hard_links(self):
+        import os
+        link = os.link
+
+        def restore():
+            os.link = link
+
+        def no_link(source, destination):
+            raise OSError(18, 'Invalid cross-device link')
+
+        self.addCleanup(restore)
+        os.link = no_link
+
+    def test_hard_link(self):
+        import os
+        from basket.export import link_or_copy
+        self.assertEqual(link_or_copy(self.source, self.destination),
+                         'hardlink')
+        self.assertTrue(os.path.samefile(self.source, self.destination))
+
+    def test_fallback(self):
+        import os
+        from basket.export import link_or_copy
+        self._disable_hard_links()
+        method = link_or_copy(self.source, self.destination)
+        # Reflinks are not supported by all file systems.
+        self.assertTrue(method in ('reflink', 'copy'))
+        self.assertFalse(os.path.samefile(self.source, self.destination))
+        with open(self.destination, 'rb') as fp:
+            self.assertEqual(fp.read(), b'data')
+        self.assertEqual(os.stat(self.destination).st_mtime, 1000000000)
+
+    def test_reflink_not_supported(self):
+        from basket import export
+        fcntl = export.fcntl
+
+        def restore():
+            export.fcntl = fcntl
+
+        self.addCleanup(restore)
+        export.fcntl = None
+        self._disable_hard_links()
+        self.assertEqual(export.link_or_copy(self.source, self.destination),
+                         'copy')
+        self.assertRaises(OSError, export.reflink, self.source,
+                          self.destination)
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+
+class TestDependencyGraph(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def _make_one(self):
+        import os
+        from basket.graph import DependencyGraph
+        return DependencyGraph(os.path.join(self.dir, 'graph.json'))
+
+    def test_add(self):
+        graph = self._make_one()
+        graph.add('Foo_Bar', '1.0', ['Baz', 'baz', 'Zope.Interface'])
+        self.assertTrue('foo-bar' in graph)
+        self.assertEqual(graph.get('foo.bar'),
+                         ('Foo_Bar', '1.0', ['baz', 'zope-interface']))
+        self.assertEqual(graph.get('baz'), None)
+
+    def test_closure(self):
+        graph = self._make_one()
+        graph.add('A', '1', ['B', 'C'])
+        graph.add('B', '1', ['D', 'A'])
+        graph.add('C', '1', ['D'])
+        self.assertEqual(graph.closure(['a']), ['a', 'b', 'c', 'd'])
+        self.assertEqual(graph.closure(['C', 'b']), ['c', 'b', 'd', 'a'])
+
+    def test_save(self):
+        graph = self._make_one()
+        graph.add('Foo', '1.0', ['Bar'])
+        graph.save()
+        self.assertEqual(self._make_one().get('foo'), ('Foo', '1.0', ['bar']))
+
+    def test_save_only_if_modified(self):
+        import os
+        graph = self._make_one()
+        graph.save()
+        self.assertFalse(os.path.exists(graph.path))
+        graph.add('Foo', '1.0', [])
+        graph.save()
+        os.remove(graph.path)
+        graph.add('Foo', '1.0', [])
+        graph.save()
+        self.assertFalse(os.path.exists(graph.path))
+
+    def test_to_dot(self):
+        graph = self._make_one()
+        graph.add('Foo', '1.0', ['Bar'])
+        self.assertEqual(graph.to_dot(graph.closure(['foo'])),
+                         'digraph dependencies {\n'
+                         '    "foo" [label="Foo 1.0"];\n'
+                         '    "foo" -> "bar";\n'
+                         '    "bar" [style=dashed];\n'
+                         '}')
+
+    def test_to_json(self):
+        import json
+        graph = self._make_one()
+        graph.add('Foo', '1.0', ['Bar'])
+        self.assertEqual(json.loads(graph.to_json(['foo', 'bar'])),
+                         {'foo': {'name': 'Foo', 'version': '1.0',
+                                  'requires': ['bar']},
+                          'bar': None})
@@ -0,0 +1,179 @@
+import threading
+from unittest import TestCase
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCRequestHandler
+    from xmlrpc.server import SimpleXMLRPCServer
+except ImportError:  # pragma: no cover
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+    from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.client_address[1], self.path))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/file')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/file':
+            self.send_response(200)
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'data')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.url = start_server(self.server)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_one(self, size=2):
+        from basket.http import ConnectionPool
+        pool = ConnectionPool(size)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connection_is_reused(self):
+        pool = self._make_one()
+        for _ in range(3):
+            with pool.open(self.url + '/file') as response:
+                self.assertEqual(response.getcode(), 200)
+                self.assertEqual(response.read(), b'data')
+        ports = set(port for port, _ in self.server.requests)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(ports), 1)
+
+    def test_partially_read_response_is_not_reused(self):
+        pool = self._make_one()
+        with pool.open(self.url + '/file') as response:
+            response.read(1)
+        with pool.open(self.url + '/file') as response:
+            response.read()
+        ports = set(port for port, _ in self.server.requests)
+        self.assertEqual(len(ports), 2)
+
+    def test_redirection(self):
+        pool = self._make_one()
+        with pool.open(self.url + '/redirect') as response:
+            self.assertEqual(response.read(), b'data')
+        self.assertEqual([path for _, path in self.server.requests],
+                         ['/redirect', '/file'])
+
+    def test_error(self):
+        from basket.compat import HTTPError
+        pool = self._make_one()
+        try:
+            pool.open(self.url + '/missing')
+        except HTTPError as exc:
+            self.assertEqual(exc.code, 404)
+        else:  # pragma: no cover
+            self.fail('HTTPError was not raised.')
+
+    def test_stale_connection(self):
+        pool = self._make_one()
+        with pool.open(self.url + '/file') as response:
+            response.read()
+        # Simulate a connection that has been closed by the server.
+        for idle in pool._idle.values():
+            for connection in idle:
+                connection.sock.close()
+        with pool.open(self.url + '/file') as response:
+            self.assertEqual(response.read(), b'data')
+
+    def test_file(self):
+        import os
+        import tempfile
+        from basket.compat import HTTPError
+        from basket.compat import pathname2url
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b'data')
+        pool = self._make_one()
+        with pool.open('file://' + pathname2url(path)) as response:
+            self.assertEqual(response.getcode(), 200)
+            self.assertEqual(response.info().get('Content-Length'), '4')
+            self.assertEqual(response.read(2), b'da')
+            self.assertEqual(response.read(), b'ta')
+        self.assertRaises(HTTPError, pool.open,
+                          'file://' + pathname2url(path + '.missing'))
+        self.assertEqual(self.server.requests, [])
+
+    def test_pool_size(self):
+        pool = self._make_one(size=1)
+        responses = [pool.open(self.url + '/file') for _ in range(3)]
+        for response in responses:
+            response.read()
+            response.close()
+        self.assertEqual(sum(len(idle) for idle in pool._idle.values()), 1)
+
+
+class TestPooledTransport(TestCase):
+
+    def setUp(self):
+        class RequestHandler(SimpleXMLRPCRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingXMLRPCServer(('127.0.0.1', 0), RequestHandler,
+                                         logRequests=False)
+        self.server.register_function(lambda x: x * 2, 'double')
+        self.server.register_multicall_functions()
+        self.url = start_server(self.server)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_it(self):
+        from basket.compat import xmlrpclib
+        from basket.http import ConnectionPool
+        from basket.http import PooledTransport
+        pool = ConnectionPool(2)
+        self.addCleanup(pool.close)
+        client = xmlrpclib.ServerProxy(self.url + '/RPC2',
+                                       PooledTransport(pool, 'http'))
+        self.assertEqual(client.double(2), 4)
+        self.assertEqual(client.double(3), 6)
+        self.assertEqual(sum(len(idle) for idle in pool._idle.values()), 1)
@@ -0,0 +1,271 @@
+import json
+from unittest import TestCase
+
+from basket.tests.test_http import ThreadingHTTPServer
+from basket.tests.test_http import start_server
+
+try:
+    from http.server import BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+
+JSON_PAGE = {
+    'meta': {'api-version': '1.0'},
+    'name': 'foo',
+    'files': [
+        {'filename': 'Foo-1.0.tar.gz', 'url': '../../files/Foo-1.0.tar.gz',
+         'hashes': {'sha256': 'abc'}},
+        {'filename': 'Foo-1.1-py3-none-any.whl',
+         'url': 'https://files.example.com/Foo-1.1-py3-none-any.whl',
+         'hashes': {}, 'core-metadata': {'sha256': 'def'}},
+        {'filename': 'Foo-1.1.tar.gz', 'url': '/files/Foo-1.1.tar.gz',
+         'hashes': {}, 'dist-info-metadata': True},
+        {'filename': 'Foo-2.0.tar.gz', 'url': '/files/Foo-2.0.tar.gz',
+         'hashes': {}, 'yanked': 'Broken.'},
+        {'filename': 'Foo-3.0b1.tar.gz', 'url': '/files/Foo-3.0b1.tar.gz',
+         'hashes': {}},
+    ]}
+
+HTML_PAGE = '''<!DOCTYPE html>
+<html><body>
+<a href="../../files/Foo-1.0.tar.gz#sha256=abc">Foo-1.0.tar.gz</a>
+<a href="/files/Foo-1.1.tar.gz" data-dist-info-metadata="sha256=def"
+   >Foo-1.1.tar.gz</a>
+<a href="/files/Foo-2.0.tar.gz" data-yanked="">Foo-2.0.tar.gz</a>
+</body></html>
+'''
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.get('If-None-Match')))
+        if self.path != '/simple/foo/':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'json' in self.headers.get('Accept', '') and self.server.json:
+            body = json.dumps(JSON_PAGE).encode('utf-8')
+            content_type = 'application/vnd.pypi.simple.v1+json'
+        else:
+            body = HTML_PAGE.encode('utf-8')
+            content_type = 'text/html'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestVersions(TestCase):
+
+    def test_version_key(self):
+        from basket.index import version_key
+        versions = ['0.9', '1.0.dev1', '1.0a1', '1.0a2.dev1', '1.0a2',
+                    '1.0b1', '1.0rc1', '1.0', '1.0.post1', '1.0.1',
+                    '1.9', '1.10', '2!0.1']
+        self.assertEqual(sorted(reversed(versions), key=version_key),
+                         versions)
+        self.assertEqual(version_key('1.0'), version_key('1.0.0'))
+        self.assertTrue(version_key('unparsable') < version_key('0.1'))
+
+    def test_get_latest_version(self):
+        from basket.index import get_latest_version
+        self.assertEqual(get_latest_version(['1.9', '1.10', '2.0b1']),
+                         '1.10')
+        self.assertEqual(get_latest_version(['2.0b1', '2.0a1']), '2.0b1')
+
+    def test_split_filename(self):
+        from basket.index import split_filename
+        self.assertEqual(split_filename('zope.interface-4.0.tar.gz'),
+                         {'name': 'zope.interface', 'version': '4.0',
+                          'packagetype': 'sdist',
+                          'python_version': 'source'})
+        self.assertEqual(split_filename('Foo-1.0-py2.py3-none-any.whl'),
+                         {'name': 'Foo', 'version': '1.0',
+                          'packagetype': 'bdist_wheel',
+                          'python_version': 'py2.py3'})
+        self.assertEqual(split_filename('Foo-1.0-py2.7.egg'), None)
+        self.assertEqual(split_filename('index.html'), None)
+
+
+class TestParseProjectPage(TestCase):
+
+    url = 'https://example.com/simple/foo/'
+
+    def test_json(self):
+        from basket.index import parse_project_page
+        files = parse_project_page(
+            self.url, json.dumps(JSON_PAGE).encode('utf-8'),
+            'application/vnd.pypi.simple.v1+json')
+        self.assertEqual(files[0],
+                         {'filename': 'Foo-1.0.tar.gz',
+                          'url': 'https://example.com/files/Foo-1.0.tar.gz',
+                          'hashes': {'sha256': 'abc'},
+                          'yanked': False,
+                          'metadata': False})
+        self.assertEqual(files[1]['metadata'], {'sha256': 'def'})
+        self.assertEqual(files[2]['metadata'], True)
+        self.assertEqual(files[3]['yanked'], True)
+
+    def test_html(self):
+        from basket.index import parse_project_page
+        files = parse_project_page(self.url, HTML_PAGE.encode('utf-8'),
+                                   'text/html; charset=utf-8')
+        self.assertEqual(files[0],
+                         {'filename': 'Foo-1.0.tar.gz',
+                          'url': 'https://example.com/files/Foo-1.0.tar.gz',
+                          'hashes': {'sha256': 'abc'},
+                          'yanked': False,
+                          'metadata': False})
+        self.assertEqual(files[1]['metadata'], {'sha256': 'def'})
+        self.assertEqual([info['yanked'] for info in files],
+                         [False, False, True])
+
+
+class TestSimpleIndex(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.json = True
+        self.url = start_server(self.server) + '/simple/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_one(self, cache=None):
+        from basket.http import ConnectionPool
+        from basket.index import SimpleIndex
+        pool = ConnectionPool(2)
+        self.addCleanup(pool.close)
+        return SimpleIndex(self.url, pool, cache)
+
+    def _make_cache(self):
+        import os
+        import shutil
+        import tempfile
+        from basket.cache import MetadataCache
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        cache = MetadataCache(os.path.join(tmp_dir, 'cache.sqlite'), 10000)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_search(self):
+        index = self._make_one()
+        # Yanked files and pre-releases are ignored.
+        self.assertEqual(index.search({'name': 'Foo'}),
+                         [{'name': 'Foo', 'version': '1.1'}])
+        self.assertEqual(index.search({'name': 'bar'}), [])
+
+    def test_search_html(self):
+        self.server.json = False
+        index = self._make_one()
+        self.assertEqual(index.search({'name': 'foo'}),
+                         [{'name': 'Foo', 'version': '1.1'}])
+
+    def test_release_urls(self):
+        index = self._make_one()
+        releases = index.release_urls('Foo', '1.1')
+        self.assertEqual(
+            [(info['filename'], info['python_version']) for info in releases],
+            [('Foo-1.1-py3-none-any.whl', 'py3'),
+             ('Foo-1.1.tar.gz', 'source')])
+        self.assertEqual(releases[1]['url'],
+                         self.url.replace('/simple/', '/files/Foo-1.1.tar.gz'))
+        self.assertEqual(index.release_urls('Foo', '1.0')[0]['digests'],
+                         {'sha256': 'abc'})
+
+    def test_one_request_per_project(self):
+        index = self._make_one()
+        index.search({'name': 'foo'})
+        index.release_urls('Foo', '1.1')
+        index.release_urls('foo', '1.0')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_conditional_request(self):
+        cache = self._make_cache()
+        files = self._make_one(cache).get_files('foo')
+        self.assertEqual(self._make_one(cache).get_files('foo'), files)
+        self.assertEqual(self.server.requests,
+                         [('/simple/foo/', None), ('/simple/foo/', '"v1"')])
+
+    def test_changelog_is_not_supported(self):
+        index = self._make_one()
+        self.assertRaises(NotImplementedError, index.changelog_last_serial)
+
+
+class TestLocalIndex(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def _make_one(self, path):
+        from basket.http import ConnectionPool
+        from basket.index import get_index
+        return get_index(path, ConnectionPool(1))
+
+    def test_flat_directory(self):
+        import os
+        for filename in ('Foo_Bar-1.0.tar.gz', 'foo-bar-1.1.zip',
+                         'Baz-1.0.tar.gz', 'README'):
+            open(os.path.join(self.dir, filename), 'w').close()
+        index = self._make_one(self.dir)
+        self.assertEqual(index.search({'name': 'foo.bar'}),
+                         [{'name': 'foo-bar', 'version': '1.1'}])
+        url = index.release_urls('Foo_Bar', '1.0')[0]['url']
+        self.assertTrue(url.startswith('file://'))
+        from basket.http import open_file
+        with open_file(url) as response:
+            self.assertEqual(response.read(), b'')
+
+    def test_simple_tree(self):
+        import os
+        from basket.simple import write_project_page
+        simple_dir = os.path.join(self.dir, 'simple')
+        os.mkdir(simple_dir)
+        open(os.path.join(self.dir, 'Foo-1.0.tar.gz'), 'w').close()
+        write_project_page(simple_dir, 'foo', [('Foo-1.0.tar.gz', 'abc')])
+        index = self._make_one('file://' + simple_dir)
+        self.assertEqual(index.search({'name': 'Foo'}),
+                         [{'name': 'Foo', 'version': '1.0'}])
+        release = index.release_urls('Foo', '1.0')[0]
+        self.assertEqual(release['url'],
+                         'file://' + os.path.join(self.dir, 'Foo-1.0.tar.gz'))
+        self.assertEqual(release['digests'], {'sha256': 'abc'})
+        self.assertEqual(index.search({'name': 'bar'}), [])
+
+    def test_get_index(self):
+        from basket.http import ConnectionPool
+        from basket.index import LocalIndex
+        from basket.index import SimpleIndex
+        from basket.index import get_index
+        pool = ConnectionPool(1)
+        self.assertTrue(isinstance(get_index(self.dir, pool), LocalIndex))
+        self.assertTrue(isinstance(get_index('file://' + self.dir, pool),
+                                   LocalIndex))
+        index = get_index('https://example.com/simple', pool)
+        self.assertTrue(isinstance(index, SimpleIndex))
+        self.assertEqual(index.url, 'https://example.com/simple/')
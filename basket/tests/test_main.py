@@ -19,6 +19,42 @@ class TestGetPackageName(TestCase):
         self.assertEqual(self.call_fut('foo<1.2'), 'foo')
         self.assertEqual(self.call_fut('foo==1.2'), 'foo')
 
+    def test_requires_dist(self):
+        self.assertEqual(self.call_fut('foo (>=1.2)'), 'foo')
+        self.assertEqual(self.call_fut('foo[bar]>=1.2'), 'foo')
+        self.assertEqual(self.call_fut('foo.bar~=1.2'), 'foo.bar')
+        self.assertEqual(
+            self.call_fut('foo; python_version < "3"'), 'foo')
+
+
+class TestParseMetadata(TestCase):
+
+    def call_fut(self, text):
+        from basket.main import parse_metadata
+        return parse_metadata(text.splitlines(True))
+
+    def test_old_metadata(self):
+        metadata = ('Metadata-Version: 1.1\n'
+                    'Name: Foo\n'
+                    'Requires-Dist: Bar\n')
+        self.assertEqual(self.call_fut(metadata), (['Bar'], False))
+
+    def test_recent_metadata(self):
+        metadata = ('Metadata-Version: 2.2\n'
+                    'Name: Foo\n'
+                    'Requires-Dist: Bar (>=1.0)\n'
+                    'Requires-Dist: Baz; extra == "test"\n'
+                    '\n'
+                    'Requires-Dist: not a header\n')
+        self.assertEqual(self.call_fut(metadata),
+                         (['Bar (>=1.0)', 'Baz; extra == "test"'], True))
+
+    def test_dynamic_requirements(self):
+        metadata = ('Metadata-Version: 2.2\n'
+                    'Name: Foo\n'
+                    'Dynamic: Requires-Dist\n')
+        self.assertEqual(self.call_fut(metadata), ([], False))
+
 
 class TestGetNameAndVersion(TestCase):
 
@@ -37,13 +73,226 @@ class TestGetNameAndVersion(TestCase):
                          {'name': 'foo-bar', 'version': '1.2'})
         self.assertEqual(self.call_fut('foo-bar-1.2.tar.bz2'),
                          {'name': 'foo-bar', 'version': '1.2'})
+        self.assertEqual(self.call_fut('foo_bar-1.2-py3-none-any.whl'),
+                         {'name': 'foo_bar', 'version': '1.2'})
+
+
+class TestPopOption(TestCase):
+
+    def call_fut(self, argv, option, default=None):
+        from basket.main import pop_option
+        return pop_option(argv, option, default)
+
+    def test_separate_value(self):
+        argv = ['--jobs', '4', 'Foo']
+        self.assertEqual(self.call_fut(argv, '--jobs'), '4')
+        self.assertEqual(argv, ['Foo'])
+
+    def test_inline_value(self):
+        argv = ['Foo', '--jobs=4']
+        self.assertEqual(self.call_fut(argv, '--jobs'), '4')
+        self.assertEqual(argv, ['Foo'])
+
+    def test_missing_option(self):
+        argv = ['Foo']
+        self.assertEqual(self.call_fut(argv, '--jobs', 1), 1)
+        self.assertEqual(argv, ['Foo'])
+
+    def test_missing_value(self):
+        self.assertRaises(ValueError, self.call_fut, ['--jobs'], '--jobs')
+
+
+class TestRequirementsFromArchives(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_tar(self, filename, members):
+        import io
+        import os
+        import tarfile
+        path = os.path.join(self.tmp_dir, filename)
+        mode = 'w:%s' % filename.rsplit('.', 1)[1]
+        with tarfile.open(path, mode) as archive:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return path
+
+    def _make_zip(self, filename, members):
+        import os
+        import zipfile
+        path = os.path.join(self.tmp_dir, filename)
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, data in members:
+                archive.writestr(name, data)
+        return path
+
+    def _find_requirements(self, path):
+        from basket.main import Basket
+        basket = Basket()
+        basket.root = self.tmp_dir + '-does-not-exist'
+        return basket._find_requirements(path)
+
+    def test_tar_egg_info(self):
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 1.0\n'),
+                ('Foo-1.0/Foo.egg-info/PKG-INFO', b''),
+                ('Foo-1.0/Foo.egg-info/requires.txt', b'Bar>=1.0\n'),
+                ('Foo-1.0/setup.py', b'')))
+        self.assertEqual(self._find_requirements(path), ['Bar'])
+
+    def test_tar_bz2_egg_info(self):
+        path = self._make_tar('Foo-1.0.tar.bz2', (
+                ('Foo-1.0/Foo.egg-info/requires.txt', b'Bar>=1.0\n'), ))
+        self.assertEqual(self._find_requirements(path), ['Bar'])
+
+    def test_tgz_egg_info(self):
+        import os
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/Foo.egg-info/requires.txt', b'Bar>=1.0\n'), ))
+        tgz_path = os.path.join(self.tmp_dir, 'Foo-1.0.tgz')
+        os.rename(path, tgz_path)
+        self.assertEqual(self._find_requirements(tgz_path), ['Bar'])
+
+    def test_tar_stops_after_egg_info(self):
+        import os
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/Foo.egg-info/PKG-INFO', b''),
+                ('Foo-1.0/big_file', os.urandom(100000))))
+        # Truncate the archive: we would get an error if we tried to
+        # read the big file.
+        with open(path, 'r+b') as fp:
+            fp.truncate(os.path.getsize(path) // 2)
+        self.assertEqual(self._find_requirements(path), [])
+
+    def test_tar_pkg_info(self):
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 2.2\n'
+                                     b'Requires-Dist: Bar (>=1.0)\n'),
+                ('Foo-1.0/setup.py', b'')))
+        self.assertEqual(self._find_requirements(path), ['Bar'])
+
+    def test_tar_old_pkg_info(self):
+        # e.g. an sdist made by flit or poetry, without '.egg-info'.
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 2.1\n'
+                                     b'Requires-Dist: requests\n'),
+                ('Foo-1.0/pyproject.toml', b'')))
+        self.assertEqual(self._find_requirements(path), ['requests'])
+
+    def test_tar_egg_info_over_old_pkg_info(self):
+        path = self._make_tar('Foo-1.0.tar.gz', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 2.1\n'
+                                     b'Requires-Dist: Bar\n'),
+                ('Foo-1.0/Foo.egg-info/requires.txt', b'Bar\nBaz\n')))
+        self.assertEqual(self._find_requirements(path), ['Bar', 'Baz'])
+
+    def test_zip_egg_info(self):
+        path = self._make_zip('foo-bar-1.0.zip', (
+                ('foo-bar-1.0/setup.py', b''),
+                ('foo-bar-1.0/foo_bar.egg-info/requires.txt', b'Baz\n')))
+        self.assertEqual(self._find_requirements(path), ['Baz'])
+
+    def test_zip_egg_info_in_src(self):
+        path = self._make_zip('Foo-1.0.zip', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 1.0\n'),
+                ('Foo-1.0/src/Foo.egg-info/requires.txt', b'Baz\n')))
+        self.assertEqual(self._find_requirements(path), ['Baz'])
+
+    def test_zip_pkg_info(self):
+        path = self._make_zip('Foo-1.0.zip', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 2.2\n'
+                                     b'Requires-Dist: Baz\n'), ))
+        self.assertEqual(self._find_requirements(path), ['Baz'])
+
+    def test_zip_old_pkg_info(self):
+        path = self._make_zip('Foo-1.0.zip', (
+                ('Foo-1.0/PKG-INFO', b'Metadata-Version: 2.1\n'
+                                     b'Requires-Dist: requests\n'), ))
+        self.assertEqual(self._find_requirements(path), ['requests'])
+
+    def test_wheel(self):
+        path = self._make_zip('Foo-1.0-py3-none-any.whl', (
+                ('foo/__init__.py', b''),
+                ('Foo-1.0.dist-info/METADATA', b'Metadata-Version: 2.1\n'
+                                               b'Requires-Dist: Baz\n')))
+        self.assertEqual(self._find_requirements(path), ['Baz'])
+
+
+def make_tar(name, version, requires=()):
+    """Return a gzipped sdist of ``name`` ``version`` whose egg-info
+    lists ``requires``.
+    """
+    import io
+    import tarfile
+    data = ('\n'.join(requires) + '\n').encode('utf-8')
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+        info = tarfile.TarInfo('%s-%s/%s.egg-info/requires.txt' % (
+                name, version, name))
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def make_metadata_index(path, packages):
+    """Make a tree of PEP 503 pages at ``path``, where each package
+    of ``packages`` (a mapping of names to tuples ``(requirements of
+    the metadata file, requirements of the archive, value of the
+    'data-core-metadata' attribute)``) has a version 1.0 and a
+    separate metadata file.
+    """
+    import hashlib
+    import os
+    for name, (requires, archive_requires, attribute) in packages.items():
+        filename = '%s-1.0.tar.gz' % name
+        with open(os.path.join(path, filename), 'wb') as fp:
+            fp.write(make_tar(name, '1.0', archive_requires))
+        metadata = 'Metadata-Version: 2.2\nName: %s\nVersion: 1.0\n' % name
+        for requirement in requires:
+            metadata += 'Requires-Dist: %s\n' % requirement
+        metadata = metadata.encode('utf-8')
+        with open(os.path.join(path, filename + '.metadata'), 'wb') as fp:
+            fp.write(metadata)
+        if attribute is True:
+            attribute = 'sha256=%s' % hashlib.sha256(metadata).hexdigest()
+        os.mkdir(os.path.join(path, name.lower()))
+        with open(os.path.join(path, name.lower(), 'index.html'), 'w') as fp:
+            fp.write('<a href="../%s" data-core-metadata="%s">%s</a>' % (
+                    filename, attribute, filename))
 
 
 class TestBasket(TestCase):
 
     def _make_one(self):
         from basket.main import Basket
-        return Basket()
+        basket = Basket()
+        # Make sure that we never touch a real repository.
+        basket.root = '/path/of/basket/root'
+        return basket
+
+    def _make_repository(self, streams=False):
+        import shutil
+        import tempfile
+        basket = self._make_one()
+        basket.root = tempfile.mkdtemp()
+        if streams:
+            basket.out = DummyStream()
+            basket.err = DummyStream()
+        def cleanup():
+            if basket._cache is not None:
+                basket._cache.close()
+            shutil.rmtree(basket.root)
+        basket._cache = None
+        self.addCleanup(cleanup)
+        return basket
 
     def test_client_property(self):
         basket = self._make_one()
@@ -53,19 +302,107 @@ class TestBasket(TestCase):
 
     def test_download_packages(self):
         basket = self._make_one()
+        import os
         class FakeOs(object):
+            path = os.path
             def __init__(self, subdirs):
                 self.subdirs = subdirs
             def listdir(self, dir):
                 return self.subdirs
         basket.os = FakeOs(['Foo-1.2.tar.gz', 'Bar-1.0.tar.bz2'])
-        expected = [{'filename': 'Foo-1.2.tar.gz',
-                     'name': 'Foo',
-                     'version': '1.2'},
-                    {'filename': 'Bar-1.0.tar.bz2',
-                     'name': 'Bar',
-                     'version': '1.0'}]
+        expected = make_catalog(('Foo', '1.2', 'Foo-1.2.tar.gz'),
+                                ('Bar', '1.0', 'Bar-1.0.tar.bz2'))
+        self.assertEqual(basket.downloaded_packages, expected)
+
+    def test_downloaded_packages_are_read_from_manifest(self):
+        import os
+        basket = self._make_repository()
+        open(os.path.join(basket.root, 'Foo-1.0.tar.gz'), 'w').close()
+        expected = make_catalog(('Foo', '1.0', 'Foo-1.0.tar.gz'))
         self.assertEqual(basket.downloaded_packages, expected)
+        # Another process should not list the directory.
+        basket._downloaded_packages = None
+        basket.os = Mock(path=os.path, stat=os.stat)
+        self.assertEqual(basket.downloaded_packages, expected)
+        self.assertEqual(basket.os.called[0][0], 'stat')
+        self.assertEqual(len(basket.os.called), 1)
+
+    def test_downloaded_packages_stale_manifest(self):
+        import os
+        basket = self._make_repository()
+        open(os.path.join(basket.root, 'Foo-1.0.tar.gz'), 'w').close()
+        basket.downloaded_packages
+        # Simulate a modification outside of Basket.
+        os.utime(basket.root, (1, 1))
+        open(os.path.join(basket.root, 'Bar-1.0.zip'), 'w').close()
+        basket._downloaded_packages = None
+        self.assertEqual(sorted(dist.filename
+                                for dist in basket.downloaded_packages),
+                         ['Bar-1.0.zip', 'Foo-1.0.tar.gz'])
+
+    def test_downloaded_packages_read_only(self):
+        import errno
+        import os
+        basket = self._make_repository(streams=True)
+        open(os.path.join(basket.root, 'Foo-1.0.tar.gz'), 'w').close()
+        def mkdir(path):
+            raise OSError(errno.EACCES, 'Permission denied', path)
+        basket.os = Mock(path=os.path, stat=os.stat, listdir=os.listdir,
+                         mkdir=mkdir)
+        self.assertEqual(basket.cmd_list(), 0)
+        self.assertEqual(basket.out.stream, 'Foo 1.0' + os.linesep)
+        self.assertTrue(('mkdir', ) in [call[:1]
+                                        for call in basket.os.called])
+        self.assertEqual(os.listdir(basket.root), ['Foo-1.0.tar.gz'])
+
+    def test_downloaded_packages_manifest_not_written(self):
+        import errno
+        import os
+        from basket import main
+        basket = self._make_repository()
+        open(os.path.join(basket.root, 'Foo-1.0.tar.gz'), 'w').close()
+        def write_manifest(path, mtime, packages):
+            raise IOError(errno.EROFS, 'Read-only file system', path)
+        self.addCleanup(setattr, main, 'write_manifest', main.write_manifest)
+        main.write_manifest = write_manifest
+        self.assertEqual(basket.downloaded_packages,
+                         make_catalog(('Foo', '1.0', 'Foo-1.0.tar.gz')))
+
+    def test_download_updates_manifest(self):
+        import os
+        basket = self._make_repository()
+        basket.downloaded_packages
+        basket._http = FakeHttp()
+        basket._download('Foo', '1.0', 'http://example.com/Foo-1.0.tar.gz')
+        # The manifest is written at the end of the command.
+        basket._save_indexes()
+        basket._downloaded_packages = None
+        basket.os = Mock(path=os.path, stat=os.stat)
+        self.assertEqual(basket.downloaded_packages,
+                         make_catalog(('Foo', '1.0', 'Foo-1.0.tar.gz')))
+
+    def test_cmd_download_writes_manifest_once(self):
+        from basket import main
+        basket = self._make_repository()
+        basket.downloaded_packages
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'},
+                                      {'name': 'Bar', 'version': '2.0'}],
+                              release_urls=release_urls)
+        basket._find_requirements = lambda path: 'Foo' in path and ['Bar'] or []
+        written = []
+        write_manifest = main.write_manifest
+        def counting_write_manifest(path, mtime, packages):
+            written.append(len(packages))
+            write_manifest(path, mtime, packages)
+        main.write_manifest = counting_write_manifest
+        self.addCleanup(setattr, main, 'write_manifest', write_manifest)
+        self.assertEqual(basket.cmd_download(['Foo']), 0)
+        self.assertEqual(written, [2])
 
     def test_find_package_name(self):
         basket = self._make_one()
@@ -82,6 +419,87 @@ class TestBasket(TestCase):
         basket._client = Mock(search=results)
         self.assertEqual(basket._find_package_name('Foo'), None)
 
+    def test_call_many_multicall(self):
+        basket = self._make_one()
+        basket._client = FakeServer(lambda spec: [spec['name']],
+                                    lambda name, version: [version])
+        calls = [('search', ({'name': 'foo'}, )),
+                 ('release_urls', ('Foo', '1.0'))]
+        self.assertEqual(basket._call_many(calls), [['foo'], ['1.0']])
+        self.assertEqual(basket._client.requests, 1)
+
+    def test_call_many_multicall_not_supported(self):
+        basket = self._make_one()
+        basket._client = FakeServer(lambda spec: [spec['name']],
+                                    lambda name, version: [version],
+                                    multicall=False)
+        calls = [('search', ({'name': 'foo'}, )),
+                 ('release_urls', ('Foo', '1.0'))]
+        self.assertEqual(basket._call_many(calls), [['foo'], ['1.0']])
+        self.assertFalse(basket._multicall_supported)
+        # 1 rejected multicall + 2 individual calls
+        self.assertEqual(basket._client.requests, 3)
+
+    def test_call_many_rejected_call(self):
+        from basket.compat import xmlrpclib
+        basket = self._make_one()
+        def search(spec):
+            if spec['name'] == 'bar' and basket._client.requests == 1:
+                raise xmlrpclib.Fault(1, 'Try again later.')
+            return [spec['name']]
+        basket._client = FakeServer(search, None)
+        calls = [('search', ({'name': 'foo'}, )),
+                 ('search', ({'name': 'bar'}, ))]
+        self.assertEqual(basket._call_many(calls), [['foo'], ['bar']])
+        self.assertTrue(basket._multicall_supported)
+        self.assertEqual(basket._client.requests, 2)
+
+    def test_prefetch(self):
+        basket = self._make_one()
+        basket._downloaded_packages = make_catalog(('Bar', '1.0'))
+        def search(spec):
+            return [{'name': spec['name'].capitalize(), 'version': '1.0'}]
+        basket._client = FakeServer(search, lambda name, version: [])
+        basket._prefetch(['Foo', 'foo', 'Bar', 'Baz'])
+        # One request for the search, one for the releases
+        self.assertEqual(basket._client.requests, 2)
+        self.assertEqual(sorted(basket._search_results.keys()),
+                         ['bar', 'baz', 'foo'])
+        # We already have Bar, no need to look for its releases.
+        self.assertEqual(sorted(basket._release_urls.keys()),
+                         [('Baz', '1.0'), ('Foo', '1.0')])
+        self.assertEqual(basket._find_package_name('Foo'),
+                         {'name': 'Foo', 'version': '1.0'})
+        self.assertEqual(basket._client.requests, 2)
+
+    def test_search_uses_cache(self):
+        basket = self._make_repository()
+        results = [{'name': 'Foo', 'version': '1.0'}]
+        basket._client = Mock(search=results)
+        self.assertEqual(basket._search('Foo'), results)
+        # A new process would not have the results in memory.
+        basket._search_results = {}
+        basket._client = Mock(search=())
+        self.assertEqual(basket._search('Foo'), results)
+        self.assertEqual(basket._client.called, [])
+
+    def test_search_negative_result_expires(self):
+        basket = self._make_repository()
+        basket._client = Mock(search=())
+        basket._search('Foo')
+        entry = basket.cache._db.execute(
+            'SELECT expires - accessed FROM entries').fetchone()
+        self.assertEqual(entry[0], basket.cache_negative_ttl)
+
+    def test_release_urls_are_kept_forever(self):
+        basket = self._make_repository()
+        results = [{'python_version': 'source', 'url': 'url-of-source'}]
+        basket._client = Mock(release_urls=results)
+        basket._get_release_urls('Foo', '1.0')
+        entry = basket.cache._db.execute(
+            'SELECT expires FROM entries').fetchone()
+        self.assertEqual(entry[0], None)
+
     def test_find_package_url(self):
         basket = self._make_one()
         results = [{'python_version': 'egg', 'url': 'url-of-egg'},
@@ -140,9 +558,23 @@ class TestBasket(TestCase):
                          'Could not open "path.zip" (unknown archive '
                          'format).' + os.linesep)
 
+    def test_find_requirements_uses_index(self):
+        import os
+        basket = self._make_repository()
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        open(path, 'w').close()
+        scanned = []
+        def scan_requirements(path):
+            scanned.append(path)
+            return ['Bar']
+        basket._scan_requirements = scan_requirements
+        self.assertEqual(basket._find_requirements(path), ['Bar'])
+        self.assertEqual(basket._find_requirements(path), ['Bar'])
+        self.assertEqual(scanned, [path])
+
     def test_has_packages(self):
         basket = self._make_one()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'))
         self.assertTrue(basket._has_package('Foo', '1.0'))
         self.assertFalse(basket._has_package('Foo', '2.0'))
         self.assertFalse(basket._has_package('Bar', '1.0'))
@@ -152,17 +584,176 @@ class TestBasket(TestCase):
         package = 'Foo'
         version = '1.0'
         url = 'http://example.com/Foo-1.0.tar.gz'
-        basket = self._make_one()
-        basket.root = '/path/of/basket/root'
-        basket.urllib = Mock(urlretrieve='data')
-        basket._downloaded_packages = []
+        basket = self._make_repository()
+        basket._http = FakeHttp({url: b'data'})
+        basket._downloaded_packages = make_catalog()
         target_path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
         self.assertEqual(basket._download(package, version, url),
                          target_path)
         self.assertEqual(basket._downloaded_packages,
-                         [{'name': package, 'version': version}])
-        self.assertEqual(basket.urllib.called,
-                         [('urlretrieve', (url, target_path), {}), ])
+                         make_catalog((package, version, 'Foo-1.0.tar.gz')))
+        self.assertEqual(basket._http.requested, [(url, None)])
+        with open(target_path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'data')
+
+    def test_retrieve_in_chunks(self):
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket.chunk_size = 3
+        basket._http = FakeHttp({url: b'0123456789'})
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        basket._retrieve(url, path)
+        self.assertEqual(basket._http.responses[0].reads, 5)
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'0123456789')
+        self.assertEqual(os.listdir(basket.root), ['Foo-1.0.tar.gz'])
+
+    def test_retrieve_interrupted(self):
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket.chunk_size = 4
+        basket._http = FakeHttp({url: b'0123456789'}, fail_after=4)
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        self.assertRaises(IOError, basket._retrieve, url, path)
+        # The truncated file is not visible.
+        self.assertFalse(os.path.exists(path))
+        # Resume download
+        basket._http = FakeHttp({url: b'0123456789'})
+        basket._retrieve(url, path)
+        self.assertEqual(basket._http.requested, [(url, 'bytes=4-')])
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'0123456789')
+
+    def test_retrieve_checks_digest(self):
+        import hashlib
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket._http = FakeHttp({url: b'data'})
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        sha256 = hashlib.sha256(b'data').hexdigest()
+        self.assertEqual(basket._retrieve(url, path, {'sha256': sha256}),
+                         sha256)
+        md5 = hashlib.md5(b'data').hexdigest()
+        self.assertEqual(basket._retrieve(url, path, {'md5': md5}), sha256)
+
+    def test_retrieve_wrong_digest(self):
+        import os
+        from basket.main import IntegrityError
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket._http = FakeHttp({url: b'data'})
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        self.assertRaises(IntegrityError, basket._retrieve, url, path,
+                          {'md5': '0' * 32})
+        self.assertEqual(os.listdir(basket.root), [])
+
+    def test_retrieve_digest_of_resumed_download(self):
+        import hashlib
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket.chunk_size = 4
+        basket._http = FakeHttp({url: b'0123456789'}, fail_after=4)
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        self.assertRaises(IOError, basket._retrieve, url, path)
+        basket._http = FakeHttp({url: b'0123456789'})
+        sha256 = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(basket._retrieve(url, path, {'sha256': sha256}),
+                         sha256)
+
+    def test_retrieve_checks_digest_after_range_not_satisfiable(self):
+        import os
+        from basket.compat import HTTPError
+        from basket.main import IntegrityError
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        with open(os.path.join(basket.root, '.Foo-1.0.tar.gz.part'),
+                  'wb') as fp:
+            fp.write(b'0123456789abcdef')
+        http = FakeHttp({url: b'0123456789'})
+        def open_url(url, headers=None):
+            if (headers or {}).get('Range'):
+                raise HTTPError(url, 416, 'Range Not Satisfiable', {}, None)
+            return FakeHttp.open(http, url, headers)
+        http.open = open_url
+        basket._http = http
+        # The file is downloaded again from the start and checked.
+        self.assertRaises(IntegrityError, basket._retrieve, url, path,
+                          {'md5': '0' * 32})
+        self.assertEqual(os.listdir(basket.root), [])
+
+    def test_download_saves_checksums_once(self):
+        import os
+        from basket.repository import ArchiveIndex
+        basket = self._make_repository()
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'},
+                                      {'name': 'Bar', 'version': '2.0'}],
+                              release_urls=release_urls)
+        basket._find_requirements = lambda path: 'Foo' in path and ['Bar'] or []
+        saved = []
+        checksums = basket.checksums
+        save = checksums.save
+        def counting_save():
+            saved.append(checksums._modified)
+            save()
+        checksums.save = counting_save
+        self.assertEqual(basket.cmd_download(['Foo']), 0)
+        self.assertEqual(saved, [True])
+        index = ArchiveIndex(checksums.path)
+        for filename in ('Foo-1.0.tar.gz', 'Bar-2.0.tar.gz'):
+            stat = os.stat(os.path.join(basket.root, filename))
+            self.assertTrue(index.get(filename, stat.st_size, stat.st_mtime))
+
+    def test_download_records_checksum(self):
+        import hashlib
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        basket._http = FakeHttp({url: b'data'})
+        path = basket._download('Foo', '1.0', url)
+        stat = os.stat(path)
+        self.assertEqual(
+            basket.checksums.get('Foo-1.0.tar.gz', stat.st_size,
+                                 stat.st_mtime),
+            hashlib.sha256(b'data').hexdigest())
+
+    def test_download_updates_simple_index(self):
+        import os
+        url = 'http://example.com/Foo_Bar-1.0.tar.gz'
+        basket = self._make_repository()
+        basket._http = FakeHttp({url: b'data'})
+        basket._download('Foo_Bar', '1.0', url)
+        simple_dir = os.path.join(basket.root, 'simple')
+        self.assertEqual(sorted(os.listdir(simple_dir)),
+                         ['foo-bar', 'index.html'])
+        with open(os.path.join(simple_dir, 'foo-bar', 'index.html')) as fp:
+            self.assertTrue('../../Foo_Bar-1.0.tar.gz#sha256=' in fp.read())
+        # The simple index is not seen as a package.
+        basket._downloaded_packages = None
+        self.assertEqual(len(basket.downloaded_packages), 1)
+
+    def test_retrieve_resume_not_supported(self):
+        import os
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket = self._make_repository()
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        with open(os.path.join(basket.root, '.Foo-1.0.tar.gz.part'),
+                  'wb') as fp:
+            fp.write(b'0123')
+        basket._http = FakeHttp({url: b'0123456789'}, ranges=False)
+        basket._retrieve(url, path)
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'0123456789')
 
     def test_print_msg(self):
         import os
@@ -183,8 +774,8 @@ class TestBasket(TestCase):
     def test_cmd_list_all_packages(self):
         import os
         basket = self._make_one()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0'},
-                                       {'name': 'Foo', 'version': '2.0'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'),
+                                                   ('Foo', '2.0'))
         basket.out = DummyStream()
         self.assertEqual(basket.cmd_list(), 0)
         self.assertEqual(basket.out.stream,
@@ -193,8 +784,8 @@ class TestBasket(TestCase):
     def test_cmd_list_specific_packages(self):
         import os
         basket = self._make_one()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0'},
-                                       {'name': 'Foo', 'version': '2.0'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'),
+                                                   ('Foo', '2.0'))
         basket.out = DummyStream()
         basket.err = DummyStream()
         self.assertEqual(basket.cmd_list(('Foo', 'Bar')), 0)
@@ -204,6 +795,60 @@ class TestBasket(TestCase):
                          'Package "bar" is not installed (or it is there but '
                          'you mistyped the package name).' + os.linesep)
 
+    def _make_records_repository(self):
+        import os
+        basket = self._make_repository(streams=True)
+        for filename, data in (('Foo-1.0.tar.gz', 'a'),
+                               ('Foo-2.0.tar.gz', 'ab'),
+                               ('Bar-1.0.zip', 'abc')):
+            with open(os.path.join(basket.root, filename), 'w') as fp:
+                fp.write(data)
+        return basket
+
+    def test_cmd_list_ndjson(self):
+        import json
+        import os
+        basket = self._make_records_repository()
+        self.assertEqual(basket.cmd_list(('foo', 'Baz'), 'ndjson'), 0)
+        records = [json.loads(line)
+                   for line in basket.out.stream.splitlines()]
+        self.assertEqual([(record['filename'], record['size'])
+                          for record in records],
+                         [('Foo-1.0.tar.gz', 1), ('Foo-2.0.tar.gz', 2)])
+        stat = os.stat(os.path.join(basket.root, 'Foo-1.0.tar.gz'))
+        self.assertEqual(records[0], {'name': 'Foo', 'version': '1.0',
+                                      'filename': 'Foo-1.0.tar.gz',
+                                      'path': 'Foo-1.0.tar.gz', 'size': 1,
+                                      'mtime': stat.st_mtime})
+        self.assertTrue('"baz" is not installed' in basket.err.stream)
+
+    def test_cmd_list_json_and_tsv(self):
+        import json
+        basket = self._make_records_repository()
+        self.assertEqual(basket.cmd_list((), 'json'), 0)
+        self.assertEqual(sorted(record['size'] for record
+                                in json.loads(basket.out.stream)), [1, 2, 3])
+        basket.out = DummyStream()
+        self.assertEqual(basket.cmd_list(('Bar', ), 'tsv'), 0)
+        lines = basket.out.stream.splitlines()
+        self.assertEqual(lines[0], 'name\tversion\tfilename\tpath\tsize\tmtime')
+        self.assertEqual(lines[1].split('\t')[:5],
+                         ['Bar', '1.0', 'Bar-1.0.zip', 'Bar-1.0.zip', '3'])
+        self.assertEqual(len(lines), 2)
+
+    def test_cmd_list_records_sharded(self):
+        import json
+        basket = self._make_sharded_repository()
+        path = basket._get_download_path('Foo_Bar', 'Foo_Bar-1.0.tar.gz')
+        with open(path, 'w') as fp:
+            fp.write('data')
+        basket._register('Foo_Bar', '1.0', 'Foo_Bar-1.0.tar.gz', 'abc')
+        basket.out = DummyStream()
+        self.assertEqual(basket.cmd_list((), 'ndjson'), 0)
+        record = json.loads(basket.out.stream)
+        self.assertEqual((record['path'], record['size']),
+                         ('f/foo-bar/Foo_Bar-1.0.tar.gz', 4))
+
     def test_cmd_download_unknown_package(self):
         import os
         basket = self._make_one()
@@ -219,7 +864,7 @@ class TestBasket(TestCase):
         basket.out = DummyStream()
         basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'}],
                               release_urls=[])
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'))
         self.assertEqual(basket.cmd_download(('Foo', )), 0)
         self.assertEqual(basket.out.stream,
                          'Foo is already up to date (1.0).' + os.linesep)
@@ -230,7 +875,7 @@ class TestBasket(TestCase):
         basket.err = DummyStream()
         basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'}],
                               release_urls=[])
-        basket._downloaded_packages = []
+        basket._downloaded_packages = make_catalog()
         self.assertEqual(basket.cmd_download(('Foo', )), 0)
         self.assertEqual(basket.err.stream,
                          'Could not find a suitable distribution for '
@@ -238,9 +883,9 @@ class TestBasket(TestCase):
 
     def test_cmd_download_success(self):
         import os
-        basket = self._make_one()
-        basket._downloaded_packages = []
-        basket.urllib = Mock(urlretrieve='data')
+        basket = self._make_repository()
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
         basket.out = DummyStream()
         def release_urls(package, version):
             url = 'http://example.com/%s-%s.tar.gz' % (package, version)
@@ -256,12 +901,778 @@ class TestBasket(TestCase):
                          '  -> requires: Bar{0}' 
                          'Added Bar 2.0.{0}'.format(os.linesep))
 
+    def test_cmd_download_wrong_digest(self):
+        import os
+        basket = self._make_repository()
+        basket.err = DummyStream()
+        basket._http = FakeHttp()
+        url = 'http://example.com/Foo-1.0.tar.gz'
+        basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'}],
+                              release_urls=[{'python_version': 'source',
+                                             'url': url,
+                                             'md5_digest': '0' * 32}])
+        self.assertEqual(basket.cmd_download(('Foo', )), 1)
+        self.assertEqual(basket.err.stream,
+                         'Wrong md5 digest for "%s" (expected %s, got '
+                         'd41d8cd98f00b204e9800998ecf8427e).%s' % (
+                             url, '0' * 32, os.linesep))
+        self.assertFalse(basket._has_package('Foo', '1.0'))
+
+    def test_cmd_download_parallel(self):
+        import os
+        basket = self._make_repository()
+        basket.jobs = 4
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        def search(spec):
+            name = spec['name'].capitalize()
+            return [{'name': name, 'version': '1.0'}]
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = FakeServer(search, release_urls)
+        # Foo and Bar both require Baz, which must be downloaded once.
+        def find_requirements(path):
+            if 'Baz' in path:
+                return []
+            return ['baz']
+        basket._find_requirements = find_requirements
+        self.assertEqual(basket.cmd_download(('Foo', 'Bar', 'foo')), 0)
+        lines = basket.out.stream.split(os.linesep)
+        self.assertEqual(sorted(line for line in lines
+                                if line.startswith('Added')),
+                         ['Added Bar 1.0.', 'Added Baz 1.0.',
+                          'Added Foo 1.0.'])
+        retrieved = [url for url, _ in basket._http.requested]
+        self.assertEqual(sorted(retrieved),
+                         ['http://example.com/Bar-1.0.tar.gz',
+                          'http://example.com/Baz-1.0.tar.gz',
+                          'http://example.com/Foo-1.0.tar.gz'])
+
+    def test_cmd_download_parallel_prefetch_error(self):
+        import os
+        basket = self._make_repository(streams=True)
+        basket.jobs = 2
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        def search(spec):
+            return [{'name': spec['name'].capitalize(), 'version': '1.0'}]
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = FakeServer(search, release_urls)
+        def multicall(calls):
+            raise IOError('Connection reset by peer')
+        basket._client.multicall = multicall
+        basket._find_requirements = lambda path: (
+            'Foo' in path and ['bar', 'baz'] or [])
+        self.assertEqual(basket.cmd_download(['Foo']), 0)
+        self.assertEqual(basket.err.stream, '')
+        lines = basket.out.stream.split(os.linesep)
+        self.assertEqual(lines[:2], ['Added Foo 1.0.',
+                                     '  -> requires: bar, baz'])
+        self.assertEqual(sorted(lines[2:]),
+                         ['', 'Added Bar 1.0.', 'Added Baz 1.0.'])
+
+    def _download_tree(self, engine, depth=8):
+        import os
+        basket = self._make_repository()
+        basket.engine = engine
+        basket.pipeline_depth = depth
+        basket._downloaded_packages = make_catalog(('Qux', '1.0'))
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        basket.err = DummyStream()
+        def search(spec):
+            if spec['name'] == 'missing':
+                return []
+            return [{'name': spec['name'].capitalize(), 'version': '1.0'}]
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = FakeServer(search, release_urls)
+        requirements = {'Foo': ['baz', 'bar', 'missing'],
+                        'Bar': ['qux', 'Quux'],
+                        'Baz': ['Quux', 'corge'],
+                        'Quux': ['foo']}
+        basket._find_requirements = lambda path: requirements.get(
+            os.path.basename(path).split('-')[0], [])
+        self.assertEqual(basket.cmd_download(['Foo', 'Grault', 'FOO']), 0)
+        return basket
+
+    def test_cmd_download_pipelined(self):
+        expected = self._download_tree('threads')
+        for depth in (1, 2, 8):
+            basket = self._download_tree('pipeline', depth)
+            self.assertEqual(basket.out.stream, expected.out.stream)
+            self.assertEqual(basket.err.stream, expected.err.stream)
+            self.assertEqual(basket._http.requested, expected._http.requested)
+        self.assertEqual(basket.out.stream.count('Added'), 6)
+        self.assertTrue('Could not find any package named "missing".'
+                        in basket.err.stream)
+        self.assertTrue('Qux is already up to date (1.0).'
+                        in basket.out.stream)
+
+    def test_cmd_download_pipelined_scan_error(self):
+        import os
+        basket = self._make_repository()
+        basket.engine = 'pipeline'
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        basket.err = DummyStream()
+        basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'}],
+                              release_urls=[{'python_version': 'source',
+                                             'url': 'http://example.com/'
+                                             'Foo-1.0.tar.gz'}])
+        def find_requirements(path):
+            raise ValueError('broken')
+        basket._find_requirements = find_requirements
+        self.assertEqual(basket.cmd_download(['Foo']), 1)
+        self.assertEqual(basket.err.stream,
+                         'Could not scan "%s": broken%s' % (
+                             os.path.join(basket.root, 'Foo-1.0.tar.gz'),
+                             os.linesep))
+
+    def test_cmd_download_errors_status(self):
+        from basket.compat import HTTPError
+        class UnavailableHttp(object):
+            def open(self, url, headers=None):
+                raise HTTPError(url, 503, 'Service Unavailable', {}, None)
+        for engine, jobs in (('threads', 2), ('pipeline', 1)):
+            basket = self._make_repository(streams=True)
+            basket.engine = engine
+            basket.jobs = jobs
+            basket._downloaded_packages = make_catalog()
+            basket._http = UnavailableHttp()
+            basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'}],
+                                  release_urls=[{'python_version': 'source',
+                                                 'url': 'http://example.com/'
+                                                 'Foo-1.0.tar.gz'}])
+            self.assertEqual(basket.cmd_download(['Foo']), 1)
+            self.assertTrue(basket.err.stream.startswith(
+                    'Could not download "Foo": '))
+            self.assertEqual(basket.out.stream, '')
+
+    def test_cmd_download_resolves_each_name_once(self):
+        basket = self._make_repository()
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        queries = []
+        def search(spec):
+            queries.append(spec['name'])
+            return [{'name': spec['name'].capitalize(), 'version': '1.0'}]
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = FakeServer(search, release_urls, multicall=False)
+        # Foo and Bar both require Baz (and Foo requires itself).
+        def find_requirements(path):
+            if 'Baz' in path:
+                return []
+            return ['baz', 'Foo']
+        basket._find_requirements = find_requirements
+        self.assertEqual(basket.cmd_download(['Bar', 'foo', 'Foo']), 0)
+        self.assertEqual(sorted(queries), ['bar', 'baz', 'foo'])
+        self.assertEqual(basket.out.stream.count('Added'), 3)
+
+    def test_cmd_download_normalizes_names(self):
+        import os
+        for engine, jobs in (('threads', 1), ('threads', 4),
+                             ('pipeline', 1)):
+            basket = self._make_repository(streams=True)
+            basket.engine = engine
+            basket.jobs = jobs
+            basket._downloaded_packages = make_catalog()
+            basket._http = FakeHttp()
+            queries = []
+            def search(spec):
+                queries.append(spec['name'])
+                if spec['name'] == 'foo':
+                    return [{'name': 'Foo', 'version': '1.0'}]
+                return [{'name': 'Zope.Interface', 'version': '1.0'}]
+            def release_urls(package, version):
+                url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+                return [{'python_version': 'source', 'url': url}]
+            basket._client = FakeServer(search, release_urls, multicall=False)
+            requirements = ['zope-interface', 'zope_interface',
+                            'Zope.Interface']
+            basket._find_requirements = lambda path: (
+                'Foo' in path and requirements or [])
+            self.assertEqual(basket.cmd_download(['Foo']), 0)
+            self.assertEqual(sorted(queries), ['foo', 'zope-interface'])
+            self.assertEqual(basket.out.stream,
+                             'Added Foo 1.0.{0}'
+                             '  -> requires: zope-interface, zope_interface, '
+                             'Zope.Interface{0}'
+                             'Added Zope.Interface 1.0.{0}'.format(
+                                 os.linesep))
+
+    def test_cmd_download_records_dependency_graph(self):
+        from basket.graph import DependencyGraph
+        basket = self._make_repository()
+        basket._downloaded_packages = make_catalog()
+        basket._http = FakeHttp()
+        basket.out = DummyStream()
+        def release_urls(package, version):
+            url = 'http://example.com/%s-%s.tar.gz' % (package, version)
+            return [{'python_version': 'source', 'url': url}]
+        basket._client = Mock(search=[{'name': 'Foo', 'version': '1.0'},
+                                      {'name': 'Bar', 'version': '2.0'}],
+                              release_urls=release_urls)
+        basket._find_requirements = lambda path: 'Foo' in path and ['Bar'] or []
+        self.assertEqual(basket.cmd_download(['Foo']), 0)
+        graph = DependencyGraph(basket.dependency_graph.path)
+        self.assertEqual(graph.get('foo'), ('Foo', '1.0', ['bar']))
+        self.assertEqual(graph.get('bar'), ('Bar', '2.0', []))
+
+    def _make_graph_repository(self):
+        import os
+        basket = self._make_repository(streams=True)
+        for filename in ('Foo-1.0.tar.gz', 'Bar-2.0.tar.gz'):
+            open(os.path.join(basket.root, filename), 'w').close()
+        requirements = {'Foo-1.0.tar.gz': ['Bar', 'missing'],
+                        'Bar-2.0.tar.gz': []}
+        basket._find_requirements = \
+            lambda path: requirements[os.path.basename(path)]
+        return basket
+
+    def test_cmd_graph_no_repository(self):
+        basket = self._make_one()
+        basket.err = DummyStream()
+        self.assertEqual(basket.cmd_graph(), 1)
+
+    def test_cmd_graph_all(self):
+        import os
+        basket = self._make_graph_repository()
+        self.assertEqual(basket.cmd_graph(), 0)
+        self.assertEqual(basket.out.stream,
+                         'Bar 2.0{0}'
+                         'Foo 1.0{0}'
+                         '  -> requires: bar, missing{0}'
+                         'missing (not downloaded){0}'.format(os.linesep))
+
+    def test_cmd_graph_writes_requirements_index_once(self):
+        import os
+        from basket import repository
+        from basket.repository import ArchiveIndex
+        basket = self._make_graph_repository()
+        requirements = basket._find_requirements
+        del basket._find_requirements
+        basket._scan_requirements = requirements
+        written = []
+        write_json = repository.write_json
+        def counting_write_json(path, data):
+            written.append(os.path.basename(path))
+            write_json(path, data)
+        repository.write_json = counting_write_json
+        self.addCleanup(setattr, repository, 'write_json', write_json)
+        self.assertEqual(basket.cmd_graph(), 0)
+        self.assertEqual(written.count('requirements.json'), 1)
+        index = ArchiveIndex(os.path.join(basket.root, '.basket-data',
+                                          'requirements.json'))
+        stat = os.stat(os.path.join(basket.root, 'Foo-1.0.tar.gz'))
+        self.assertEqual(index.get('Foo-1.0.tar.gz', stat.st_size,
+                                   stat.st_mtime), ['Bar', 'missing'])
+
+    def test_cmd_graph_specific_packages(self):
+        import os
+        basket = self._make_graph_repository()
+        self.assertEqual(basket.cmd_graph(['bar', 'unknown']), 0)
+        self.assertEqual(basket.out.stream, 'Bar 2.0' + os.linesep)
+        self.assertEqual(basket.err.stream,
+                         'Package "unknown" is not installed (or it is '
+                         'there but you mistyped the package name).' +
+                         os.linesep)
+
+    def test_cmd_graph_formats(self):
+        import json
+        basket = self._make_graph_repository()
+        self.assertEqual(basket.cmd_graph(['Foo'], 'json'), 0)
+        self.assertEqual(json.loads(basket.out.stream),
+                         {'foo': {'name': 'Foo', 'version': '1.0',
+                                  'requires': ['bar', 'missing']},
+                          'bar': {'name': 'Bar', 'version': '2.0',
+                                  'requires': []},
+                          'missing': None})
+        basket.out = DummyStream()
+        self.assertEqual(basket.cmd_graph(['Foo'], 'dot'), 0)
+        self.assertTrue(basket.out.stream.startswith('digraph'))
+        self.assertTrue('"foo" -> "bar";' in basket.out.stream)
+
+    def test_cmd_graph_is_persisted(self):
+        basket = self._make_graph_repository()
+        self.assertEqual(basket.cmd_graph(), 0)
+        # The graph is read from the repository: archives are not
+        # scanned again.
+        other = self._make_one()
+        other.root = basket.root
+        other.out = DummyStream()
+        other._find_requirements = None
+        self.assertEqual(other.cmd_graph(['foo']), 0)
+        self.assertTrue('bar, missing' in other.out.stream)
+
+    def test_cmd_download_from_local_index(self):
+        import os
+        import shutil
+        import tempfile
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        for name, version, requires in (('Foo', '1.0', ['bar_baz']),
+                                        ('Foo', '1.1', ['bar_baz']),
+                                        ('bar.baz', '2.0', [])):
+            path = os.path.join(index_dir, '%s-%s.tar.gz' % (name, version))
+            with open(path, 'wb') as fp:
+                fp.write(make_tar(name, version, requires))
+        basket = self._make_repository()
+        basket.index_url = index_dir
+        basket.out = DummyStream()
+        self.assertEqual(basket.cmd_download(['foo']), 0)
+        self.assertEqual(basket.out.stream,
+                         'Added Foo 1.1.{0}'
+                         '  -> requires: bar_baz{0}'
+                         'Added bar.baz 2.0.{0}'.format(os.linesep))
+        self.assertTrue(os.path.exists(
+                os.path.join(basket.root, 'bar.baz-2.0.tar.gz')))
+        # Results are cached separately from those of PyPI.
+        self.assertEqual(basket.cache.get('search:foo'), None)
+        self.assertEqual(basket.cache.get('%s search:foo' % index_dir),
+                         [{'name': 'Foo', 'version': '1.1'}])
+
+    def _make_metadata_index(self, packages):
+        import shutil
+        import tempfile
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        make_metadata_index(index_dir, packages)
+        basket = self._make_repository()
+        basket.index_url = index_dir
+        basket.out = DummyStream()
+        basket.err = DummyStream()
+        return basket
+
+    def test_cmd_download_resolves_with_metadata_files(self):
+        import os
+        # Archives list other requirements than metadata files, to
+        # make sure that they are not scanned.
+        basket = self._make_metadata_index(
+            {'Foo': (['Bar (>=1.0)'], ['wrong'], True),
+             'Bar': ([], ['wrong'], True)})
+        basket._find_requirements = None
+        self.assertEqual(basket.cmd_download(['foo']), 0)
+        self.assertEqual(basket.out.stream,
+                         'Added Foo 1.0.{0}'
+                         '  -> requires: Bar{0}'
+                         'Added Bar 1.0.{0}'.format(os.linesep))
+        self.assertEqual(sorted(dist.filename
+                                for dist in basket.downloaded_packages),
+                         ['Bar-1.0.tar.gz', 'Foo-1.0.tar.gz'])
+        self.assertEqual(basket.dependency_graph.get('foo').requires,
+                         ['bar'])
+        # Requirements are stored in the requirements index.
+        path = os.path.join(basket.root, 'Foo-1.0.tar.gz')
+        stat = os.stat(path)
+        self.assertEqual(basket.requirements_index.get(
+                'Foo-1.0.tar.gz', stat.st_size, stat.st_mtime), ['Bar'])
+
+    def test_cmd_download_metadata_file_does_not_match_hash(self):
+        import os
+        basket = self._make_metadata_index(
+            {'Foo': (['bar'], ['baz'], 'sha256=0123')})
+        self.assertEqual(basket.cmd_download(['foo']), 0)
+        self.assertTrue(basket.out.stream.startswith(
+                'Added Foo 1.0.{0}  -> requires: baz{0}'.format(os.linesep)))
+
+    def test_cmd_download_incomplete_metadata_file(self):
+        import os
+        basket = self._make_metadata_index(
+            {'Foo': (['bar'], ['baz'], True)})
+        basket._read_metadata_file = lambda release, data: None
+        self.assertEqual(basket.cmd_download(['foo']), 0)
+        self.assertTrue(basket.out.stream.startswith(
+                'Added Foo 1.0.{0}  -> requires: baz{0}'.format(os.linesep)))
+
+    def test_cmd_download_metadata_file_dynamic_requirements(self):
+        basket = self._make_one()
+        release = {'metadata': True}
+        self.assertEqual(basket._read_metadata_file(
+                release, b'Metadata-Version: 2.1\nRequires-Dist: foo\n'),
+                None)
+        self.assertEqual(basket._read_metadata_file(
+                release, b'Metadata-Version: 2.2\nDynamic: Requires-Dist\n'
+                b'Requires-Dist: foo\n'), None)
+        self.assertEqual(basket._read_metadata_file(
+                release, b'Metadata-Version: 2.2\nRequires-Dist: foo\n'),
+                ['foo'])
+
+    def _make_sharded_repository(self):
+        import os
+        basket = self._make_repository(streams=True)
+        os.rmdir(basket.root)
+        self.assertEqual(basket.cmd_init(sharded=True), 0)
+        basket.out = DummyStream()
+        return basket
+
+    def test_sharded_layout(self):
+        import os
+        basket = self._make_sharded_repository()
+        self.assertEqual(basket.layout, 'sharded')
+        self.assertEqual(basket._get_path('Foo_Bar', 'Foo_Bar-1.0.tar.gz'),
+                         os.path.join(basket.root, 'f', 'foo-bar',
+                                      'Foo_Bar-1.0.tar.gz'))
+        path = basket._get_download_path('Foo_Bar', 'Foo_Bar-1.0.tar.gz')
+        open(path, 'w').close()
+        basket._register('Foo_Bar', '1.0', 'Foo_Bar-1.0.tar.gz', 'abc')
+        self.assertEqual(basket.downloaded_packages.get('foo-bar')[0].filename,
+                         'Foo_Bar-1.0.tar.gz')
+        page = os.path.join(basket.root, 'simple', 'foo-bar', 'index.html')
+        with open(page) as fp:
+            self.assertTrue('href="../../f/foo-bar/Foo_Bar-1.0.tar.gz' in
+                            fp.read())
+        # Another process only lists the directory of the package.
+        other = self._make_one()
+        other.root = basket.root
+        listed = []
+        other.os = Mock(path=os.path,
+                        listdir=lambda path: listed.append(path) or
+                        os.listdir(path))
+        self.assertTrue(other.downloaded_packages.has('Foo_Bar', '1.0'))
+        self.assertEqual(listed, [os.path.join(basket.root, 'f', 'foo-bar')])
+
+    def test_cmd_migrate(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        for filename in ('Foo-1.0.tar.gz', 'Foo-2.0.tar.gz', 'bar-1.0.zip'):
+            open(os.path.join(basket.root, filename), 'w').close()
+        self.assertEqual(basket.cmd_migrate('sharded'), 0)
+        self.assertEqual(basket.out.stream,
+                         'Moved 3 files to the sharded layout.' + os.linesep)
+        self.assertEqual(sorted(os.listdir(os.path.join(basket.root, 'f',
+                                                        'foo'))),
+                         ['Foo-1.0.tar.gz', 'Foo-2.0.tar.gz'])
+        self.assertTrue(os.path.exists(
+                os.path.join(basket.root, 'b', 'bar', 'bar-1.0.zip')))
+        page = os.path.join(basket.root, 'simple', 'bar', 'index.html')
+        with open(page) as fp:
+            self.assertTrue('../../b/bar/bar-1.0.zip' in fp.read())
+        basket.out = DummyStream()
+        self.assertEqual(basket.cmd_prune(['foo']), 0)
+        self.assertEqual(basket.out.stream,
+                         'Removed Foo 1.0 (kept 2.0).' + os.linesep)
+        # And back.
+        other = self._make_one()
+        other.root = basket.root
+        other.out = DummyStream()
+        self.assertEqual(other.layout, 'sharded')
+        self.assertEqual(other.cmd_migrate('flat'), 0)
+        self.assertEqual(other.out.stream,
+                         'Moved 2 files to the flat layout.' + os.linesep)
+        self.assertEqual(sorted(os.listdir(other.root)),
+                         ['.basket-data', 'Foo-2.0.tar.gz', 'bar-1.0.zip',
+                          'simple'])
+        self.assertEqual(other.layout, 'flat')
+        self.assertEqual(sorted(dist.filename
+                                for dist in other.downloaded_packages),
+                         ['Foo-2.0.tar.gz', 'bar-1.0.zip'])
+
+    def _make_export_repository(self):
+        import os
+        basket = self._make_repository(streams=True)
+        for name, version, requires in (('Foo', '1.0', ['bar']),
+                                        ('Foo', '2.0', ['bar', 'missing']),
+                                        ('Bar', '1.0', []),
+                                        ('Baz', '1.0', [])):
+            path = os.path.join(basket.root, '%s-%s.tar.gz' % (name, version))
+            with open(path, 'wb') as fp:
+                fp.write(make_tar(name, version, requires))
+        return basket
+
+    def test_read_requirements_file(self):
+        import os
+        basket = self._make_repository()
+        path = os.path.join(basket.root, 'requirements.txt')
+        with open(path, 'w') as fp:
+            fp.write('# Comment\n'
+                     '--index-url http://example.com/simple/\n'
+                     'Foo[extra] == 1.0  # pinned\n'
+                     'bar>=1.0,<2\n'
+                     '-r other.txt\n')
+        with open(os.path.join(basket.root, 'other.txt'), 'w') as fp:
+            fp.write('baz==1.0 ; python_version > "2.7"\n')
+        self.assertEqual(basket._read_requirements_file(path),
+                         [('Foo', '1.0'), ('bar', None), ('baz', '1.0')])
+
+    def test_cmd_export(self):
+        import os
+        import shutil
+        import tempfile
+        basket = self._make_export_repository()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'requirements.txt')
+        with open(path, 'w') as fp:
+            fp.write('foo==1.0\n')
+        destination = os.path.join(tmp_dir, 'export')
+        self.assertEqual(basket.cmd_export(destination, ['unknown'], [path]),
+                         0)
+        self.assertEqual(basket.out.stream,
+                         'Exported Foo 1.0 (hard link).{0}'
+                         'Exported Bar 1.0 (hard link).{0}'.format(
+                    os.linesep))
+        self.assertEqual(basket.err.stream,
+                         'Package "unknown" is not installed (or it is '
+                         'there but you mistyped the package name).' +
+                         os.linesep)
+        self.assertTrue(os.path.samefile(
+                os.path.join(basket.root, 'Foo-1.0.tar.gz'),
+                os.path.join(destination, 'Foo-1.0.tar.gz')))
+        # The destination is a repository, whose indexes are known.
+        target = self._make_one()
+        target.root = destination
+        target._scan_requirements = None
+        self.assertEqual(sorted(dist.filename
+                                for dist in target.downloaded_packages),
+                         ['Bar-1.0.tar.gz', 'Foo-1.0.tar.gz'])
+        self.assertEqual(target._find_requirements(
+                os.path.join(destination, 'Foo-1.0.tar.gz')), ['bar'])
+        self.assertEqual(target.dependency_graph.get('foo').requires, ['bar'])
+        self.assertTrue(os.path.exists(
+                os.path.join(destination, 'simple', 'foo', 'index.html')))
+        # Files that are already there are skipped.
+        basket.out = DummyStream()
+        basket.err = DummyStream()
+        self.assertEqual(basket.cmd_export(destination, ['foo']), 0)
+        self.assertEqual(basket.out.stream,
+                         'Exported Foo 2.0 (hard link).{0}'
+                         'Bar 1.0 is already there.{0}'.format(os.linesep))
+        self.assertTrue('"missing"' in basket.err.stream)
+
+    def test_cmd_export_missing_pinned_version(self):
+        import os
+        import shutil
+        import tempfile
+        basket = self._make_export_repository()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'requirements.txt')
+        with open(path, 'w') as fp:
+            fp.write('foo==3.0\nbaz\n')
+        destination = os.path.join(tmp_dir, 'export')
+        self.assertEqual(basket.cmd_export(destination, [], [path]), 0)
+        # We do not fall back to another version of Foo.
+        self.assertEqual(basket.out.stream,
+                         'Exported Baz 1.0 (hard link).' + os.linesep)
+        self.assertEqual(basket.err.stream,
+                         'Package "foo==3.0" is not installed (or it is '
+                         'there but you mistyped the package name).' +
+                         os.linesep)
+
+    def _make_bundle_repositories(self):
+        import os
+        source = self._make_repository(streams=True)
+        target = self._make_repository(streams=True)
+        for name, requires in (('Foo', ['bar']), ('Bar', [])):
+            path = os.path.join(source.root, '%s-1.0.tar.gz' % name)
+            with open(path, 'wb') as fp:
+                fp.write(make_tar(name, '1.0', requires))
+        return source, target
+
+    def _get_bundle_id(self, basket):
+        return basket.out.stream.split()[1]
+
+    def test_cmd_bundle_and_unbundle(self):
+        import os
+        source, target = self._make_bundle_repositories()
+        first = os.path.join(target.root, '.first.tar')
+        self.assertEqual(source.cmd_bundle(first), 0)
+        first_id = self._get_bundle_id(source)
+        self.assertTrue(source.out.stream.endswith(
+                'has been written to %s (2 packages).%s' % (
+                    first, os.linesep)))
+        # Only new packages are in the next bundle.
+        source.out = DummyStream()
+        self.assertEqual(source.cmd_bundle(first, first_id), 0)
+        self.assertEqual(source.out.stream,
+                         'No package has been added since bundle '
+                         '%s.%s' % (first_id, os.linesep))
+        path = os.path.join(source.root, 'Baz-1.0.tar.gz')
+        with open(path, 'wb') as fp:
+            fp.write(make_tar('Baz', '1.0', ['foo']))
+        source._downloaded_packages = None
+        source.out = DummyStream()
+        second = os.path.join(target.root, '.second.tar')
+        self.assertEqual(source.cmd_bundle(second, first_id, True), 0)
+        second_id = self._get_bundle_id(source)
+        self.assertTrue('(1 packages)' in source.out.stream)
+        # Bundles must be applied in order.
+        self.assertEqual(target.cmd_unbundle(second), 1)
+        self.assertEqual(target.err.stream,
+                         'Bundle %s has been made since bundle %s, which '
+                         'has not been applied.%s' % (
+                    second_id, first_id, os.linesep))
+        self.assertEqual(target.cmd_unbundle(first), 0)
+        self.assertEqual(target.cmd_unbundle(second), 0)
+        self.assertEqual(sorted(target.out.stream.split(os.linesep)),
+                         ['', 'Added Bar 1.0.', 'Added Baz 1.0.',
+                          'Added Foo 1.0.'])
+        target.out = DummyStream()
+        self.assertEqual(target.cmd_unbundle(second), 0)
+        self.assertEqual(target.out.stream,
+                         'Bundle %s has already been applied.%s' % (
+                    second_id, os.linesep))
+        # Indexes are restored from the manifest of the bundle.
+        other = self._make_one()
+        other.root = target.root
+        other._scan_requirements = None
+        self.assertEqual(sorted(dist.filename
+                                for dist in other.downloaded_packages),
+                         ['Bar-1.0.tar.gz', 'Baz-1.0.tar.gz',
+                          'Foo-1.0.tar.gz'])
+        self.assertEqual(other._find_requirements(
+                os.path.join(target.root, 'Baz-1.0.tar.gz')), ['foo'])
+        self.assertEqual(other.dependency_graph.get('foo').requires, ['bar'])
+        self.assertTrue(os.path.exists(
+                os.path.join(target.root, 'simple', 'baz', 'index.html')))
+
+    def test_cmd_bundle_empty_repository(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        path = os.path.join(basket.root, '.bundle.tar')
+        self.assertEqual(basket.cmd_bundle(path), 0)
+        self.assertEqual(basket.out.stream,
+                         'There is no package to bundle.' + os.linesep)
+        self.assertFalse(os.path.exists(path))
+
+    def test_cmd_bundle_unknown_since(self):
+        import os
+        source, _ = self._make_bundle_repositories()
+        self.assertEqual(source.cmd_bundle('bundle.tar', 'unknown'), 1)
+        self.assertEqual(source.err.stream,
+                         'Unknown bundle "unknown".' + os.linesep)
+
+    def test_cmd_unbundle_wrong_digest(self):
+        import os
+        source, target = self._make_bundle_repositories()
+        stat = os.stat(os.path.join(source.root, 'Bar-1.0.tar.gz'))
+        source.checksums.set('Bar-1.0.tar.gz', stat.st_size, stat.st_mtime,
+                             '0123')
+        path = os.path.join(target.root, '.bundle.tar')
+        self.assertEqual(source.cmd_bundle(path), 0)
+        self.assertEqual(target.cmd_unbundle(path), 1)
+        self.assertTrue(target.err.stream.startswith(
+                'Wrong sha256 digest for "%s:Bar-1.0.tar.gz"' % path))
+        self.assertEqual([dist.filename
+                          for dist in target.downloaded_packages],
+                         ['Foo-1.0.tar.gz'])
+
+    def test_cmd_unbundle_not_a_bundle(self):
+        import os
+        _, target = self._make_bundle_repositories()
+        path = os.path.join(target.root, '.bundle.tar')
+        open(path, 'w').close()
+        self.assertEqual(target.cmd_unbundle(path), 1)
+        self.assertTrue(target.err.stream.startswith(
+                'Could not read bundle "%s": ' % path))
+
+    def test_tracer(self):
+        import os
+        import shutil
+        import tempfile
+        from basket.tracing import Tracer
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        for name, requires in (('Foo', ['bar']), ('Bar', [])):
+            path = os.path.join(index_dir, '%s-1.0.tar.gz' % name)
+            with open(path, 'wb') as fp:
+                fp.write(make_tar(name, '1.0', requires))
+        basket = self._make_repository()
+        basket.index_url = index_dir
+        basket.out = DummyStream()
+        basket.tracer = Tracer()
+        self.assertEqual(basket.cmd_download(['Foo']), 0)
+        spans = [(span.name, span.package, span.cache)
+                 for span in basket.tracer.spans]
+        for span in (('search', 'foo', 'miss'),
+                     ('release_urls', 'foo', 'miss'),
+                     ('download', 'foo', None),
+                     ('register', 'foo', None),
+                     ('requirements', 'foo', 'miss'),
+                     ('search', 'bar', 'miss')):
+            self.assertTrue(span in spans, span)
+        downloads = [span for span in basket.tracer.spans
+                     if span.name == 'download']
+        self.assertEqual(sorted(span.bytes for span in downloads),
+                         sorted(os.path.getsize(os.path.join(basket.root,
+                                                             filename))
+                                for filename in ('Foo-1.0.tar.gz',
+                                                 'Bar-1.0.tar.gz')))
+
+    def test_main_profile(self):
+        import json
+        import os
+        from basket.main import Basket
+        from basket.main import main
+        basket = self._make_repository()
+        trace_path = os.path.join(basket.root, '.trace.json')
+        streams = []
+
+        class ProfiledBasket(Basket):
+            root = basket.root
+
+            def __init__(self):
+                Basket.__init__(self)
+                self.out = DummyStream()
+                self.err = DummyStream()
+                streams.append(self.err)
+
+        self.assertEqual(main(['basket', 'list', '--profile', '--trace',
+                               trace_path], ProfiledBasket), 0)
+        self.assertTrue(streams[0].stream.startswith('phase '))
+        self.assertTrue(streams[0].stream.endswith(
+                'Trace has been written to %s.%s' % (trace_path,
+                                                     os.linesep)))
+        with open(trace_path) as fp:
+            self.assertEqual(json.load(fp)['traceEvents'], [])
+
+    def test_cmd_cache_no_repository(self):
+        import os
+        basket = self._make_one()
+        basket.err = DummyStream()
+        self.assertEqual(basket.cmd_cache('stats'), 1)
+        self.assertEqual(basket.err.stream,
+                         'There is no repository at '
+                         '"/path/of/basket/root".' + os.linesep)
+
+    def test_cmd_cache_stats(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        basket.cache.set('foo', 'bar')
+        self.assertEqual(basket.cmd_cache('stats'), 0)
+        self.assertEqual(basket.out.stream,
+                         'Entries: 1 (0 expired){0}'
+                         'Size: 5 bytes{0}'.format(os.linesep))
+
+    def test_cmd_cache_clear(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        basket.cache.set('foo', 'bar')
+        self.assertEqual(basket.cmd_cache('clear'), 0)
+        self.assertEqual(basket.out.stream,
+                         'Cache has been cleared.' + os.linesep)
+        self.assertEqual(basket.cache.get('foo'), None)
+
     def test_cmd_prune_unknown_package(self):
         import os
         basket = self._make_one()
         basket.os = Mock(remove=lambda: 1)
         basket.err = DummyStream()
-        basket._downloaded_packages = []
+        basket._downloaded_packages = make_catalog()
         self.assertEqual(basket.cmd_prune(('Foo', )), 0)
         self.assertEqual(basket.err.stream,
                          'Package "foo" is not installed (or it is there '
@@ -272,7 +1683,7 @@ class TestBasket(TestCase):
         basket = self._make_one()
         basket.os = Mock(remove=lambda: 1)  # safety belt
         basket.out = DummyStream()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'))
         self.assertEqual(basket.cmd_prune(('Foo', )), 0)
         self.assertEqual(basket.out.stream,
                          'Foo has only one version. '
@@ -284,9 +1695,8 @@ class TestBasket(TestCase):
         basket.os = Mock(remove=lambda path: 1, path=os.path)  # safety belt
         basket.os.path
         basket.out = DummyStream()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0',
-                                        'filename': '/belt/and/suspenders'},
-                                       {'name': 'Foo', 'version': '2.0'}]
+        basket._downloaded_packages = make_catalog(
+            ('Foo', '1.0', '/belt/and/suspenders'), ('Foo', '2.0'))
         self.assertEqual(basket.cmd_prune(('Foo', )), 0)
         self.assertEqual(basket.out.stream,
                          'Removed Foo 1.0 (kept 2.0).' + os.linesep)
@@ -297,26 +1707,375 @@ class TestBasket(TestCase):
         basket.os = Mock(remove=lambda path: 1, path=os.path)  # safety belt
         basket.os.path
         basket.out = DummyStream()
-        basket._downloaded_packages = [{'name': 'Foo', 'version': '1.0',
-                                        'filename': '/belt/and/suspenders'},
-                                       {'name': 'Foo', 'version': '2.0'}]
+        basket._downloaded_packages = make_catalog(
+            ('Foo', '1.0', '/belt/and/suspenders'), ('Foo', '2.0'))
         self.assertEqual(basket.cmd_prune(()), 0)
         self.assertEqual(basket.out.stream,
                          'Removed Foo 1.0 (kept 2.0).' + os.linesep)
 
+    def test_cmd_prune_dry_run(self):
+        import os
+        basket = self._make_records_repository()
+        self.assertEqual(basket.cmd_prune((), dry_run=True), 0)
+        self.assertEqual(basket.out.stream,
+                         'Bar has only one version. Nothing to prune.{0}'
+                         'Would remove Foo 1.0 (keeping 2.0).{0}'.format(
+                             os.linesep))
+        self.assertEqual(len(basket.downloaded_packages), 3)
+        self.assertTrue(os.path.exists(
+                os.path.join(basket.root, 'Foo-1.0.tar.gz')))
+
+    def test_cmd_prune_records(self):
+        import json
+        import os
+        for dry_run in (True, False):
+            basket = self._make_records_repository()
+            self.assertEqual(basket.cmd_prune((), 'json', dry_run), 0)
+            records = json.loads(basket.out.stream)
+            self.assertEqual([(record['filename'], record['size'],
+                               record['kept']) for record in records],
+                             [('Foo-1.0.tar.gz', 1, '2.0')])
+            self.assertEqual(os.path.exists(
+                    os.path.join(basket.root, 'Foo-1.0.tar.gz')), dry_run)
+
+    def test_cmd_prune_output_closed(self):
+        import errno
+        import os
+        basket = self._make_records_repository()
+        with open(os.path.join(basket.root, 'Bar-2.0.zip'), 'w') as fp:
+            fp.write('abcd')
+        basket._downloaded_packages = None
+        basket._update_simple_index(())
+
+        class ClosedStream(object):
+            def write(self, data):
+                if '"Foo"' in data:
+                    raise IOError(errno.EPIPE, 'Broken pipe')
+
+        basket.out = ClosedStream()
+        self.assertRaises(IOError, basket.cmd_prune, (), 'ndjson')
+        # Bar 1.0 has been removed before the output was closed.
+        self.assertFalse(os.path.exists(
+                os.path.join(basket.root, 'Bar-1.0.zip')))
+        path = os.path.join(basket.root, 'simple', 'bar', 'index.html')
+        with open(path) as fp:
+            self.assertFalse('Bar-1.0.zip' in fp.read())
+        basket._downloaded_packages = None
+        basket.os = Mock(path=os.path, stat=os.stat)
+        self.assertFalse(basket.downloaded_packages.has('Bar', '1.0'))
+
+    def test_main_list_and_prune_formats(self):
+        from basket.main import Basket
+        from basket.main import main
+        basket = self._make_records_repository()
+        baskets = []
+
+        class RecordsBasket(Basket):
+            root = basket.root
+
+            def __init__(self):
+                Basket.__init__(self)
+                self.out = DummyStream()
+                self.err = DummyStream()
+                baskets.append(self)
+
+        self.assertEqual(main(['basket', 'list', '--format', 'tsv'],
+                              RecordsBasket), 0)
+        self.assertEqual(len(baskets[-1].out.stream.splitlines()), 4)
+        self.assertEqual(main(['basket', 'prune', '--format', 'xml'],
+                              RecordsBasket), 1)
+        self.assertTrue('basket prune [--dry-run]' in baskets[-1].err.stream)
+        self.assertEqual(main(['basket', 'prune', '--dry-run', 'Foo'],
+                              RecordsBasket), 0)
+        self.assertEqual(baskets[-1].out.stream.strip(),
+                         'Would remove Foo 1.0 (keeping 2.0).')
+
+    def test_cmd_prune_updates_manifest(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        for filename in ('Foo-1.0.tar.gz', 'Foo-2.0.tar.gz'):
+            open(os.path.join(basket.root, filename), 'w').close()
+        self.assertEqual(basket.cmd_prune(()), 0)
+        basket._downloaded_packages = None
+        basket.os = Mock(path=os.path, stat=os.stat)
+        self.assertEqual(basket.downloaded_packages,
+                         make_catalog(('Foo', '2.0', 'Foo-2.0.tar.gz')))
+
+    def test_cmd_prune_updates_simple_index(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        for filename in ('Foo-1.0.tar.gz', 'Foo-2.0.tar.gz'):
+            open(os.path.join(basket.root, filename), 'w').close()
+        basket._update_simple_index(())
+        self.assertEqual(basket.cmd_prune(()), 0)
+        path = os.path.join(basket.root, 'simple', 'foo', 'index.html')
+        with open(path) as fp:
+            html = fp.read()
+        self.assertFalse('Foo-1.0.tar.gz' in html)
+        self.assertTrue('Foo-2.0.tar.gz' in html)
+
+    def test_cmd_index(self):
+        import os
+        basket = self._make_repository()
+        basket.out = DummyStream()
+        open(os.path.join(basket.root, 'Foo-1.0.tar.gz'), 'w').close()
+        simple_dir = os.path.join(basket.root, 'simple')
+        os.mkdir(simple_dir)
+        open(os.path.join(simple_dir, 'stale'), 'w').close()
+        self.assertEqual(basket.cmd_index(), 0)
+        self.assertEqual(sorted(os.listdir(simple_dir)),
+                         ['foo', 'index.html'])
+        self.assertEqual(basket.out.stream,
+                         'Simple index has been built: %s%s' % (
+                             simple_dir, os.linesep))
+
     def test_cmd_update_all(self):
         basket = self._make_one()
-        basket._downloaded_packages = [{'name': 'Foo'}, {'name': 'Bar'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'),
+                                                   ('Bar', '1.0'))
+        basket._client = Mock(changelog_last_serial=42)
         basket.cmd_download = lambda args: args
         self.assertEqual(basket.cmd_update(), ['Foo', 'Bar'])
 
+    def _make_updated_repository(self, events):
+        basket = self._make_repository()
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'),
+                                                   ('Bar', '1.0'),
+                                                   ('Baz', '1.0'))
+        basket._client = Mock(changelog_last_serial=42,
+                              changelog_since_serial=events)
+        basket.out = DummyStream()
+        basket.downloaded = []
+        def download(packages):
+            basket.downloaded.append(packages)
+            return 0
+        basket.cmd_download = download
+        return basket
+
+    def test_cmd_update_records_serial(self):
+        basket = self._make_updated_repository([])
+        self.assertEqual(basket._read_serial(), None)
+        self.assertEqual(basket.cmd_update(), 0)
+        self.assertEqual(basket.downloaded, [['Foo', 'Baz', 'Bar']])
+        self.assertEqual(basket._read_serial(), 42)
+
+    def test_cmd_update_uses_changelog(self):
+        events = [['foo', '1.1', 1000, 'new release', 43],
+                  ['Unknown', '1.0', 1001, 'new release', 45],
+                  ['Baz', None, 1002, 'remove project', 44]]
+        basket = self._make_updated_repository(events)
+        basket._write_serial(42)
+        basket.cache.set('search:foo', [], None)
+        basket.cache.set('search:bar', [], None)
+        basket.cache.set('release_urls:foo/1.1', [], None)
+        self.assertEqual(basket.cmd_update(), 0)
+        self.assertEqual(basket._client.called,
+                         [('changelog_since_serial', (42, ), {})])
+        self.assertEqual(basket.downloaded, [['Foo', 'Baz']])
+        self.assertEqual(basket._read_serial(), 45)
+        # Metadata of changed packages has been removed from the cache.
+        self.assertEqual(basket.cache.get('search:foo'), None)
+        self.assertEqual(basket.cache.get('release_urls:foo/1.1'), None)
+        self.assertEqual(basket.cache.get('search:bar'), [])
+
+    def test_cmd_update_nothing_changed(self):
+        import os
+        events = [['Unknown', '1.0', 1001, 'new release', 43]]
+        basket = self._make_updated_repository(events)
+        basket._write_serial(42)
+        self.assertEqual(basket.cmd_update(), 0)
+        self.assertEqual(basket.downloaded, [])
+        self.assertEqual(basket.out.stream,
+                         'No package has changed since the last update.' +
+                         os.linesep)
+        self.assertEqual(basket._read_serial(), 43)
+
+    def test_cmd_update_download_error(self):
+        events = [['foo', '1.1', 1000, 'new release', 43]]
+        basket = self._make_updated_repository(events)
+        basket._write_serial(42)
+        basket.cmd_download = lambda packages: 1
+        self.assertEqual(basket.cmd_update(), 1)
+        # Failed packages are looked at again by the next update.
+        self.assertEqual(basket._read_serial(), 42)
+
+    def test_cmd_update_full(self):
+        basket = self._make_updated_repository([])
+        basket._write_serial(40)
+        self.assertEqual(basket.cmd_update(full=True), 0)
+        self.assertEqual(basket.downloaded, [['Foo', 'Baz', 'Bar']])
+        self.assertEqual(basket._read_serial(), 42)
+
+    def test_cmd_update_changelog_not_supported(self):
+        from basket.compat import xmlrpclib
+        basket = self._make_updated_repository([])
+        basket._write_serial(40)
+        def not_supported(*args):
+            raise xmlrpclib.Fault(1, 'Unknown method.')
+        basket._client = Mock(changelog_last_serial=not_supported,
+                              changelog_since_serial=not_supported)
+        self.assertEqual(basket.cmd_update(), 0)
+        self.assertEqual(basket.downloaded, [['Foo', 'Baz', 'Bar']])
+        self.assertEqual(basket._read_serial(), 40)
+
     def test_cmd_update_specific_packages(self):
         basket = self._make_one()
-        basket._downloaded_packages = [{'name': 'Foo'}, {'name': 'Bar'}]
+        basket._downloaded_packages = make_catalog(('Foo', '1.0'),
+                                                   ('Bar', '1.0'))
         basket.cmd_download = lambda packages: packages
         self.assertEqual(basket.cmd_update(('Foo', )), ('Foo', ))
 
 
+class TestStartup(TestCase):
+
+    # Modules that read-only commands must not import (see
+    # 'benchmarks.run.bench_startup()' for the time it takes).
+    HEAVY_MODULES = ('asyncio', 'basket.aio', 'basket.bundle',
+                     'basket.cache', 'basket.compat', 'basket.http',
+                     'basket.index', 'hashlib', 'http.client', 'httplib',
+                     'sqlite3', 'ssl', 'tarfile', 'xmlrpc.client',
+                     'xmlrpclib', 'zipfile')
+
+    def _get_imported_modules(self, argv):
+        import json
+        import os
+        import shutil
+        import subprocess
+        import sys
+        import tempfile
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        open(os.path.join(root, 'Foo-1.0.tar.gz'), 'w').close()
+        script = ('import json, sys\n'
+                  'from basket.main import main\n'
+                  'main([\'basket\'] + sys.argv[1:])\n'
+                  'sys.stderr.write(json.dumps(sorted(sys.modules)))\n')
+        env = dict(os.environ, BASKET_ROOT=root)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__))))
+        process = subprocess.Popen([sys.executable, '-c', script] + argv,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, env=env)
+        out, err = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(out.decode('utf-8').strip(), 'Foo 1.0')
+        return json.loads(err.decode('utf-8'))
+
+    def test_list_does_not_import_heavy_modules(self):
+        modules = self._get_imported_modules(['list'])
+        self.assertEqual([name for name in self.HEAVY_MODULES
+                          if name in modules], [])
+
+    def test_lazy_module(self):
+        import zipfile
+        from basket.lazy import LazyModule
+        module = LazyModule('zipfile')
+        self.assertTrue(module.ZipFile is zipfile.ZipFile)
+        self.assertEqual(repr(module), "<lazy module 'zipfile'>")
+
+
+def make_catalog(*distributions):
+    """Return a catalog of the given ``(name, version)`` or ``(name,
+    version, filename)`` tuples.
+    """
+    from basket.repository import Catalog
+    catalog = Catalog()
+    for dist in distributions:
+        if len(dist) == 2:
+            dist += ('%s-%s.tar.gz' % dist, )
+        catalog.add(*dist)
+    return catalog
+
+
+class FakeServer(object):
+    """A fake XML-RPC server proxy that counts the number of requests
+    (a multicall request counts as one).
+    """
+
+    def __init__(self, search, release_urls, multicall=True):
+        self._search = search
+        self._release_urls = release_urls
+        self.requests = 0
+        self.system = self
+        self.supports_multicall = multicall
+
+    def search(self, spec):
+        self.requests += 1
+        return self._search(spec)
+
+    def release_urls(self, name, version):
+        self.requests += 1
+        return self._release_urls(name, version)
+
+    def multicall(self, calls):
+        from basket.compat import xmlrpclib
+        self.requests += 1
+        if not self.supports_multicall:
+            raise xmlrpclib.Fault(1, 'Unknown method "system.multicall".')
+        results = []
+        for call in calls:
+            method = {'search': self._search,
+                      'release_urls': self._release_urls}[call['methodName']]
+            try:
+                results.append([method(*call['params'])])
+            except xmlrpclib.Fault as fault:
+                results.append({'faultCode': fault.faultCode,
+                                'faultString': fault.faultString})
+        return results
+
+
+class FakeHttp(object):
+    """A fake connection pool that serves the given ``files`` (a
+    mapping of URLs to bytes). Unknown URLs serve empty files.
+    """
+
+    def __init__(self, files=None, fail_after=None, ranges=True):
+        self.files = files or {}
+        self.fail_after = fail_after
+        self.ranges = ranges
+        self.requested = []
+        self.responses = []
+
+    def open(self, url, headers=None):
+        range_header = (headers or {}).get('Range')
+        self.requested.append((url, range_header))
+        data = self.files.get(url, b'')
+        status = 200
+        if range_header and self.ranges:
+            data = data[int(range_header[6:-1]):]
+            status = 206
+        response = FakeResponse(data, status, self.fail_after)
+        self.responses.append(response)
+        return response
+
+
+class FakeResponse(object):
+
+    def __init__(self, data, status, fail_after=None):
+        import io
+        self.length = len(data)
+        self.status = status
+        self.reads = 0
+        if fail_after is not None:
+            data = data[:fail_after]
+        self.stream = io.BytesIO(data)
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return {'Content-Length': str(self.length)}
+
+    def read(self, size):
+        self.reads += 1
+        return self.stream.read(size)
+
+    def close(self):
+        pass
+
+
 class DummyStream(object):
 
     def __init__(self):
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+
+class TestWriteRecords(TestCase):
+
+    def _write(self, records, fmt):
+        from basket.records import write_records
+        from basket.tests.test_main import DummyStream
+        stream = DummyStream()
+        write_records(stream, iter(records), fmt, ('name', 'size', 'mtime'))
+        return stream.stream
+
+    def test_json(self):
+        import json
+        import os
+        records = [{'name': 'Foo', 'size': 1, 'mtime': 2.5},
+                   {'name': 'Bar', 'size': None, 'mtime': None}]
+        data = self._write(records, 'json')
+        self.assertEqual(json.loads(data), records)
+        self.assertEqual(data.splitlines()[1],
+                         '{"name": "Foo", "size": 1, "mtime": 2.5},')
+        self.assertEqual(self._write([], 'json'), '[]' + os.linesep)
+
+    def test_ndjson(self):
+        import os
+        data = self._write([{'name': 'Foo', 'size': 1}], 'ndjson')
+        self.assertEqual(data, '{"name": "Foo", "size": 1, "mtime": null}' +
+                         os.linesep)
+        self.assertEqual(self._write([], 'ndjson'), '')
+
+    def test_tsv(self):
+        data = self._write([{'name': 'Foo', 'size': 1, 'mtime': 2.5},
+                            {'name': 'Bar'}], 'tsv')
+        self.assertEqual(data.splitlines(),
+                         ['name\tsize\tmtime', 'Foo\t1\t2.5', 'Bar\t\t'])
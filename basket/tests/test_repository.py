@@ -0,0 +1,245 @@
+from unittest import TestCase
+
+
+class TestNormalize(TestCase):
+
+    def test_it(self):
+        from basket.repository import normalize
+        self.assertEqual(normalize('Foo'), 'foo')
+        self.assertEqual(normalize('Foo_Bar'), 'foo-bar')
+        self.assertEqual(normalize('foo.-_bar'), 'foo-bar')
+
+
+class TestGetShard(TestCase):
+
+    def test_it(self):
+        from basket.repository import get_shard
+        self.assertEqual(get_shard('Foo_Bar'), 'f/foo-bar')
+        self.assertEqual(get_shard('3to2'), '3/3to2')
+
+
+class TestListFiles(TestCase):
+
+    def test_it(self):
+        import os
+        import shutil
+        import tempfile
+        from basket.repository import list_files
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with open(os.path.join(tmp_dir, 'Foo-1.0.tar.gz'), 'w') as fp:
+            fp.write('data')
+        open(os.path.join(tmp_dir, '.hidden'), 'w').close()
+        os.mkdir(os.path.join(tmp_dir, 'simple'))
+        stat = os.stat(os.path.join(tmp_dir, 'Foo-1.0.tar.gz'))
+        self.assertEqual(list(list_files(tmp_dir)),
+                         [('Foo-1.0.tar.gz', 4, stat.st_mtime)])
+
+
+class TestManifest(TestCase):
+
+    def _get_path(self):
+        import os
+        import shutil
+        import tempfile
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return os.path.join(tmp_dir, 'manifest.json')
+
+    def test_read_missing_manifest(self):
+        from basket.repository import read_manifest
+        self.assertEqual(read_manifest(self._get_path(), 1.0), None)
+
+    def test_write_and_read(self):
+        from basket.repository import Distribution
+        from basket.repository import read_manifest
+        from basket.repository import write_manifest
+        path = self._get_path()
+        packages = [Distribution('Foo', '1.0', 'Foo-1.0.tar.gz')]
+        write_manifest(path, 1.0, packages)
+        self.assertEqual(read_manifest(path, 1.0), packages)
+
+    def test_read_stale_manifest(self):
+        from basket.repository import Distribution
+        from basket.repository import read_manifest
+        from basket.repository import write_manifest
+        path = self._get_path()
+        packages = [Distribution('Foo', '1.0', 'Foo-1.0.tar.gz')]
+        write_manifest(path, 1.0, packages)
+        self.assertEqual(read_manifest(path, 2.0), None)
+
+
+class TestArchiveIndex(TestCase):
+
+    def _make_one(self):
+        import os
+        import shutil
+        import tempfile
+        from basket.repository import ArchiveIndex
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return ArchiveIndex(os.path.join(tmp_dir, 'requirements.json'))
+
+    def test_get_unknown(self):
+        index = self._make_one()
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 10, 1.0), None)
+
+    def test_set_and_get(self):
+        from basket.repository import ArchiveIndex
+        index = self._make_one()
+        import os
+        index.set('Foo-1.0.tar.gz', 10, 1.0, ['Bar'])
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 10, 1.0), ['Bar'])
+        # The index is only written when it is saved.
+        self.assertFalse(os.path.exists(index.path))
+        index.save()
+        index = ArchiveIndex(index.path)
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 10, 1.0), ['Bar'])
+
+    def test_save_unmodified(self):
+        import os
+        index = self._make_one()
+        index.save()
+        self.assertFalse(os.path.exists(index.path))
+        index.set('Foo-1.0.tar.gz', 10, 1.0, ['Bar'])
+        index.save()
+        os.remove(index.path)
+        index.discard(['Bar-1.0.tar.gz'])
+        index.save()
+        self.assertFalse(os.path.exists(index.path))
+
+    def test_get_modified_archive(self):
+        index = self._make_one()
+        index.set('Foo-1.0.tar.gz', 10, 1.0, ['Bar'])
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 11, 1.0), None)
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 10, 2.0), None)
+
+    def test_discard(self):
+        from basket.repository import ArchiveIndex
+        index = self._make_one()
+        index.set('Foo-1.0.tar.gz', 10, 1.0, ['Bar'])
+        index.save()
+        index.discard(['Foo-1.0.tar.gz', 'Bar-1.0.tar.gz'])
+        index.save()
+        index = ArchiveIndex(index.path)
+        self.assertEqual(index.get('Foo-1.0.tar.gz', 10, 1.0), None)
+
+
+class TestCatalog(TestCase):
+
+    def _make_one(self):
+        from basket.repository import Catalog
+        catalog = Catalog()
+        catalog.add('Foo', '1.0', 'Foo-1.0.tar.gz')
+        catalog.add('Bar', '1.0', 'Bar-1.0.zip')
+        catalog.add('foo', '2.0', 'foo-2.0.tar.gz')
+        return catalog
+
+    def test_iter(self):
+        catalog = self._make_one()
+        self.assertEqual([dist.filename for dist in catalog],
+                         ['Foo-1.0.tar.gz', 'Bar-1.0.zip', 'foo-2.0.tar.gz'])
+        self.assertEqual(len(catalog), 3)
+
+    def test_names(self):
+        catalog = self._make_one()
+        self.assertEqual(sorted(catalog.names()), ['bar', 'foo'])
+
+    def test_get(self):
+        catalog = self._make_one()
+        self.assertEqual([dist.version for dist in catalog.get('FOO')],
+                         ['1.0', '2.0'])
+        self.assertEqual(catalog.get('baz'), [])
+
+    def test_get_normalized_name(self):
+        from basket.repository import Catalog
+        catalog = Catalog()
+        catalog.add('foo_bar', '1.0', 'foo_bar-1.0.tar.gz')
+        catalog.add('Foo-Bar', '2.0', 'Foo-Bar-2.0.tar.gz')
+        self.assertEqual([dist.version for dist in catalog.get('foo.bar')],
+                         ['1.0', '2.0'])
+
+    def test_has(self):
+        catalog = self._make_one()
+        self.assertTrue(catalog.has('Foo', '1.0'))
+        self.assertTrue(catalog.has('foo', '2.0'))
+        self.assertFalse(catalog.has('Foo', '2.0'))
+        self.assertFalse(catalog.has('Baz', '1.0'))
+
+    def test_latest(self):
+        catalog = self._make_one()
+        self.assertEqual(catalog.latest('foo').version, '2.0')
+        self.assertEqual(catalog.latest('baz'), None)
+
+    def test_remove(self):
+        catalog = self._make_one()
+        for dist in catalog.get('bar'):
+            catalog.remove(dist)
+        self.assertEqual(sorted(catalog.names()), ['foo'])
+        self.assertEqual(len(catalog), 2)
+
+    def test_remove_keeps_order(self):
+        from basket.repository import Catalog
+        catalog = Catalog()
+        dists = [catalog.add(name, '1.0', '%s-1.0.tar.gz' % name)
+                 for name in ('Foo', 'Bar', 'Baz')]
+        catalog.remove(dists[1])
+        self.assertEqual(list(catalog), [dists[0], dists[2]])
+        catalog.add('Bar', '1.0', 'Bar-1.0.tar.gz')
+        self.assertEqual(list(catalog), [dists[0], dists[2], dists[1]])
+
+    def test_add_twice(self):
+        from basket.repository import Catalog
+        catalog = Catalog()
+        catalog.add('Foo', '1.0', 'Foo-1.0.tar.gz')
+        catalog.add('Foo', '1.0', 'Foo-1.0.tar.gz')
+        self.assertEqual(len(catalog), 1)
+        self.assertEqual(len(catalog.get('foo')), 1)
+
+
+class TestShardedCatalog(TestCase):
+
+    def _make_one(self):
+        from basket.repository import Distribution
+        from basket.repository import ShardedCatalog
+        shards = {'foo': [Distribution('Foo', '1.0', 'Foo-1.0.tar.gz'),
+                          Distribution('foo', '2.0', 'foo-2.0.tar.gz')],
+                  'bar': [Distribution('Bar', '1.0', 'Bar-1.0.zip')]}
+        self.listed = []
+
+        def list_project(name):
+            self.listed.append(name)
+            return shards.get(name, [])
+
+        return ShardedCatalog(list_project, lambda: sorted(shards))
+
+    def test_lookup_only_lists_one_project(self):
+        catalog = self._make_one()
+        self.assertEqual([dist.version for dist in catalog.get('FOO')],
+                         ['1.0', '2.0'])
+        self.assertTrue(catalog.has('Foo', '1.0'))
+        self.assertEqual(catalog.latest('foo').version, '2.0')
+        self.assertEqual(catalog.get('baz'), [])
+        self.assertEqual(self.listed, ['foo', 'baz'])
+
+    def test_iter(self):
+        catalog = self._make_one()
+        catalog.get('foo')
+        self.assertEqual([dist.filename for dist in catalog],
+                         ['Foo-1.0.tar.gz', 'foo-2.0.tar.gz', 'Bar-1.0.zip'])
+        self.assertEqual(sorted(catalog.names()), ['bar', 'foo'])
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(self.listed, ['foo', 'bar'])
+
+    def test_add_file_already_listed(self):
+        catalog = self._make_one()
+        catalog.add('Foo', '1.0', 'Foo-1.0.tar.gz')
+        catalog.add('Foo', '3.0', 'Foo-3.0.tar.gz')
+        self.assertEqual([dist.version for dist in catalog.get('foo')],
+                         ['1.0', '2.0', '3.0'])
+
+    def test_remove(self):
+        catalog = self._make_one()
+        for dist in catalog.get('bar'):
+            catalog.remove(dist)
+        self.assertEqual(sorted(catalog.names()), ['foo'])
@@ -0,0 +1,118 @@
+import threading
+from unittest import TestCase
+
+
+class TestRepositoryServer(TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+        from basket.server import make_server
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'Foo-1.0.tar.gz'), 'wb') as fp:
+            fp.write(b'data' * 1000)
+        os.mkdir(os.path.join(self.root, 'simple'))
+        os.mkdir(os.path.join(self.root, 'simple', 'foo'))
+        with open(os.path.join(self.root, 'simple', 'foo', 'index.html'),
+                  'w') as fp:
+            fp.write('<a href="../../Foo-1.0.tar.gz">Foo-1.0.tar.gz</a>')
+        os.mkdir(os.path.join(self.root, '.basket-data'))
+        open(os.path.join(self.root, '.basket-data', 'secret'), 'w').close()
+        self.server = make_server(self.root, '127.0.0.1', 0)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        import shutil
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def _request(self, path, headers=None, method='GET'):
+        from basket.compat import httplib
+        connection = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            connection.request(method, path, None, headers or {})
+            response = connection.getresponse()
+            return response.status, response.msg, response.read()
+        finally:
+            connection.close()
+
+    def test_file(self):
+        status, headers, body = self._request('/Foo-1.0.tar.gz')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'data' * 1000)
+        self.assertEqual(headers['Content-Length'], '4000')
+        self.assertTrue(headers['ETag'])
+        self.assertTrue(headers['Last-Modified'])
+
+    def test_file_without_sendfile(self):
+        from basket.server import RepositoryHandler
+        sendfile = RepositoryHandler.sendfile
+        RepositoryHandler.sendfile = None
+        try:
+            status, _, body = self._request('/Foo-1.0.tar.gz')
+        finally:
+            RepositoryHandler.sendfile = sendfile
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'data' * 1000)
+
+    def test_head(self):
+        status, headers, body = self._request('/Foo-1.0.tar.gz',
+                                              method='HEAD')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Length'], '4000')
+        self.assertEqual(body, b'')
+
+    def test_if_none_match(self):
+        _, headers, _ = self._request('/Foo-1.0.tar.gz')
+        status, _, body = self._request(
+            '/Foo-1.0.tar.gz', {'If-None-Match': headers['ETag']})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        status, _, _ = self._request(
+            '/Foo-1.0.tar.gz', {'If-None-Match': '"other"'})
+        self.assertEqual(status, 200)
+
+    def test_if_modified_since(self):
+        _, headers, _ = self._request('/Foo-1.0.tar.gz')
+        status, _, _ = self._request(
+            '/Foo-1.0.tar.gz',
+            {'If-Modified-Since': headers['Last-Modified']})
+        self.assertEqual(status, 304)
+        status, _, _ = self._request(
+            '/Foo-1.0.tar.gz',
+            {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEqual(status, 200)
+
+    def test_simple_index(self):
+        status, _, body = self._request('/simple/foo/')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'Foo-1.0.tar.gz' in body)
+
+    def test_redirect_to_directory(self):
+        status, headers, _ = self._request('/simple/foo')
+        self.assertEqual(status, 301)
+        self.assertEqual(headers['Location'], '/simple/foo/')
+
+    def test_listing(self):
+        status, _, body = self._request('/')
+        self.assertEqual(status, 200)
+        self.assertTrue(b'<a href="Foo-1.0.tar.gz">' in body)
+        self.assertTrue(b'<a href="simple/">' in body)
+        self.assertFalse(b'basket-data' in body)
+
+    def test_hidden_files(self):
+        status, _, _ = self._request('/.basket-data/secret')
+        self.assertEqual(status, 404)
+
+    def test_outside_of_repository(self):
+        status, _, _ = self._request('/../../etc/passwd')
+        self.assertEqual(status, 404)
+        status, _, _ = self._request('/%2E%2E/%2E%2E/etc/passwd')
+        self.assertEqual(status, 404)
+
+    def test_not_found(self):
+        status, _, _ = self._request('/Bar-1.0.tar.gz')
+        self.assertEqual(status, 404)
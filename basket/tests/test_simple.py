@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+
+class TestSimpleIndex(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.simple_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.simple_dir)
+
+    def _read(self, *path):
+        import os
+        with open(os.path.join(self.simple_dir, *path)) as fp:
+            return fp.read()
+
+    def test_write_root_page(self):
+        from basket.simple import write_root_page
+        write_root_page(self.simple_dir, ['foo', 'bar'])
+        html = self._read('index.html')
+        self.assertTrue(html.index('<a href="bar/">bar</a>') <
+                        html.index('<a href="foo/">foo</a>'))
+
+    def test_write_project_page(self):
+        from basket.simple import write_project_page
+        changed = write_project_page(
+            self.simple_dir, 'foo-bar',
+            [('Foo_Bar-1.0.tar.gz', 'abc'), ('foo-bar-2.0.zip', None)])
+        self.assertTrue(changed)
+        html = self._read('foo-bar', 'index.html')
+        self.assertTrue('<title>Links for foo-bar</title>' in html)
+        self.assertTrue('<a href="../../Foo_Bar-1.0.tar.gz#sha256=abc">'
+                        'Foo_Bar-1.0.tar.gz</a>' in html)
+        self.assertTrue('<a href="../../foo-bar-2.0.zip">'
+                        'foo-bar-2.0.zip</a>' in html)
+
+    def test_update_project_page(self):
+        from basket.simple import write_project_page
+        write_project_page(self.simple_dir, 'foo', [('foo-1.0.zip', None)])
+        changed = write_project_page(self.simple_dir, 'foo',
+                                     [('foo-2.0.zip', None)])
+        self.assertFalse(changed)
+        html = self._read('foo', 'index.html')
+        self.assertTrue('foo-2.0.zip' in html)
+        self.assertFalse('foo-1.0.zip' in html)
+
+    def test_remove_project_page(self):
+        import os
+        from basket.simple import write_project_page
+        write_project_page(self.simple_dir, 'foo', [('foo-1.0.zip', None)])
+        self.assertTrue(write_project_page(self.simple_dir, 'foo', []))
+        self.assertFalse(os.path.exists(
+                os.path.join(self.simple_dir, 'foo')))
+        self.assertFalse(write_project_page(self.simple_dir, 'foo', []))
@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+
+class TestNullTracer(TestCase):
+
+    def test_spans_record_nothing(self):
+        from basket.tracing import NULL_TRACER
+        self.assertFalse(NULL_TRACER.enabled)
+        with NULL_TRACER.span('search', 'foo') as span:
+            span.cache = 'hit'
+            span.bytes = 10
+        self.assertFalse(hasattr(span, 'cache'))
+        self.assertTrue(NULL_TRACER.span('other') is span)
+
+
+class TestTracer(TestCase):
+
+    def _make_one(self):
+        from basket.tracing import Tracer
+        tracer = Tracer()
+        for name, package, cache, size in (
+                ('search', 'foo', 'miss', None),
+                ('search', 'bar', 'hit', None),
+                ('download', 'foo', None, 100),
+                ('multicall', None, None, None)):
+            with tracer.span(name, package) as span:
+                span.cache = cache
+                span.bytes = size
+        return tracer
+
+    def test_summary(self):
+        tracer = self._make_one()
+        lines = tracer.summary()
+        self.assertEqual(lines[0].split(),
+                         ['phase', 'count', 'total', 'mean', 'max', 'bytes',
+                          'hits', 'misses'])
+        search = lines[1].split()
+        self.assertEqual(search[0], 'search')
+        self.assertEqual(search[1], '2')
+        self.assertEqual(search[-2:], ['1', '1'])
+        self.assertEqual(lines[2].split()[5], '100')
+        self.assertEqual(lines[3].split()[0], 'multicall')
+        self.assertEqual(lines[5], 'Slowest packages:')
+        self.assertEqual(sorted(line.split()[0] for line in lines[6:]),
+                         ['bar', 'foo'])
+
+    def test_chrome_trace(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+        tracer = self._make_one()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'trace.json')
+        tracer.write_chrome_trace(path)
+        with open(path) as fp:
+            events = json.load(fp)['traceEvents']
+        self.assertEqual([event['name'] for event in events],
+                         ['search', 'search', 'download', 'multicall'])
+        self.assertEqual(events[2]['ph'], 'X')
+        self.assertEqual(events[2]['args'], {'package': 'foo', 'bytes': 100})
+        self.assertEqual(events[3]['args'], {})
+        self.assertTrue(events[0]['ts'] <= events[1]['ts'])
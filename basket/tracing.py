@@ -0,0 +1,162 @@
+"""Timing of the phases of a run (see ``--profile``).
+
+Each phase of the processing of a package (search, release URLs,
+download, requirements, etc.) is recorded as a span with its start
+time, its duration, the number of bytes transferred and whether the
+result came from a cache. At the end of the run, a summary is
+printed and spans may be written as a Chrome trace (that can be
+loaded in ``chrome://tracing`` or https://ui.perfetto.dev).
+
+When profiling is disabled, ``Basket.tracer`` is ``NULL_TRACER``,
+whose spans do nothing at all.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Number of packages listed in the "slowest packages" part of the
+# summary.
+SLOWEST_PACKAGES = 10
+
+
+class Span(object):
+    """A phase of the processing of ``package``. Use it as a context
+    manager, and set ``bytes`` and ``cache`` ('hit' or 'miss') if
+    relevant.
+    """
+
+    __slots__ = ('tracer', 'name', 'package', 'start', 'duration',
+                 'bytes', 'cache', 'thread')
+
+    def __init__(self, tracer, name, package):
+        self.tracer = tracer
+        self.name = name
+        self.package = package
+        self.start = None
+        self.duration = None
+        self.bytes = None
+        self.cache = None
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.current_thread().ident
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = timer() - self.start
+        self.tracer.record(self)
+
+
+class NullSpan(object):
+    """A span that records nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class NullTracer(object):
+
+    enabled = False
+
+    def __init__(self):
+        self._span = NullSpan()
+
+    def span(self, name, package=None):
+        return self._span
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer(object):
+    """Record spans of all threads."""
+
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin = timer()
+
+    def span(self, name, package=None):
+        return Span(self, name, package)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Return the lines of a table with the number of spans, the
+        total, mean and maximum duration, the bytes and the cache hits
+        and misses of each phase, followed by the slowest packages.
+        """
+        phases = collections.OrderedDict()
+        packages = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            stats = phases.setdefault(
+                span.name, {'count': 0, 'total': 0.0, 'max': 0.0,
+                            'bytes': 0, 'hit': 0, 'miss': 0})
+            stats['count'] += 1
+            stats['total'] += span.duration
+            stats['max'] = max(stats['max'], span.duration)
+            stats['bytes'] += span.bytes or 0
+            if span.cache in ('hit', 'miss'):
+                stats[span.cache] += 1
+            if span.package is not None:
+                packages[span.package] = packages.get(span.package, 0.0) + \
+                    span.duration
+        lines = ['%-14s %6s %9s %9s %9s %12s %6s %6s' % (
+                'phase', 'count', 'total', 'mean', 'max', 'bytes', 'hits',
+                'misses')]
+        for name, stats in phases.items():
+            lines.append('%-14s %6d %8.3fs %8.3fs %8.3fs %12d %6d %6d' % (
+                    name, stats['count'], stats['total'],
+                    stats['total'] / stats['count'], stats['max'],
+                    stats['bytes'], stats['hit'], stats['miss']))
+        slowest = sorted(packages.items(), key=lambda item: -item[1])
+        if slowest:
+            lines.append('')
+            lines.append('Slowest packages:')
+            for package, duration in slowest[:SLOWEST_PACKAGES]:
+                lines.append('  %-40s %8.3fs' % (package, duration))
+        return lines
+
+    def to_chrome_trace(self):
+        """Return spans in the Trace Event Format of Chrome (as
+        "complete" events, with durations in microseconds).
+        """
+        pid = os.getpid()
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            args = {}
+            for attr in ('package', 'bytes', 'cache'):
+                if getattr(span, attr) is not None:
+                    args[attr] = getattr(span, attr)
+            events.append({'name': span.name,
+                           'cat': 'basket',
+                           'ph': 'X',
+                           'ts': int((span.start - self._origin) * 1e6),
+                           'dur': int(span.duration * 1e6),
+                           'pid': pid,
+                           'tid': span.thread,
+                           'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.to_chrome_trace(), fp)
@@ -0,0 +1 @@
+"""Benchmarks of Basket (see ``benchmarks.run``)."""
@@ -0,0 +1,149 @@
+"""A stand-in for PyPI: an XML-RPC server with the methods used by
+Basket, that also serves (synthetic) files, with a configurable
+latency for each request.
+"""
+
+import os
+import threading
+import time
+
+try:
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCRequestHandler
+    from xmlrpc.server import SimpleXMLRPCServer
+except ImportError:  # pragma: no cover
+    # Python 2
+    from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+    from SimpleXMLRPCServer import SimpleXMLRPCServer
+    from SocketServer import ThreadingMixIn
+
+from basket.repository import normalize
+
+from benchmarks.fixtures import make_archive
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/pypi', )
+
+    def do_POST(self):
+        self.server.count('xmlrpc')
+        time.sleep(self.server.latency)
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def do_GET(self):
+        self.server.count('files')
+        time.sleep(self.server.latency)
+        path = self.server.pypi.get_file(self.path.split('/')[-1])
+        if path is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+
+    daemon_threads = True
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+class FakePyPI(object):
+    """A fake PyPI that serves ``add()``-ed packages from ``files_dir``,
+    where archives are generated on demand (see ``prepare()``).
+    """
+
+    def __init__(self, files_dir, latency=0):
+        self.files_dir = files_dir
+        self.packages = {}
+        # Packages keyed by file name, so that serving a file does not
+        # depend on the number of packages.
+        self.files = {}
+        self.server = Server(('127.0.0.1', 0), Handler, logRequests=False,
+                             allow_none=True)
+        self.server.pypi = self
+        self.server.latency = latency
+        self.server.lock = threading.Lock()
+        self.server.requests = {}
+        for method in ('search', 'release_urls', 'changelog_last_serial',
+                       'changelog_since_serial'):
+            self.server.register_function(getattr(self, method), method)
+        self.server.register_multicall_functions()
+        host, port = self.server.server_address[:2]
+        self.url = 'http://%s:%d' % (host, port)
+        self.endpoint = self.url + '/pypi'
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def requests(self):
+        """Number of requests received so far, by kind ('xmlrpc' or
+        'files').
+        """
+        return dict(self.server.requests)
+
+    def add(self, name, version, requires=(), extension='.tar.gz'):
+        key = normalize(name)
+        previous = self.packages.get(key)
+        if previous is not None:
+            del self.files[previous[3]]
+        package = (name, version, list(requires),
+                   name + '-' + version + extension)
+        self.packages[key] = package
+        self.files[package[3]] = package
+
+    def prepare(self):
+        """Generate archives of all packages that have been added."""
+        for filename in list(self.files):
+            self.get_file(filename)
+
+    def get_file(self, filename):
+        package = self.files.get(filename)
+        if package is None:
+            return None
+        name, version, requires, _ = package
+        path = os.path.join(self.files_dir, filename)
+        if not os.path.exists(path):
+            make_archive(path, name, version, requires)
+        return path
+
+    def search(self, spec):
+        package = self.packages.get(normalize(spec['name']))
+        if package is None:
+            return []
+        return [{'name': package[0], 'version': package[1]}]
+
+    def release_urls(self, name, version):
+        package = self.packages.get(normalize(name))
+        if package is None or package[1] != version:
+            return []
+        return [{'python_version': 'source', 'packagetype': 'sdist',
+                 'filename': package[3],
+                 'url': '%s/files/%s' % (self.url, package[3])}]
+
+    def changelog_last_serial(self):
+        return 1
+
+    def changelog_since_serial(self, serial):
+        return []
@@ -0,0 +1,98 @@
+"""Synthetic repositories and archives for the benchmarks."""
+
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.zip', '.tar.bz2')
+
+PKG_INFO = '''Metadata-Version: 1.1
+Name: %(name)s
+Version: %(version)s
+Summary: A synthetic package for benchmarks.
+
+'''
+
+# Something to decompress, like the code of a real package.
+MODULE = ''.join('def function_%d(arg):\n    return arg * %d\n\n' % (i, i)
+                 for i in range(300))
+
+
+def package_name(prefix, i):
+    return '%s%05d' % (prefix, i)
+
+
+def get_requirements(prefix, i, count):
+    """Return the requirements of the package ``i`` among ``count``
+    packages: they form a binary tree, whose root is package 0.
+    """
+    return [package_name(prefix, child) for child in (2 * i + 1, 2 * i + 2)
+            if child < count]
+
+
+def make_archive(path, name, version, requires=()):
+    """Write a source distribution at ``path``. The format depends on
+    the extension of ``path``.
+    """
+    base = '%s-%s' % (name, version)
+    members = [
+        ('%s/PKG-INFO' % base, PKG_INFO % {'name': name, 'version': version}),
+        ('%s/%s.egg-info/PKG-INFO' % (base, name),
+         PKG_INFO % {'name': name, 'version': version}),
+        ('%s/%s.egg-info/requires.txt' % (base, name),
+         ''.join('%s\n' % requirement for requirement in requires)),
+        ('%s/setup.py' % base, 'from setuptools import setup\nsetup()\n'),
+        ('%s/%s.py' % (base, name.lower()), MODULE)]
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for member, data in members:
+                archive.writestr(member, data)
+        return
+    mode = path.endswith('.tar.bz2') and 'w:bz2' or 'w:gz'
+    with tarfile.open(path, mode) as archive:
+        for member, data in members:
+            data = data.encode('utf-8')
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def make_repository(root, count, versions=1, prefix='Pkg'):
+    """Create a repository at ``root`` with ``count`` archives: each of
+    the ``count // versions`` packages has ``versions`` versions, in
+    turn in each of ``ARCHIVE_EXTENSIONS``. Return the list of
+    ``(name, version, requirements)`` tuples of the latest versions.
+    """
+    os.makedirs(root)
+    packages = count // versions
+    latest = []
+    for i in range(packages):
+        name = package_name(prefix, i)
+        requires = get_requirements(prefix, i, packages)
+        for j in range(versions):
+            version = '1.%d' % j
+            extension = ARCHIVE_EXTENSIONS[(i + j) % len(ARCHIVE_EXTENSIONS)]
+            make_archive(os.path.join(root, name + '-' + version + extension),
+                         name, version, requires)
+        latest.append((name, version, requires))
+    return latest
+
+
+def clone_tree(source, destination):
+    """Copy the directory ``source`` at ``destination`` with hard
+    links (when possible), which is much faster than copying large
+    repositories.
+    """
+    for dirpath, _, filenames in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(dirpath, source))
+        os.makedirs(target)
+        for filename in filenames:
+            src = os.path.join(dirpath, filename)
+            dst = os.path.join(target, filename)
+            try:
+                os.link(src, dst)
+            except (AttributeError, OSError):
+                shutil.copy2(src, dst)
@@ -0,0 +1,348 @@
+"""Run the benchmarks of Basket and save the results as JSON, or
+compare two result files::
+
+    python -m benchmarks.run [--sizes 1000,10000] [--latency 0.01]
+                             [--repeat 3] [--jobs 1] [--engine threads]
+                             [--only list,prune]
+                             [--work-dir DIR] [--output results.json]
+    python -m benchmarks.run --compare old.json new.json [--threshold 1.2]
+
+Benchmarks run in-process on synthetic repositories (see
+``benchmarks.fixtures``) and against a fake PyPI (see
+``benchmarks.fakepypi``). Repositories are generated once per size in
+the work directory (a temporary directory by default, which is
+removed at the end) and copied with hard links when a benchmark
+modifies them.
+
+When comparing, the best run of each benchmark is used and the exit
+status is 1 if any benchmark is slower than ``threshold`` times its
+previous result.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import basket
+from basket.main import Basket
+
+from benchmarks.fakepypi import FakePyPI
+from benchmarks.fixtures import clone_tree
+from benchmarks.fixtures import get_requirements
+from benchmarks.fixtures import make_repository
+from benchmarks.fixtures import package_name
+
+
+RESULTS_FORMAT = 1
+# The directory of the 'basket' package, so that benchmarks that start
+# a new process run the same version of Basket.
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(basket.__file__)))
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class NullStream(object):
+
+    def write(self, data):
+        pass
+
+
+class Context(object):
+    """Shared state of a run: the work directory, the fake PyPI and
+    the synthetic repositories.
+    """
+
+    def __init__(self, work_dir, pypi, jobs=1, max_downloads=200,
+                 engine='threads'):
+        self.work_dir = work_dir
+        self.pypi = pypi
+        self.jobs = jobs
+        self.engine = engine
+        self.max_downloads = max_downloads
+        self._baskets = []
+        self._runs = 0
+
+    def repository(self, size, versions=1):
+        """Return the path of a synthetic repository of ``size``
+        archives. It must not be modified (see ``copy()``).
+        """
+        path = os.path.join(self.work_dir, 'repo-%d-%d' % (size, versions))
+        if not os.path.exists(path):
+            for name, version, requires in make_repository(path, size,
+                                                           versions):
+                self.pypi.add(name, version, requires)
+        return path
+
+    def copy(self, size, versions=1):
+        """Return the path of a copy of a synthetic repository."""
+        return self.new_root(self.repository(size, versions))
+
+    def new_root(self, source=None):
+        self._runs += 1
+        path = os.path.join(self.work_dir, 'run-%d' % self._runs)
+        if source is None:
+            os.makedirs(path)
+        else:
+            clone_tree(source, path)
+        return path
+
+    def basket(self, root):
+        basket = Basket()
+        basket.root = root
+        basket.endpoint = self.pypi.endpoint
+        basket.index_url = None
+        basket.jobs = self.jobs
+        basket.engine = self.engine
+        basket.out = basket.err = NullStream()
+        self._baskets.append(basket)
+        return basket
+
+    def cleanup(self):
+        for basket in self._baskets:
+            if getattr(basket, '_cache', None) is not None:
+                basket._cache.close()
+        self._baskets = []
+        for name in os.listdir(self.work_dir):
+            if name.startswith('run-'):
+                shutil.rmtree(os.path.join(self.work_dir, name))
+
+
+def _remove_state(root, filename):
+    path = os.path.join(root, '.basket-data', filename)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Each benchmark prepares a run (which is not timed) and returns the
+# function to time.
+
+def bench_list_cold(context, size):
+    """``list`` without a manifest: the directory is listed."""
+    root = context.repository(size)
+    _remove_state(root, 'manifest.json')
+    return context.basket(root).cmd_list
+
+
+def bench_list_warm(context, size):
+    """``list`` with a fresh manifest."""
+    root = context.repository(size)
+    context.basket(root).cmd_list()
+    return context.basket(root).cmd_list
+
+
+def bench_startup(context, size):
+    """``basket list`` in a new Python process, with a fresh
+    manifest: mostly the time needed to start Python and import Basket.
+    """
+    root = context.repository(size)
+    context.basket(root).cmd_list()
+    env = dict(os.environ, BASKET_ROOT=root)
+    paths = [path for path in env.get('PYTHONPATH', '').split(os.pathsep)
+             if path]
+    env['PYTHONPATH'] = os.pathsep.join([SOURCE_DIR] + paths)
+    command = [sys.executable, '-m', 'basket.main', 'list']
+
+    def start():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, env=env, stdout=devnull)
+
+    return start
+
+
+def bench_prune(context, size):
+    """``prune`` of a repository with two versions of each package."""
+    root = context.copy(size, versions=2)
+    basket = context.basket(root)
+    basket.downloaded_packages  # write the manifest
+    return basket.cmd_prune
+
+
+def bench_scan(context, size):
+    """Requirement scanning of all archives (without the index)."""
+    root = context.repository(size)
+    basket = context.basket(root)
+    paths = [os.path.join(root, filename)
+             for filename in sorted(os.listdir(root))
+             if not filename.startswith('.')]
+
+    def scan():
+        for path in paths:
+            basket._scan_requirements(path)
+
+    return scan
+
+
+def bench_update(context, size):
+    """``update --full`` of an up-to-date repository, with a cold
+    metadata cache.
+    """
+    root = context.copy(size)
+    basket = context.basket(root)
+    basket.downloaded_packages  # write the manifest
+    return lambda: basket.cmd_update(full=True)
+
+
+def bench_download(context, size):
+    """``download`` of a package that requires (directly or not)
+    ``min(size, max_downloads)`` packages, into an empty repository.
+    """
+    count = min(size, context.max_downloads)
+    for i in range(count):
+        context.pypi.add(package_name('Dl', i), '1.0',
+                         get_requirements('Dl', i, count))
+    context.pypi.prepare()
+    basket = context.basket(context.new_root())
+    return lambda: basket.cmd_download([package_name('Dl', 0)])
+
+
+BENCHMARKS = (
+    ('list-cold', bench_list_cold),
+    ('list-warm', bench_list_warm),
+    ('startup', bench_startup),
+    ('prune', bench_prune),
+    ('scan', bench_scan),
+    ('update', bench_update),
+    ('download', bench_download),
+    )
+
+
+def measure(context, benchmark, size, repeat):
+    """Run ``benchmark`` ``repeat`` times and return its results."""
+    runs = []
+    requests = {}
+    try:
+        for _ in range(repeat):
+            func = benchmark(context, size)
+            before = context.pypi.requests
+            start = timer()
+            func()
+            runs.append(timer() - start)
+            for kind, count in context.pypi.requests.items():
+                requests[kind] = count - before.get(kind, 0)
+            context.cleanup()
+    finally:
+        context.cleanup()
+    result = {'min': min(runs),
+              'median': sorted(runs)[len(runs) // 2],
+              'runs': runs}
+    if requests:
+        result['requests'] = requests
+    return result
+
+
+def run(sizes, latency=0, repeat=3, jobs=1, only=None, work_dir=None,
+        max_downloads=200, out=sys.stdout, engine='threads'):
+    """Run the benchmarks (all of them, or those whose names are in
+    ``only``) for each size of repository and return the results.
+    """
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='basket-bench-')
+    elif not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    files_dir = os.path.join(work_dir, 'files')
+    if not os.path.exists(files_dir):
+        os.mkdir(files_dir)
+    pypi = FakePyPI(files_dir, latency)
+    pypi.start()
+    context = Context(work_dir, pypi, jobs, max_downloads, engine)
+    results = {}
+    try:
+        for size in sizes:
+            for name, benchmark in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                result = measure(context, benchmark, size, repeat)
+                results.setdefault(name, {})[str(size)] = result
+                out.write('%-10s %8d %10.3fs%s' % (
+                        name, size, result['min'], os.linesep))
+    finally:
+        pypi.stop()
+        if remove_work_dir:
+            shutil.rmtree(work_dir)
+    return {'format': RESULTS_FORMAT,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'parameters': {'sizes': list(sizes), 'latency': latency,
+                           'repeat': repeat, 'jobs': jobs,
+                           'engine': engine,
+                           'max_downloads': max_downloads},
+            'results': results}
+
+
+def compare(old, new, threshold=1.2, out=sys.stdout):
+    """Print the best runs of ``new`` results next to those of ``old``
+    and return the number of benchmarks that are slower than
+    ``threshold`` times their old result.
+    """
+    regressions = 0
+    out.write('%-10s %8s %10s %10s %7s%s' % (
+            'benchmark', 'size', 'old', 'new', 'ratio', os.linesep))
+    for name in sorted(new['results']):
+        for size in sorted(new['results'][name], key=int):
+            before = old['results'].get(name, {}).get(size)
+            if before is None:
+                continue
+            before = before['min']
+            after = new['results'][name][size]['min']
+            if before:
+                ratio = after / before
+            else:
+                ratio = float('inf')
+            flag = ''
+            if ratio > threshold:
+                regressions += 1
+                flag = '  regression'
+            out.write('%-10s %8s %9.3fs %9.3fs %6.2fx%s%s' % (
+                    name, size, before, after, ratio, flag, os.linesep))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the benchmarks of Basket.')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma-separated numbers of archives of the '
+                        'synthetic repositories (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency (in seconds) of each request to the '
+                        'fake PyPI (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='value of "--jobs" for "update" and "download"')
+    parser.add_argument('--engine', default='threads',
+                        choices=('threads', 'asyncio', 'pipeline'),
+                        help='value of "--engine" for "update" and "download"')
+    parser.add_argument('--max-downloads', type=int, default=200)
+    parser.add_argument('--only', default='',
+                        help='comma-separated names of benchmarks to run '
+                        '(%s)' % ', '.join(name for name, _ in BENCHMARKS))
+    parser.add_argument('--work-dir')
+    parser.add_argument('--output', help='write results in this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+    if args.compare:
+        results = []
+        for path in args.compare:
+            with open(path) as fp:
+                results.append(json.load(fp))
+        return compare(results[0], results[1], args.threshold) and 1 or 0
+    sizes = [int(size) for size in args.sizes.split(',')]
+    only = [name for name in args.only.split(',') if name]
+    results = run(sizes, args.latency, args.repeat, args.jobs, only,
+                  args.work_dir, args.max_downloads, engine=args.engine)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,7 +28,7 @@ setup(name='Basket',
       author_email='damien.baty.remove@gmail.com',
       url='http://packages.python.org/Basket',
       keywords='eggs easy_install pip package static repository pypi',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       include_package_data=True,
       zip_safe=False,
       install_requires=REQUIRES,